@@ -0,0 +1,529 @@
+import os
+import re
+import bz2
+import gzip
+import json
+import time
+import logging
+import bisect
+import heapq
+import random
+import datetime
+import threading
+from array import array
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# file extension for each codec
+CODECS = {
+    'bz2': '.bz2',
+    'gzip': '.gz',
+    'zstd': '.zst',
+    'none': '',
+    }
+
+
+# tweet ids are snowflakes, milliseconds since this epoch << 22
+TWITTER_EPOCH_MS = 1288834974657
+# "created_at" is the first key of a status, the id follows
+# (json writes a space after the separators, orjson does not)
+ID_PATTERN = re.compile(r'^\{"created_at": ?"[^"]*", ?"id": ?(\d+)')
+# fields every archived tweet keeps: date and id for the indexes
+# and de-duplication, the entities for reads by keyword
+REQUIRED_FIELDS = ['created_at', 'id', 'entities.symbols.text', 'entities.hashtags.text']
+
+
+def tweet_time(tweet_id):
+    '''
+    Unix time of a tweet from its id.
+    '''
+    return ((int(tweet_id) >> 22) + TWITTER_EPOCH_MS) / 1000
+
+
+def time_to_id(unix_time):
+    '''
+    Smallest tweet id which could be created at unix_time.
+    '''
+    return max(int(unix_time*1000) - TWITTER_EPOCH_MS, 0) << 22
+
+
+def archive_files(output_dir, days=None):
+    '''
+    Tweets files in the output_dir, oldest first.
+    Only the files of the last days if days is given.
+    '''
+    pattern = re.compile(r'^tweets_(\d{8})(?:_backfill|_shard\d+|_merged)?(?:_\d+)?\.json(?:%s)?$' %
+                         '|'.join([re.escape(i) for i in CODECS.values() if i]))
+    first_day = None
+    if days is not None:
+        first_day = (datetime.date.today() - datetime.timedelta(days=days)).strftime('%Y%m%d')
+    files = []
+    for file_name in sorted(os.listdir(output_dir)):
+        m = pattern.match(file_name)
+        if m and (first_day is None or m.group(1) >= first_day):
+            files.append(os.path.join(output_dir, file_name))
+    return files
+
+
+def open_archive(file_name):
+    '''
+    Open a tweets file of any codec for reading lines of text.
+    Reads across all concatenated streams.
+    '''
+    if file_name.endswith('.bz2'):
+        return bz2.open(file_name, 'rt', encoding='utf-8')
+    if file_name.endswith('.gz'):
+        return gzip.open(file_name, 'rt', encoding='utf-8')
+    if file_name.endswith('.zst'):
+        if zstandard is None:
+            raise ValueError('zstd codec needs the zstandard package')
+        import io
+        reader = zstandard.ZstdDecompressor().stream_reader(
+            open(file_name, 'rb'), read_across_frames=True, closefd=True)
+        return io.TextIOWrapper(reader, encoding='utf-8')
+    return open(file_name, 'rt', encoding='utf-8')
+
+
+def read_ids(file_name):
+    '''
+    Yield ids of all tweets in a tweets file. A last line
+    the writer is still appending is left out.
+    '''
+    with open_archive(file_name) as f:
+        for line in f:
+            m = ID_PATTERN.match(line)
+            if m and line.endswith('\n'):
+                yield int(m.group(1))
+            elif line.strip():
+                try:
+                    tweet_id = json.loads(line)['id']
+                except ValueError:
+                    # only the last line can be written in part
+                    if line.endswith('\n'):
+                        raise
+                    logging.warning('Skipped a partly written line at the end of ' + file_name)
+                    continue
+                yield tweet_id
+
+
+def tweet_keywords(tweet):
+    '''
+    Cashtags and hashtags of a tweet, lowercase with $ and #.
+    '''
+    entities = tweet.get('entities', {})
+    keywords = set(['$' + i['text'].lower() for i in entities.get('symbols', [])])
+    keywords.update(['#' + i['text'].lower() for i in entities.get('hashtags', [])])
+    return keywords
+
+
+def load_fields(fields_file):
+    '''
+    JSON paths from a file, one per line, # starts a comment.
+    '''
+    with open(fields_file) as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+
+def compile_fields(paths):
+    '''
+    Projection tree of JSON paths, ex.: user.screen_name or
+    entities.symbols[].text, lists are projected item by item.
+    The required fields are always kept, first as in a full tweet.
+    '''
+    tree = {}
+    for path in REQUIRED_FIELDS + list(paths):
+        keys = path.replace('[]', '').split('.')
+        node = tree
+        for key in keys[:-1]:
+            if node.get(key, {}) is None:
+                # the whole parent is kept
+                break
+            node = node.setdefault(key, {})
+        else:
+            node[keys[-1]] = None
+    return tree
+
+
+def project(value, tree):
+    '''
+    Keep only the fields of a projection tree.
+    '''
+    if isinstance(value, list):
+        return [project(i, tree) for i in value]
+    if not isinstance(value, dict):
+        return value
+    out = {}
+    for key, sub in tree.items():
+        if key in value:
+            out[key] = value[key] if sub is None else project(value[key], sub)
+    return out
+
+
+def dumps_lines(tweets):
+    '''
+    Tweets as json lines in one bytes string, with orjson if installed.
+    '''
+    if orjson is not None:
+        return b''.join([orjson.dumps(t, option=orjson.OPT_APPEND_NEWLINE) for t in tweets])
+    return ''.join([json.dumps(t) + '\n' for t in tweets]).encode('utf-8')
+
+
+def index_name(file_name):
+    '''
+    Sidecar index of a tweets file.
+    '''
+    return file_name + '.idx'
+
+
+def write_index_entry(file_name, entry):
+    '''
+    Append the entry of one stream to the sidecar index.
+    The index has a json line per stream:
+        offset, length - position of the stream in the file
+        count          - number of tweets
+        min_id, max_id - range of tweet ids, the ids hold the dates
+        keywords       - cashtags and hashtags in the stream
+        compacted      - 1 for streams written by the compact subcommand
+    '''
+    with open(index_name(file_name), 'a') as f:
+        f.write(json.dumps(entry) + '\n')
+
+
+def compress(data, codec):
+    '''
+    Compress bytes into one complete stream of the codec.
+    Streams can be concatenated and still read as one file.
+    '''
+    if codec == 'bz2':
+        return bz2.compress(data)
+    if codec == 'gzip':
+        return gzip.compress(data)
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor().compress(data)
+    return data
+
+
+def merge_files(file_names, out_name, codec='bz2', stream_bytes=8*1024**2):
+    '''
+    Merge tweets files into one, each tweet once, in compressed
+    streams of about stream_bytes with a sidecar index. Written
+    under a temporary name and renamed when complete.
+    Returns the number of tweets written.
+    '''
+    tmp_name = out_name + '.tmp'
+    if os.path.exists(index_name(tmp_name)):
+        os.remove(index_name(tmp_name))
+    seen = set()
+    count = 0
+    with open(tmp_name, 'wb') as out:
+        lines, size, ids, keywords = [], 0, [], set()
+        for file_name in file_names:
+            with open_archive(file_name) as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    tweet = json.loads(line)
+                    if tweet['id'] in seen:
+                        continue
+                    seen.add(tweet['id'])
+                    data = line.encode('utf-8')
+                    lines.append(data if data.endswith(b'\n') else data + b'\n')
+                    size += len(data)
+                    ids.append(tweet['id'])
+                    keywords.update(tweet_keywords(tweet))
+                    if size >= stream_bytes:
+                        count += _write_stream(out, tmp_name, lines, ids, keywords, codec)
+                        lines, size, ids, keywords = [], 0, [], set()
+        if lines:
+            count += _write_stream(out, tmp_name, lines, ids, keywords, codec)
+    if count:
+        os.replace(index_name(tmp_name), index_name(out_name))
+    os.replace(tmp_name, out_name)
+    return count
+
+
+def _write_stream(out, file_name, lines, ids, keywords, codec, extra=None):
+    data = compress(b''.join(lines), codec)
+    offset = out.tell()
+    out.write(data)
+    entry = {
+        'offset': offset,
+        'length': len(data),
+        'count': len(lines),
+        'min_id': min(ids),
+        'max_id': max(ids),
+        'keywords': sorted(keywords),
+        }
+    entry.update(extra or {})
+    write_index_entry(file_name, entry)
+    return len(lines)
+
+
+class SeenIndex(object):
+    '''
+    Ids of archived tweets, so each tweet is archived only once.
+
+    Ids are kept in a sorted array of int64 plus a set of ids added
+    since the last merge. Tweet ids older than horizon_days are
+    evicted, the search API does not return them anyway. At most
+    max_ids ids are kept, the oldest are evicted first.
+    '''
+
+    def __init__(self, horizon_days=8, max_ids=50*10**6, merge_size=10**5):
+        self.horizon = horizon_days*24*3600
+        self.max_ids = max_ids
+        self.merge_size = merge_size
+        self.ids = array('q')
+        self.recent = set()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.ids) + len(self.recent)
+
+    def __contains__(self, tweet_id):
+        if tweet_id in self.recent:
+            return True
+        i = bisect.bisect_left(self.ids, tweet_id)
+        return i < len(self.ids) and self.ids[i] == tweet_id
+
+    def add(self, tweet_id):
+        '''
+        Add an id, returns False if it was already seen.
+        '''
+        if tweet_id in self:
+            self.hits += 1
+            return False
+        self.misses += 1
+        self.recent.add(tweet_id)
+        if self._merge_due():
+            self.merge()
+        return True
+
+    def _merge_due(self):
+        # merging is linear in the array size, merge less
+        # often as it grows to keep adding cheap
+        return len(self.recent) >= max(self.merge_size, len(self.ids) // 4)
+
+    def merge(self):
+        '''
+        Merge recent ids into the sorted array and evict old ids.
+        '''
+        merged = array('q', heapq.merge(self.ids, sorted(self.recent)))
+        self.recent = set()
+        start = bisect.bisect_left(merged, time_to_id(time.time() - self.horizon))
+        start = max(start, len(merged) - self.max_ids)
+        if start > 0:
+            logging.debug('Evicted {:d} tweet ids'.format(start))
+            merged = merged[start:]
+        self.ids = merged
+
+    def rebuild(self, output_dir):
+        '''
+        Load ids from the tweets files within the horizon.
+        '''
+        if not os.path.exists(output_dir):
+            return
+        days = int(self.horizon / (24*3600)) + 1
+        for file_name in archive_files(output_dir, days=days):
+            logging.debug('Loading tweet ids: ' + file_name)
+            try:
+                for tweet_id in read_ids(file_name):
+                    self.recent.add(tweet_id)
+                    if self._merge_due():
+                        self.merge()
+            except (EOFError, OSError, ValueError) as e:
+                # partly written stream at the end of a file, or a
+                # broken line, the ids before it are loaded
+                logging.warning('Could not read all of ' + file_name)
+                logging.warning(str(e))
+        self.merge()
+        logging.info('Tweet ids loaded: {:d}'.format(len(self)))
+
+    def pop_stats(self):
+        '''
+        Hits and misses since the last call.
+        '''
+        stats = self.hits, self.misses
+        self.hits, self.misses = 0, 0
+        return stats
+
+
+class ArchiveWriter(object):
+    '''
+    Long lived writer for the daily tweets files.
+
+    Tweets are serialized into a buffer and written as one compressed
+    stream when the buffer reaches flush_bytes or flush_interval
+    seconds have passed since the last flush. Files rotate at midnight
+    and when they grow over rotate_mb:
+        tweets_20171101.json.bz2, tweets_20171101_01.json.bz2, ...
+    A name suffix keeps the files of another process apart, ex.:
+        tweets_20171101_backfill.json.bz2
+    With a SeenIndex, tweets archived before are skipped.
+    With fields (see compile_fields) only those fields of the tweets
+    are archived, a raw writer gets the full tweet of a raw_sample
+    share of them.
+    Every stream gets an entry in the sidecar index of the file,
+    see write_index_entry.
+    '''
+
+    def __init__(self, output_dir='tweets', codec='bz2', flush_bytes=8*1024**2,
+                 flush_interval=300, rotate_mb=None, seen=None, suffix='',
+                 fields=None, raw=None, raw_sample=0.0):
+        if codec not in CODECS:
+            raise ValueError('Unknown codec: ' + codec)
+        if codec == 'zstd' and zstandard is None:
+            raise ValueError('zstd codec needs the zstandard package')
+        self.output_dir = output_dir
+        self.codec = codec
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.rotate_bytes = rotate_mb*1024**2 if rotate_mb else None
+        # SeenIndex to skip already archived tweets
+        self.seen = seen
+        self.suffix = suffix
+        self.fields = fields
+        self.raw = raw
+        self.raw_sample = raw_sample
+
+        self.lock = threading.Lock()
+        self._clear_buffer()
+        self.last_flush = time.time()
+        self.file = None
+        self.file_name = None
+        self.file_day = None
+        self.buffer_day = None
+        self.closed = False
+        # tweets and compressed bytes written
+        self.tweets_written = 0
+        self.bytes_written = 0
+        os.makedirs(output_dir, exist_ok=True)
+
+    def write(self, tweets):
+        '''
+        Buffer tweets, flush when a threshold is reached.
+        '''
+        with self.lock:
+            if self.closed:
+                raise ValueError('write to a closed ArchiveWriter')
+            # tweets belong to the day they were written,
+            # flush the previous day before adding new ones
+            day = time.strftime('%Y%m%d')
+            if self.buffer_day != day:
+                self._flush()
+                self.buffer_day = day
+            kept = []
+            for tweet in tweets:
+                if self.seen is not None and not self.seen.add(tweet['id']):
+                    continue
+                kept.append(tweet)
+                self.buffer_ids.append(tweet['id'])
+                self.buffer_keywords.update(tweet_keywords(tweet))
+            if self.raw is not None:
+                sample = [t for t in kept if random.random() < self.raw_sample]
+                if sample:
+                    self.raw.write(sample)
+            if self.fields is not None:
+                kept = [project(t, self.fields) for t in kept]
+            # one string per page
+            if kept:
+                data = dumps_lines(kept)
+                self.buffer.append(data)
+                self.buffer_size += len(data)
+            if self.buffer_size >= self.flush_bytes or \
+                    time.time() - self.last_flush >= self.flush_interval:
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+        if self.raw is not None:
+            self.raw.flush()
+
+    def close(self):
+        if self.raw is not None:
+            self.raw.close()
+        with self.lock:
+            if self.closed:
+                return
+            self._flush()
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            self.closed = True
+            logging.debug('Archive closed')
+
+    def _flush(self):
+        self.last_flush = time.time()
+        if self.buffer_size == 0:
+            return
+        self._open(self.buffer_day)
+        data = compress(b''.join(self.buffer), self.codec)
+        offset = self.file.tell()
+        self.file.write(data)
+        self.file.flush()
+        self.tweets_written += len(self.buffer_ids)
+        self.bytes_written += len(data)
+        write_index_entry(self.file_name, {
+            'offset': offset,
+            'length': len(data),
+            'count': len(self.buffer_ids),
+            'min_id': min(self.buffer_ids),
+            'max_id': max(self.buffer_ids),
+            'keywords': sorted(self.buffer_keywords),
+            })
+        self._clear_buffer()
+
+    def _clear_buffer(self):
+        self.buffer = []
+        self.buffer_size = 0
+        self.buffer_ids = []
+        self.buffer_keywords = set()
+
+    def _open(self, day):
+        '''
+        Keep the file of the day open, rotate on a new
+        day or when the file is over the size limit.
+        '''
+        if self.file is not None and day == self.file_day and \
+                (self.rotate_bytes is None or self.file.tell() < self.rotate_bytes):
+            return
+        if self.file is not None:
+            self.file.close()
+            logging.debug('Rotated archive: ' + self.file_name)
+        self.file_name = self._file_name(day)
+        self.file_day = day
+        self.file = open(self.file_name, 'ab')
+
+    def _file_name(self, day):
+        '''
+        Latest file of the day which is still under the size limit.
+        '''
+        ext = '.json' + CODECS[self.codec]
+        pattern = re.compile(r'^tweets_%s%s(?:_(\d+))?%s$' % (day, re.escape(self.suffix), re.escape(ext)))
+        parts = [m.group(1) for m in map(pattern.match, os.listdir(self.output_dir)) if m]
+        part = max([int(i) if i else 0 for i in parts]) if parts else 0
+
+        while True:
+            suffix = '_{:02d}'.format(part) if part else ''
+            full_name = os.path.join(self.output_dir, 'tweets_' + day + self.suffix + suffix + ext)
+            if self.rotate_bytes is None or not os.path.exists(full_name) or \
+                    os.path.getsize(full_name) < self.rotate_bytes:
+                return full_name
+            part += 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
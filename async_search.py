@@ -0,0 +1,226 @@
+import time
+import asyncio
+import logging
+from urllib.parse import parse_qsl
+
+# imported by load_aiohttp(), only the async mode needs it
+aiohttp = None
+
+import oauth
+import metrics
+
+
+API_URL = 'https://api.twitter.com/1.1/'
+SEARCH_PATH = 'search/tweets.json'
+# tweets per page, a full page has more after it
+PAGE_COUNT = 100
+# extra sec to be on the safe side when waiting for the limit reset
+RESET_MARGIN = 10
+
+
+def load_aiohttp():
+    '''
+    Import aiohttp on first use, False if it is not installed.
+    '''
+    global aiohttp
+    if aiohttp is None:
+        try:
+            import aiohttp
+        except ImportError:
+            return False
+    return True
+
+
+class SearchError(Exception):
+    '''
+    Search endpoint answered with an error.
+    '''
+    def __init__(self, status, message):
+        self.status = status
+        super(SearchError, self).__init__('Error %s: %s' % (status, message))
+
+
+class AsyncSearchClient(object):
+    '''
+    asyncio client for the search endpoint with one pooled
+    keep-alive session per credential set.
+
+    The rate limit is tracked from the x-rate-limit-* headers.
+    Requests are reserved from the remaining budget before they
+    are sent, so several paginations can be in flight without
+    going over it, and wait for the window reset when it is spent.
+
+        async with AsyncSearchClient(keys) as client:
+            async for tweets in client.search('$AAPL', since_id=...):
+                ...
+    '''
+
+    def __init__(self, keys, base_url=API_URL, max_connections=8, timeout=30):
+        if not load_aiohttp():
+            raise ValueError('async client needs the aiohttp package')
+        self.keys = keys
+        self.base_url = base_url
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.session = None
+        self.lock = None
+        # rate limit state, unknown until the first response
+        self.remaining = None
+        self.reset = None
+        self.queries = 0
+        self.tweets = 0
+        self.windows = 1
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=60)
+        self.session = aiohttp.ClientSession(
+            connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+        self.lock = asyncio.Lock()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.session.close()
+
+    async def _reserve(self):
+        '''
+        Take one request from the budget, wait for
+        the next window if it is spent.
+        '''
+        async with self.lock:
+            if self.remaining is not None and self.remaining <= 0:
+                wait = max((self.reset or time.time()+15*60) + RESET_MARGIN - time.time(), 0)
+                logging.debug('Rate limit, sleeping {:.0f} sec'.format(wait))
+                with metrics.timer('sleep'):
+                    await asyncio.sleep(wait)
+                self.remaining = None
+                self.windows += 1
+            if self.remaining is not None:
+                self.remaining -= 1
+
+    def _update_limit(self, headers):
+        if 'x-rate-limit-remaining' in headers:
+            remaining = int(headers['x-rate-limit-remaining'])
+            # requests reserved but not answered yet
+            # are already taken off self.remaining
+            if self.remaining is None or remaining < self.remaining:
+                self.remaining = remaining
+        if 'x-rate-limit-reset' in headers:
+            self.reset = int(headers['x-rate-limit-reset'])
+
+    async def get(self, path, params):
+        '''
+        Signed GET request, returns the decoded json.
+        '''
+        while True:
+            await self._reserve()
+            url = self.base_url + path
+            headers = {'Authorization': oauth.oauth_header('GET', url, params, self.keys)}
+            with metrics.timer('request'):
+                async with self.session.get(url, params=params, headers=headers) as response:
+                    self.queries += 1
+                    self._update_limit(response.headers)
+                    if response.status == 429:
+                        # over the limit anyway, wait for the reset and retry
+                        self.remaining = 0
+                        continue
+                    if response.status != 200:
+                        raise SearchError(response.status, await response.text())
+                    return await response.json()
+
+    async def search(self, query, since_id=None, max_id=None, max_pages=None):
+        '''
+        Yield pages of tweets for a query, following next_results.
+        '''
+        params = {
+            'q': query,
+            'result_type': 'recent',
+            'include_entities': 'true',
+            'count': str(PAGE_COUNT),
+            }
+        if since_id:
+            params['since_id'] = str(since_id)
+        if max_id:
+            params['max_id'] = str(max_id)
+
+        pages = 0
+        while params is not None:
+            response = await self.get(SEARCH_PATH, params)
+            tweets = response.get('statuses', [])
+            self.tweets += len(tweets)
+            pages += 1
+            yield tweets
+
+            next_results = response.get('search_metadata', {}).get('next_results')
+            if not next_results or (max_pages and pages >= max_pages):
+                params = None
+            else:
+                params = dict(parse_qsl(next_results.lstrip('?')))
+
+    def get_statistics(self):
+        '''
+        Queries and tweets, as TwitterSearch.get_statistics
+        '''
+        return self.queries, self.tweets
+
+
+async def search_keywords(keys_list, keywords, since_ids, on_page, on_done,
+                          base_url=API_URL, concurrency=4, max_ids=None,
+                          max_pages=None, gaps=None):
+    '''
+    Search keywords with one client per credential set and
+    concurrency paginations in flight per client.
+    max_ids resumes paginations of some keywords at that max_id.
+    A keyword gets at most max_pages, its gaps, keyword -> [row]
+    searched from row['cursor'] down to row['since_id'], get the
+    pages left after the new tweets.
+    on_page(keyword, tweets, gap) is called for every page and
+    on_done(keyword, gap, cursor) when a pagination is finished,
+    gap None for the new tweets and cursor the max_id of the next
+    page if max_pages cut it short.
+    Returns the clients.
+    '''
+    max_ids = max_ids or {}
+    gaps = gaps or {}
+    queue = asyncio.Queue()
+    for keyword in keywords:
+        queue.put_nowait(keyword)
+
+    async def worker(client):
+        while True:
+            try:
+                keyword = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            left = max_pages
+            searches = [(None, since_ids.get(keyword), max_ids.get(keyword))] + \
+                [(gap, gap['since_id'], gap['cursor']) for gap in gaps.get(keyword, [])]
+            for gap, since_id, max_id in searches:
+                if max_pages and left <= 0:
+                    break
+                pages, cursor = 0, None
+                try:
+                    async for tweets in client.search(keyword, since_id=since_id, max_id=max_id,
+                                                      max_pages=left):
+                        on_page(keyword, tweets, gap)
+                        pages += 1
+                        if max_pages and pages >= left and len(tweets) >= PAGE_COUNT:
+                            cursor = min([t['id'] for t in tweets]) - 1
+                except (SearchError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    logging.warning('Search failed: ' + keyword)
+                    logging.warning(str(e))
+                    break
+                on_done(keyword, gap, cursor)
+                if max_pages:
+                    left -= pages
+
+    clients = [AsyncSearchClient(keys, base_url=base_url, max_connections=concurrency)
+               for keys in keys_list]
+    for client in clients:
+        await client.__aenter__()
+    try:
+        await asyncio.gather(*[worker(client) for client in clients
+                               for i in range(concurrency)])
+    finally:
+        for client in clients:
+            await client.__aexit__()
+    return clients
@@ -0,0 +1,235 @@
+import time
+import queue
+import logging
+import calendar
+import datetime
+import threading
+from tqdm import tqdm
+import TwitterSearch
+
+import archive
+import helpers
+import pipeline
+import publish
+
+
+# the search API goes back about 7 days
+HORIZON_DAYS = 7
+
+
+def _unix_time(date_text):
+    return calendar.timegm(time.strptime(date_text, '%Y-%m-%d %H:%M:%S'))
+
+
+def _day_start(day):
+    return calendar.timegm(day.timetuple())
+
+
+def boundary_ids(keywords, store):
+    '''
+    Id below which each keyword is backfilled, the oldest tweet
+    found by the forward searches. Keywords never searched are
+    added to latest_search at the current time, so the forward
+    loop goes on from there and the backfill covers what is older.
+    '''
+    first = store.first_dates()
+    store.load_max_ids()
+    now_id = archive.time_to_id(time.time())
+    boundaries = {}
+    new = []
+    for keyword in keywords:
+        if keyword in first:
+            boundaries[keyword] = archive.time_to_id(_unix_time(first[keyword]))
+        elif store.since_id(keyword):
+            # searched, nothing found yet
+            boundaries[keyword] = store.since_id(keyword) + 1
+        else:
+            boundaries[keyword] = now_id
+            new.append(keyword)
+
+    search_date = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    store.add_boundaries([{'keyword': keyword, 'count': 0, 'min_date': None, 'max_date': None,
+                           'max_id': now_id, 'search_date': search_date} for keyword in new])
+    store.commit()
+    return boundaries
+
+
+def plan_slices(keywords, boundaries, days=HORIZON_DAYS, now=None):
+    '''
+    One slice per keyword and UTC day, from the search horizon up to
+    the boundary id of the keyword. A slice is searched with since_id
+    and until= the next day, from cursor (max_id) down.
+    '''
+    now = now or time.time()
+    horizon = now - days*24*3600
+    today = datetime.datetime.utcfromtimestamp(now).date()
+    rows = []
+    for keyword in keywords:
+        for i in range(days, -1, -1):
+            day = today - datetime.timedelta(days=i)
+            since_id = archive.time_to_id(max(_day_start(day), horizon)) - 1
+            next_day_id = archive.time_to_id(_day_start(day + datetime.timedelta(days=1)))
+            max_id = min(next_day_id, boundaries[keyword]) - 1
+            if max_id <= since_id:
+                continue
+            rows.append({'keyword': keyword, 'day': day.isoformat(), 'since_id': since_id,
+                         'max_id': max_id, 'cursor': max_id, 'count': 0, 'done': 0})
+    return rows
+
+
+def search_slice(ts, row, pages, writer, store, keys=None, base_url=None):
+    '''
+    Search a slice from its cursor down to its since_id.
+    Pages are written and the slice progress recorded by the
+    pages pipeline. Returns the number of windows slept.
+    '''
+    tso = TwitterSearch.TwitterSearchOrder()
+    tso.set_include_entities(True)
+    tso.set_result_type('recent')
+    tso.set_keywords([row['keyword']])
+    tso.set_since_id(row['since_id'])
+    until = datetime.datetime.strptime(row['day'], '%Y-%m-%d').date() + datetime.timedelta(days=1)
+    # no until in the future, max_id bounds today's slice. Days are UTC
+    # as in plan_slices, set_until would check against the local date
+    if until <= datetime.datetime.utcnow().date():
+        tso.arguments['until'] = until.strftime('%Y-%m-%d')
+
+    window_count = 0
+    _request(ts, pages, keys, base_url, helpers.start_search, ts, tso, row['cursor'])
+    while True:
+        meta = ts.get_metadata()
+        tweets = ts.get_tweets().get('statuses', [])
+        pages.submit(slice_page, tweets, writer, store, row)
+
+        if int(meta.get('x-rate-limit-remaining', 0)) == 0:
+            pages.waiting()
+            if helpers.wait_for_reset(meta, keys=keys, base_url=base_url):
+                window_count += 1
+
+        try:
+            _request(ts, pages, keys, base_url, ts.search_next_results)
+        except TwitterSearch.TwitterSearchException as e:
+            if e.code != helpers.NO_MORE_RESULTS:
+                raise
+            break
+
+    pages.submit(slice_done, store, row)
+    return window_count
+
+
+def _request(ts, pages, keys, base_url, func, *args):
+    '''
+    Run a request, slices in flight on the same credentials can
+    go over the rate limit, wait for the reset and retry then.
+    '''
+    while True:
+        try:
+            return func(*args)
+        except TwitterSearch.TwitterSearchException as e:
+            if e.code != helpers.TOO_MANY_REQUESTS:
+                raise
+            pages.waiting()
+            helpers.wait_for_reset(ts.get_metadata(), keys=keys, base_url=base_url)
+
+
+def slice_page(tweets, writer, store, row):
+    writer.write(tweets)
+    publish.publish([row['keyword']], tweets)
+    if len(tweets) != 0:
+        row['count'] += len(tweets)
+        row['cursor'] = min([t['id'] for t in tweets]) - 1
+        store.slice_progress(row)
+
+
+def slice_done(store, row):
+    row['done'] = 1
+    store.slice_progress(row)
+    logging.info('Backfilled {} {}: {:d} tweets'.format(row['keyword'], row['day'], row['count']))
+
+
+def slice_worker(keys, base_url, tasks, pages, writer, store, pbar, errors):
+    '''
+    Take slices from the shared tasks queue until it is empty.
+    '''
+    try:
+        ts = helpers.get_ts(keys, base_url)
+    except Exception as e:
+        logging.warning('Backfill worker could not connect.')
+        logging.warning(str(e))
+        errors.append(e)
+        return
+
+    while True:
+        try:
+            row = tasks.get_nowait()
+        except queue.Empty:
+            return
+        pbar.set_description('Backfilling {:10} {}'.format(row['keyword'], row['day']))
+        pbar.refresh()
+        try:
+            search_slice(ts, row, pages, writer, store, keys=keys, base_url=base_url)
+        except Exception as e:
+            # the slice resumes from its cursor in the next run
+            logging.warning('Backfill stopped on: {} {}'.format(row['keyword'], row['day']))
+            logging.warning(str(e))
+            errors.append(e)
+            return
+        pbar.update(1)
+
+
+def backfill(keywords, keys_list, store, writer, base_url, days=HORIZON_DAYS, parallel=2):
+    '''
+    Search the history of keywords back to the search horizon in
+    day slices, parallel slices in flight per credential set.
+    Slices and their cursors are kept in the backfill table, so
+    an interrupted backfill resumes where it stopped.
+    '''
+    # slices are planned once per keyword, later the forward loop covers it
+    planned = store.backfill_keywords()
+    new = [i for i in keywords if i not in planned]
+    boundaries = boundary_ids(new, store)
+    store.add_slices(plan_slices(new, boundaries, days))
+    keyword_set = set(keywords)
+    slices = [i for i in store.load_slices() if i['keyword'] in keyword_set]
+    logging.info('{:d} slices to backfill for {:d} keywords'.format(len(slices), len(keywords)))
+
+    tasks = queue.Queue()
+    for row in slices:
+        tasks.put(row)
+
+    errors = []
+    pbar = tqdm(total=len(slices), unit='slice')
+    pages = pipeline.Pipeline(idle=(writer.flush, store.commit))
+    workers = [threading.Thread(target=slice_worker,
+                                args=(keys, base_url, tasks, pages, writer, store, pbar, errors),
+                                daemon=True)
+               for keys in keys_list for i in range(parallel)]
+    try:
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    finally:
+        pbar.close()
+        pages.close()
+        writer.flush()
+        store.commit()
+
+    left = len([i for i in store.load_slices() if i['keyword'] in keyword_set])
+    if left:
+        logging.warning('{:d} slices left, run backfill again to resume.'.format(left))
+    return errors
+
+
+def backfill_command(args, keys_list, store, writer):
+    '''
+    The backfill subcommand.
+    '''
+    if args.keyword:
+        keywords = args.keyword
+    elif args.keywords_file:
+        keywords = helpers.get_keywords_file(args.keywords_file)
+    else:
+        keywords = helpers.get_keywords_sql(store.db_file)
+    backfill(keywords, keys_list, store, writer, args.api_url,
+             days=args.days, parallel=args.parallel)
@@ -0,0 +1,91 @@
+'''
+Per keyword stats of a 50 keyword OR-query page,
+as in helpers.submit_tso before and after the single pass,
+and the cost of the keyword matcher as the keyword set grows.
+
+python benchmarks/bench_aggregation.py
+'''
+import os
+import sys
+import random
+import timeit
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import helpers
+import matcher
+
+
+def synthetic_page(keywords, n_tweets=100):
+    tweets = []
+    for i in range(n_tweets):
+        symbols = random.sample(keywords, random.randint(1, 3))
+        tweets.append({
+            'id': 930000000000000000 + i,
+            'created_at': 'Wed Nov 01 13:{:02d}:{:02d} +0000 2017'.format(i // 60, i % 60),
+            'entities': {'symbols': [{'text': s.lstrip('$')} for s in symbols]},
+            })
+    return tweets
+
+
+def old_page(tweets, keywords):
+    # per keyword list comprehensions and scalar pd.to_datetime
+    out = {}
+    for kw in keywords:
+        kw_tweets = [t for t in tweets if kw in ['$'+i['text'] for i in t['entities']['symbols']]]
+        if len(kw_tweets) != 0:
+            out[kw] = (len(kw_tweets),
+                       min([pd.to_datetime(t['created_at'], utc=True) for t in kw_tweets]),
+                       max([pd.to_datetime(t['created_at'], utc=True) for t in kw_tweets]))
+    return out
+
+
+def new_page(tweets, keywords, keyword_matcher):
+    page_stats = helpers.keyword_stats(tweets, keyword_matcher)
+    stats = {kw: helpers.KeywordStats() for kw in keywords}
+    for kw in keywords:
+        if kw in page_stats:
+            stats[kw].update(*page_stats[kw])
+    return stats
+
+
+def mixed_keywords(n):
+    # cashtags, hashtags, words and two word phrases
+    kinds = ['$T{:04d}', '#tag{:04d}', 'word{:04d}', 'some phrase{:04d}']
+    return [kinds[i % 4].format(i) for i in range(n)]
+
+
+def mixed_page(keywords, n_tweets=100):
+    tweets = synthetic_page([k for k in keywords if k[0] == '$'], n_tweets)
+    for tweet in tweets:
+        picked = random.sample(keywords, 3)
+        tweet['text'] = ' '.join(picked) + ' and some more text of an ordinary tweet'
+        tweet['entities']['hashtags'] = [{'text': k[1:]} for k in picked if k[0] == '#']
+    return tweets
+
+
+if __name__ == '__main__':
+    random.seed(1)
+    keywords = ['$T{:03d}'.format(i) for i in range(50)]
+    tweets = synthetic_page(keywords)
+    n = 20
+    old = timeit.timeit(lambda: old_page(tweets, keywords), number=n) / n
+    keyword_matcher = matcher.KeywordMatcher(keywords)
+    new = timeit.timeit(lambda: new_page(tweets, keywords, keyword_matcher), number=n) / n
+    print('50 keywords, 100 tweets per page')
+    print('per keyword scan : {:8.2f} ms/page'.format(old*1000))
+    print('single pass      : {:8.2f} ms/page'.format(new*1000))
+    print('speedup          : {:8.1f}x'.format(old/new))
+
+    print()
+    print('mixed cashtags, hashtags, words and phrases, 100 tweets per page')
+    for size in [50, 500, 5000]:
+        keywords = mixed_keywords(size)
+        tweets = mixed_page(keywords)
+        start = timeit.default_timer()
+        keyword_matcher = matcher.KeywordMatcher(keywords)
+        build = timeit.default_timer() - start
+        page = timeit.timeit(lambda: helpers.keyword_stats(tweets, keyword_matcher), number=n) / n
+        found = sum([len(keyword_matcher.match(t)) for t in tweets])
+        print('{:5d} keywords   : {:8.2f} ms/page, build {:6.2f} ms, {:d} matches'.format(
+              size, page*1000, build*1000, found))
@@ -0,0 +1,79 @@
+'''
+Compaction of a day written in small streams.
+
+Writes synthetic tweets the way the search loop does, a stream per
+--page_tweets tweets, then compacts copies of the day into each codec
+and reports the file size, the seconds to compact and the seconds to
+read every tweet of the day before and after.
+
+python benchmarks/bench_compact.py --tweets 100000 --page_tweets 100
+'''
+import os
+import sys
+import time
+import shutil
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import archive
+import compact
+import reader
+import fake_twitter
+
+
+def write_day(output_dir, tweets, page_tweets):
+    rnd = random.Random(0)
+    now = time.time()
+    writer = archive.ArchiveWriter(output_dir, flush_bytes=1)
+    for i in range(0, tweets, page_tweets):
+        writer.write([fake_twitter.synthetic_tweet(archive.time_to_id(now - rnd.random()*86400) + j,
+                                                   ['$AAPL']) for j in range(i, i + page_tweets)])
+    writer.close()
+    return writer.file_name
+
+
+def read_all(file_name):
+    start = time.time()
+    count = sum([1 for _ in reader.read_file(file_name)])
+    return count, time.time() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Archive compaction benchmark.')
+    parser.add_argument('--tweets', type=int, default=100000)
+    parser.add_argument('--page_tweets', type=int, default=100)
+    parser.add_argument('--block_mb', type=float, default=32)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix='bench_compact_')
+    try:
+        day_file = write_day(os.path.join(tmp, 'day'), args.tweets, args.page_tweets)
+        count, sec = read_all(day_file)
+        print('{:>22} {:>9} {:>8} {:>12} {:>9}'.format('', 'MB', 'streams', 'compact_sec', 'read_sec'))
+        print('{:>22} {:9.1f} {:8d} {:>12} {:9.2f}'.format(
+              'bz2, a stream per page', os.path.getsize(day_file) / 1024**2,
+              len(reader.read_index(day_file)), '', sec))
+        for codec in sorted(archive.CODECS):
+            if codec == 'zstd' and archive.zstandard is None:
+                continue
+            for sort in [False, True]:
+                out_dir = os.path.join(tmp, codec)
+                shutil.rmtree(out_dir, ignore_errors=True)
+                os.makedirs(out_dir)
+                file_name = os.path.join(out_dir, os.path.basename(day_file))
+                shutil.copy(day_file, file_name)
+                shutil.copy(archive.index_name(day_file), archive.index_name(file_name))
+                out_name = file_name[:-len('.bz2')] + archive.CODECS[codec]
+                start = time.time()
+                compact.compact_day([file_name], out_name, codec, dedup=sort, sort=sort,
+                                    block_bytes=int(args.block_mb*1024**2))
+                compact_sec = time.time() - start
+                read, sec = read_all(out_name)
+                assert read == count
+                print('{:>22} {:9.1f} {:8d} {:12.2f} {:9.2f}'.format(
+                      codec + (', sorted' if sort else ''), os.path.getsize(out_name) / 1024**2,
+                      len(reader.read_index(out_name)), compact_sec, sec))
+    finally:
+        shutil.rmtree(tmp)
@@ -0,0 +1,128 @@
+'''
+Full search cycles against the fake search backend.
+
+Runs two cycles per mode and keyword list size, the second one after
+new tweets arrived, and reports tweets/sec, queries per window,
+CPU per tweet, archive bytes per tweet and SQLite time per cycle.
+
+python benchmarks/bench_cycle.py --sizes 100 1000 10000 --modes keyword batched
+'''
+import os
+import sys
+import time
+import types
+import shutil
+import logging
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import helpers
+import async_search
+import archive
+import stats_store
+import fake_twitter
+import twitter_search
+
+
+KEYS = types.SimpleNamespace(consumer_key='key', consumer_secret='secret',
+                             access_token='token', access_token_secret='token_secret')
+
+SEARCH = {
+    'keyword': twitter_search.twitter_search,
+    'batched': twitter_search.twitter_search_batched,
+    'adaptive': twitter_search.twitter_search_adaptive,
+    'async': twitter_search.twitter_search_async,
+    }
+
+
+def run_cycle(mode, store, writer, keywords_file):
+    start = time.time()
+    cpu_start = time.process_time()
+    sql_start = store.sql_time
+    written_start, bytes_start = writer.tweets_written, writer.bytes_written
+
+    SEARCH[mode](store=store, writer=writer, keywords_file=keywords_file)
+    writer.flush()
+
+    wall = time.time() - start
+    cpu = time.process_time() - cpu_start
+    row = store.conn.execute('SELECT tweets_got, queries_submitted, windows_used '
+                             'FROM iterations ORDER BY rowid DESC LIMIT 1').fetchone()
+    tweets, queries, windows = row
+    written = writer.tweets_written - written_start
+    return {
+        'wall_sec': wall,
+        'tweets': tweets,
+        'queries': queries,
+        'tweets_per_sec': tweets / wall if wall else 0,
+        'queries_per_window': queries / max(windows, 1),
+        'cpu_ms_per_tweet': 1000 * cpu / max(tweets, 1),
+        'bytes_per_tweet': (writer.bytes_written - bytes_start) / max(written, 1),
+        'sqlite_ms': 1000 * (store.sql_time - sql_start),
+        }
+
+
+def bench(mode, n_keywords, args):
+    tmp = tempfile.mkdtemp(prefix='bench_cycle_')
+    try:
+        keywords = ['$K{:05d}'.format(i) for i in range(n_keywords)]
+        keywords_file = os.path.join(tmp, 'keywords.txt')
+        with open(keywords_file, 'w') as f:
+            f.write('\n'.join(keywords))
+
+        fake = fake_twitter.FakeTwitter(window_requests=args.window_requests,
+                                        window_sec=args.window_sec,
+                                        latency=args.latency)
+        fake.generate(keywords, n_keywords * args.tweets_per_keyword)
+        server = fake_twitter.serve(fake)
+        twitter_search.api_url = server.api_url
+        twitter_search.twitter_keys = [KEYS]
+
+        db_file = os.path.join(tmp, 'search_stats.db')
+        helpers.check_db(db_file)
+        store = stats_store.StatsStore(db_file)
+        writer = archive.ArchiveWriter(os.path.join(tmp, 'tweets'), seen=archive.SeenIndex())
+
+        results = []
+        for cycle in range(2):
+            if cycle:
+                fake.generate(keywords, n_keywords * args.tweets_per_keyword // 10,
+                              seconds=60, seed=cycle)
+            results.append(run_cycle(mode, store, writer, keywords_file))
+
+        writer.close()
+        store.close()
+        server.shutdown()
+        return results
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Search cycle benchmark on a fake backend.')
+    parser.add_argument('--sizes', nargs='+', type=int, default=[100, 1000, 10000])
+    parser.add_argument('--modes', nargs='+', default=['keyword', 'batched'],
+                        choices=sorted(SEARCH))
+    parser.add_argument('--tweets_per_keyword', type=int, default=5)
+    parser.add_argument('--window_requests', type=int, default=180)
+    parser.add_argument('--window_sec', type=float, default=2,
+                        help='Rate limit window, 15 min on Twitter.')
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help='Seconds per request.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    # windows are seconds long here
+    helpers.RESET_MARGIN = 0
+    async_search.RESET_MARGIN = 0
+
+    columns = ['tweets', 'queries', 'wall_sec', 'tweets_per_sec', 'queries_per_window',
+               'cpu_ms_per_tweet', 'bytes_per_tweet', 'sqlite_ms']
+    print('{:>9} {:>7} {:>5} '.format('mode', 'size', 'cycle') +
+          ' '.join(['{:>18}'.format(i) for i in columns]))
+    for mode in args.modes:
+        for size in args.sizes:
+            for cycle, result in enumerate(bench(mode, size, args)):
+                print('{:>9} {:>7} {:>5} '.format(mode, size, cycle + 1) +
+                      ' '.join(['{:18.2f}'.format(result[i]) for i in columns]))
@@ -0,0 +1,121 @@
+'''
+Freshness of quiet keywords while one keyword has a burst.
+
+Runs keyword mode cycles against a local fake_twitter with --quiet
+keywords and a hot one searched first, new with --history tweets of
+the last day. Between the first and second cycle the hot keyword gets
+a burst of --burst tweets. Reports per --max_pages the requests of the
+cycle after the burst, the requests made before the last quiet keyword
+was searched (and the minutes it waited at 180 requests per 15 min
+window), the cycles until no gap is left to search and the history and
+burst tweets archived, fails if any are missing.
+
+python benchmarks/bench_gaps.py --quiet 200 --history 5000 --burst 50000 --max_pages 0 10 50
+'''
+import os
+import sys
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import helpers
+import archive
+import reader
+import stats_store
+import gaps
+import fake_twitter
+import twitter_search
+
+
+class Keys(object):
+    consumer_key = consumer_secret = access_token = access_token_secret = 'x'
+
+
+def run(tmp, quiet, history, burst, max_pages, max_cycles=100):
+    keywords = ['$HOT'] + ['$Q{:04d}'.format(i) for i in range(quiet)]
+    now = time.time()
+    fake = fake_twitter.FakeTwitter(window_requests=10**6, window_sec=900, latency=0)
+    for i, keyword in enumerate(keywords):
+        fake.add_tweet(archive.time_to_id(now - 3600) + i, (keyword.lower(),))
+    history_id = archive.time_to_id(now - 86400)
+    for i in range(history):
+        fake.add_tweet(history_id + i*4096*17, ('$hot',))
+    queries = []
+    search = fake.search
+
+    def logged_search(params):
+        queries.append(params.get('q', ''))
+        return search(params)
+    fake.search = logged_search
+    server = fake_twitter.serve(fake)
+    twitter_search.api_url = server.api_url
+    twitter_search.twitter_keys = [Keys]
+
+    db_file = os.path.join(tmp, 'search_stats.db')
+    keywords_file = os.path.join(tmp, 'keywords.txt')
+    with open(keywords_file, 'w') as f:
+        f.write('\n'.join(keywords) + '\n')
+    helpers.check_db(db_file)
+    store = stats_store.StatsStore(db_file)
+    writer = archive.ArchiveWriter(os.path.join(tmp, 'tweets'), codec='gzip')
+
+    def cycle():
+        start = len(queries)
+        twitter_search.twitter_search(store, writer, keywords_file, max_pages=max_pages or None)
+        writer.flush()
+        store.commit()
+        return queries[start:]
+
+    try:
+        cycle()
+        first_burst_id = archive.time_to_id(now - 1800)
+        for i in range(burst):
+            fake.add_tweet(first_burst_id + i*4096, ('$hot',))
+        after = cycle()
+        last_quiet = max([i for i, q in enumerate(after) if q.lower() != '$hot'])
+        cycles = 1
+        while gaps.plan_gaps(store) and cycles < max_cycles:
+            cycle()
+            cycles += 1
+        ids = set([t['id'] for t in reader.read_file(writer.file_name)])
+        burst_archived = len([i for i in fake.ids['$hot'] if i >= first_burst_id and i in ids])
+        history_archived = len([i for i in fake.ids['$hot'] if history_id <= i < history_id + history*4096*17
+                                and i in ids])
+    finally:
+        writer.close()
+        store.close()
+        server.shutdown()
+    return len(after), last_quiet, cycles, history_archived, burst_archived
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Gap-aware pagination benchmark.')
+    parser.add_argument('--quiet', type=int, default=200)
+    parser.add_argument('--history', type=int, default=5000)
+    parser.add_argument('--burst', type=int, default=50000)
+    parser.add_argument('--max_pages', type=int, nargs='+', default=[0, 10, 50],
+                        help='Pages per keyword and cycle, 0 for all.')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    print('{:>9} {:>9} {:>17} {:>12} {:>7} {:>17} {:>15}'.format(
+          'max_pages', 'requests', 'before_last_quiet', 'wait_min', 'cycles', 'history_archived',
+          'burst_archived'))
+    missing = False
+    for max_pages in args.max_pages:
+        tmp = tempfile.mkdtemp(prefix='bench_gaps_')
+        try:
+            requests, last_quiet, cycles, history_archived, burst_archived = run(
+                tmp, args.quiet, args.history, args.burst, max_pages)
+        finally:
+            shutil.rmtree(tmp)
+        print('{:>9} {:9d} {:17d} {:12.1f} {:7d} {:>17} {:>15}'.format(
+              max_pages or 'all', requests, last_quiet, last_quiet / 180 * 15, cycles,
+              '{:d}/{:d}'.format(history_archived, args.history),
+              '{:d}/{:d}'.format(burst_archived, args.burst)))
+        missing = missing or history_archived < args.history or burst_archived < args.burst
+    if missing:
+        sys.exit('Tweets missing from the archive.')
@@ -0,0 +1,91 @@
+'''
+Queries per cycle of the batched mode, helpers.pack_keywords against
+the count thresholds (3/10/20/40 -> combine 50/10/4/2) it replaced.
+
+Reports queries, expected requests (pages at 100 tweets per page
+for the expected tweets of each query) and packing time, for
+synthetic keyword counts or the exp_averages table of a stats db.
+
+python benchmarks/bench_packer.py --sizes 1000 10000
+python benchmarks/bench_packer.py --db_file /data/search_stats.db
+'''
+import os
+import sys
+import time
+import math
+import random
+import sqlite3
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import helpers
+
+
+THRESHOLDS = [(3, 50), (10, 10), (20, 4), (40, 2), (None, 1)]
+
+
+def threshold_groups(rows):
+    # the old generate_tso: fixed group sizes per count threshold,
+    # dropping one keyword at a time until the url fits
+    groups = []
+    for count, combine in THRESHOLDS:
+        if count:
+            section = [r for r in rows if r[1] is not None and r[1] < count]
+            rows = [r for r in rows if r[1] is None or r[1] >= count]
+        else:
+            section, rows = rows, []
+        while section:
+            try_n = combine
+            while try_n > 1 and len(helpers.query_tso(section[:try_n]).create_search_url()) >= helpers.MAX_QUERY_URL:
+                try_n -= 1
+            groups.append(section[:try_n])
+            section = section[try_n:]
+    return groups
+
+
+def expected_requests(groups):
+    # new keywords are counted as one page
+    return sum([max(1, math.ceil(sum([r[1] or 0 for r in group]) / helpers.PAGE_TWEETS))
+                for group in groups])
+
+
+def synthetic_rows(n, new_share=0.02, seed=0):
+    # most tickers are quiet, a few are busy
+    rnd = random.Random(seed)
+    rows = []
+    for i in range(n):
+        keyword = '${}'.format(''.join(rnd.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+                                       for j in range(rnd.randint(1, 5))))
+        count = None if rnd.random() < new_share else rnd.paretovariate(1.2) - 1
+        rows.append((keyword, count, 930000000000000000 + rnd.randint(0, 10**16)))
+    return rows
+
+
+def db_rows(db_file):
+    with sqlite3.connect(db_file) as conn:
+        return conn.execute('SELECT keyword, count, max_id FROM exp_averages').fetchall()
+
+
+def report(name, rows):
+    for packer, func in [('thresholds', threshold_groups), ('pack_keywords', helpers.pack_keywords)]:
+        start = time.perf_counter()
+        groups = func(rows)
+        seconds = time.perf_counter() - start
+        print('{:>14} {:>7} {:>14} {:>8} {:>9} {:>9.3f}'.format(
+              name, len(rows), packer, len(groups), expected_requests(groups), seconds))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Batched mode query packing benchmark.')
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1000, 10000])
+    parser.add_argument('--db_file', default=None,
+                        help='Use the exp_averages of a stats db instead.')
+    args = parser.parse_args()
+
+    print('{:>14} {:>7} {:>14} {:>8} {:>9} {:>9}'.format(
+          'keywords', 'size', 'packer', 'queries', 'requests', 'sec'))
+    if args.db_file:
+        report('db', db_rows(args.db_file))
+    else:
+        for size in args.sizes:
+            report('synthetic', synthetic_rows(size))
@@ -0,0 +1,71 @@
+'''
+Archive writes of full and projected tweets, with json and orjson.
+
+Writes synthetic tweets (half of them retweets, with the nested
+retweeted_status) through archive.ArchiveWriter and reports CPU per
+tweet and archive bytes per tweet, for the full tweets and for the
+fields of fields.txt.
+
+python benchmarks/bench_projection.py --tweets 20000 --codec bz2
+'''
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import archive
+import fake_twitter
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def synthetic_tweets(n):
+    tweets = []
+    first_id = archive.time_to_id(time.time() - 3600)
+    for i in range(n):
+        tweet = fake_twitter.synthetic_tweet(first_id + (i << 22), ['$AAPL', '#stocks'])
+        if i % 2:
+            tweet['retweeted_status'] = fake_twitter.synthetic_tweet(first_id - (i << 22), ['$AAPL'])
+        tweets.append(tweet)
+    return tweets
+
+
+def bench(tweets, codec, fields, use_orjson, page=100):
+    tmp = tempfile.mkdtemp(prefix='bench_projection_')
+    orjson = archive.orjson
+    if not use_orjson:
+        archive.orjson = None
+    try:
+        writer = archive.ArchiveWriter(tmp, codec=codec, fields=fields)
+        start = time.process_time()
+        for i in range(0, len(tweets), page):
+            writer.write(tweets[i:i+page])
+        writer.close()
+        cpu = time.process_time() - start
+        return 1e6 * cpu / len(tweets), writer.bytes_written / len(tweets)
+    finally:
+        archive.orjson = orjson
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Tweet projection and serialization benchmark.')
+    parser.add_argument('--tweets', type=int, default=20000)
+    parser.add_argument('--codec', default='bz2', choices=sorted(archive.CODECS))
+    parser.add_argument('--fields_file', default=os.path.join(ROOT, 'fields.txt'))
+    args = parser.parse_args()
+
+    tweets = synthetic_tweets(args.tweets)
+    fields = archive.compile_fields(archive.load_fields(args.fields_file))
+    print('{:>10} {:>8} {:>14} {:>15}'.format('tweets', 'json', 'cpu_us/tweet', 'bytes/tweet'))
+    for name, projection in [('full', None), ('projected', fields)]:
+        for use_orjson in [False, True]:
+            if use_orjson and archive.orjson is None:
+                continue
+            cpu, size = bench(tweets, args.codec, projection, use_orjson)
+            print('{:>10} {:>8} {:14.1f} {:15.1f}'.format(
+                  name, 'orjson' if use_orjson else 'json', cpu, size))
@@ -0,0 +1,107 @@
+'''
+Fan-out of pages to local subscribers.
+
+Publishes synthetic pages of 100 tweets at --rate pages/sec (0 as fast
+as the publisher takes them) to N reader processes on a unix socket
+(or --tcp), one of them slow, reading a page every --slow_sec. Reports
+pages/sec and MB/sec published, the slowest publish() call, and the
+pages received and dropped by the fast readers (the worst of them) and
+by the slow one, for every buffer policy.
+
+python benchmarks/bench_publish.py --subscribers 1 4 16 --pages 2000 --rate 200
+'''
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import archive
+import publish
+import fake_twitter
+
+
+def reader(address, slow_sec, results):
+    pages = dropped = 0
+    for page in publish.subscribe(address):
+        if 'dropped' in page:
+            dropped += page['dropped']
+            continue
+        if page['keywords'] == ['end']:
+            break
+        pages += 1
+        if slow_sec:
+            time.sleep(slow_sec)
+    results.put((slow_sec > 0, pages, dropped))
+
+
+def bench(address, subscribers, pages, page, policy, buffer_mb, slow_sec, rate):
+    publisher = publish.Publisher(address, int(buffer_mb*1024**2), policy)
+    results = multiprocessing.Queue()
+    readers = [multiprocessing.Process(target=reader, args=(
+               publisher.address if isinstance(publisher.address, str) else '%s:%d' % publisher.address,
+               slow_sec if i == 0 else 0, results)) for i in range(subscribers)]
+    for process in readers:
+        process.start()
+    while len(publisher.subscribers) < subscribers:
+        time.sleep(0.01)
+
+    slowest = 0
+    start = time.time()
+    for i in range(pages):
+        if rate:
+            time.sleep(max(start + i / rate - time.time(), 0))
+        call = time.time()
+        publisher.publish(['$AAPL'], page)
+        slowest = max(slowest, time.time() - call)
+    sec = time.time() - start
+    # an end page every reader gets, once the buffers are sent
+    while any([i.buffer for i in list(publisher.subscribers)]):
+        time.sleep(0.05)
+    publisher.publish(['end'], [{'id': 0}])
+
+    received = [results.get(timeout=300) for _ in readers]
+    for process in readers:
+        process.join()
+    publisher.close()
+    fast = [i for i in received if not i[0]]
+    slow = [i for i in received if i[0]]
+    return sec, slowest, fast, slow
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Publisher fan-out benchmark.')
+    parser.add_argument('--subscribers', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--pages', type=int, default=5000)
+    parser.add_argument('--rate', type=float, default=200, help='Pages/sec, 0 for no limit.')
+    parser.add_argument('--buffer_mb', type=float, default=16)
+    parser.add_argument('--slow_sec', type=float, default=0.05,
+                        help='Seconds the slow reader takes per page.')
+    parser.add_argument('--tcp', action='store_true', help='Publish on 127.0.0.1 instead of a unix socket.')
+    args = parser.parse_args()
+
+    first_id = archive.time_to_id(time.time())
+    page = [fake_twitter.synthetic_tweet(first_id + i, ['$AAPL']) for i in range(100)]
+    page_mb = len(publish.encode(['$AAPL'], page)) / 1024**2
+
+    tmp = tempfile.mkdtemp(prefix='bench_publish_')
+    try:
+        print('{:>11} {:>12} {:>10} {:>8} {:>14} {:>18} {:>18}'.format(
+              'subscribers', 'policy', 'pages/sec', 'MB/sec', 'slowest_ms',
+              'fast got/dropped', 'slow got/dropped'))
+        for subscribers in args.subscribers:
+            for policy in publish.POLICIES:
+                address = '127.0.0.1:0' if args.tcp else os.path.join(tmp, 'tweets.sock')
+                sec, slowest, fast, slow = bench(address, subscribers, args.pages, page, policy,
+                                                 args.buffer_mb, args.slow_sec, args.rate)
+                fast_text = '{:d}/{:d}'.format(min([i[1] for i in fast]), max([i[2] for i in fast])) \
+                    if fast else '-'
+                slow_text = '{:d}/{:d}'.format(slow[0][1], slow[0][2])
+                print('{:>11d} {:>12} {:10.0f} {:8.1f} {:14.2f} {:>18} {:>18}'.format(
+                      subscribers, policy, args.pages / sec, args.pages * page_mb / sec,
+                      1000 * slowest, fast_text, slow_text))
+    finally:
+        shutil.rmtree(tmp)
@@ -0,0 +1,112 @@
+'''
+Per keyword tweet counts from the rollup tables against the searches table.
+
+Fills a stats db with a month of searches rows (one per keyword per
+3 min cycle) and an archive with synthetic tweets, then reports the
+rollup of the archive (cold and with nothing new), the query of a
+month of hourly counts of a keyword from searches and from the
+rollup, and the db size before and after the searches are pruned.
+
+python benchmarks/bench_rollup.py --keywords 500 --tweets 200000 --days 30
+'''
+import os
+import sys
+import time
+import shutil
+import random
+import sqlite3
+import argparse
+import tempfile
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import helpers
+import archive
+import rollup
+import scheduler
+import fake_twitter
+
+
+def fill_searches(db_file, keywords, days, cycle_sec=180):
+    now = time.time()
+    with sqlite3.connect(db_file) as conn:
+        conn.executemany('INSERT INTO keywords (keyword) VALUES (?)', [(k,) for k in keywords])
+        for start in range(int(now - days*86400), int(now), cycle_sec):
+            search_date = time.strftime(scheduler.DATE_FORMAT, time.localtime(start))
+            conn.executemany('INSERT INTO searches (keyword, count, min_date, max_date, search_date) '
+                             'VALUES (?, ?, ?, ?, ?)',
+                             [(k, 1, helpers.format_date(start - cycle_sec), helpers.format_date(start),
+                               search_date) for k in keywords])
+
+
+def fill_archive(output_dir, keywords, tweets, days):
+    rnd = random.Random(0)
+    now = time.time()
+    writer = archive.ArchiveWriter(output_dir, codec='gzip')
+    page = []
+    for i in range(tweets):
+        tweet_id = archive.time_to_id(now - rnd.random()*days*86400) + i
+        page.append(fake_twitter.synthetic_tweet(tweet_id, [rnd.choice(keywords).upper()]))
+        if len(page) == 100:
+            writer.write(page)
+            page = []
+    writer.write(page)
+    writer.close()
+
+
+def hourly_from_searches(db_file, keyword, start):
+    # the old way: every search of the month, its count
+    # put in the hour of its newest tweet
+    counts = {}
+    with sqlite3.connect(db_file) as conn:
+        c = conn.execute('SELECT count, max_date FROM searches WHERE keyword=? AND search_date > ?',
+                         (keyword, time.strftime(scheduler.DATE_FORMAT, time.localtime(start))))
+        for count, max_date in c.fetchall():
+            hour = datetime.strptime(max_date, '%Y-%m-%d %H:%M:%S').strftime('%Y-%m-%d %H')
+            counts[hour] = counts.get(hour, 0) + count
+    return counts
+
+
+def timed(func, *args):
+    start = time.time()
+    result = func(*args)
+    return time.time() - start, result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rollup store benchmark.')
+    parser.add_argument('--keywords', type=int, default=500)
+    parser.add_argument('--tweets', type=int, default=200000)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--searches_days', type=int, default=14)
+    args = parser.parse_args()
+
+    keywords = ['$k{:04d}'.format(i) for i in range(args.keywords)]
+    tmp = tempfile.mkdtemp(prefix='bench_rollup_')
+    try:
+        db_file = os.path.join(tmp, 'search_stats.db')
+        output_dir = os.path.join(tmp, 'tweets')
+        helpers.check_db(db_file)
+        fill_searches(db_file, keywords, args.days)
+        fill_archive(output_dir, keywords, args.tweets, args.days)
+        print('{:>34} {:>9}'.format('', 'sec'))
+
+        sec, tweets = timed(rollup.rollup_archive, db_file, output_dir, keywords)
+        print('{:>34} {:9.2f}  {:.0f} tweets/sec'.format('rollup, cold', sec, tweets / sec))
+        sec, _ = timed(rollup.rollup_archive, db_file, output_dir, keywords)
+        print('{:>34} {:9.3f}'.format('rollup, nothing new', sec))
+
+        start = time.time() - args.days*86400
+        sec, _ = timed(hourly_from_searches, db_file, keywords[0], start)
+        print('{:>34} {:9.3f}'.format('month hourly, from searches', sec))
+        sec, _ = timed(rollup.series, db_file, keywords[0], start, time.time(), 'hour')
+        print('{:>34} {:9.3f}'.format('month hourly, rollup.series', sec))
+
+        size = os.path.getsize(db_file)
+        rollup.prune_searches(db_file, args.searches_days)
+        with sqlite3.connect(db_file) as conn:
+            conn.execute('VACUUM')
+        print('db size {:.1f} MB, {:.1f} MB with searches pruned to {:d} days'.format(
+              size / 1024**2, os.path.getsize(db_file) / 1024**2, args.searches_days))
+    finally:
+        shutil.rmtree(tmp)
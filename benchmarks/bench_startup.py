@@ -0,0 +1,80 @@
+'''
+Startup time and memory of the search script.
+
+Imports twitter_search in fresh interpreters and reports the import
+time, the peak RSS and the heavy modules that got loaded. With
+--max_sec or --max_rss_mb it exits non zero when a limit is passed,
+so a new import on the hot path shows up.
+
+python benchmarks/bench_startup.py --runs 5 --max_sec 0.3 --max_rss_mb 60
+'''
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import helpers
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# only the export, async and ticker scraping features need these
+LAZY_MODULES = ['pandas', 'pyarrow', 'aiohttp', 'lxml']
+
+CHILD = '''
+import sys, time, json, resource
+start = time.perf_counter()
+import twitter_search
+seconds = time.perf_counter() - start
+print(json.dumps({
+    'seconds': seconds,
+    'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'loaded': [m for m in %r if m in sys.modules],
+    }))
+''' % (LAZY_MODULES,)
+
+
+def run_import():
+    out = subprocess.run([sys.executable, '-c', CHILD], cwd=ROOT, check=True,
+                         stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def bench_parse_dates(n):
+    tweets = [{'created_at': 'Wed Aug 27 13:08:45 +0000 2008'}] * n
+    start = time.perf_counter()
+    helpers.parse_dates(tweets)
+    return 1e6 * (time.perf_counter() - start) / n
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Startup time and memory benchmark.')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max_sec', type=float, default=None,
+                        help='Fail if the best import time is above.')
+    parser.add_argument('--max_rss_mb', type=float, default=None,
+                        help='Fail if the peak RSS is above.')
+    args = parser.parse_args()
+
+    results = [run_import() for i in range(args.runs)]
+    seconds = min([i['seconds'] for i in results])
+    rss_mb = max([i['rss_mb'] for i in results])
+    loaded = results[-1]['loaded']
+    print('import twitter_search: {:.3f} sec (best of {:d}), peak RSS {:.1f} MB'.format(
+          seconds, args.runs, rss_mb))
+    print('lazy modules loaded: {}'.format(', '.join(loaded) or 'none'))
+    print('parse_dates: {:.2f} us per tweet'.format(bench_parse_dates(100000)))
+
+    failed = []
+    if loaded:
+        failed.append('loaded at startup: ' + ', '.join(loaded))
+    if args.max_sec is not None and seconds > args.max_sec:
+        failed.append('import {:.3f} sec > {:.3f}'.format(seconds, args.max_sec))
+    if args.max_rss_mb is not None and rss_mb > args.max_rss_mb:
+        failed.append('RSS {:.1f} MB > {:.1f}'.format(rss_mb, args.max_rss_mb))
+    if failed:
+        print('FAILED: ' + '; '.join(failed))
+        sys.exit(1)
@@ -0,0 +1,95 @@
+'''
+Ticker universe loads against fake_netfonds market pages.
+
+Times the serial scrape the loader replaced, a cold concurrent load,
+a refresh answered with 304 Not Modified and a refresh within the
+TTL, then lists and delists tickers and checks that the keywords
+table gets exactly those changes.
+
+python benchmarks/bench_universe.py --markets 10 --tickers 3000 --latency 0.3
+'''
+import os
+import sys
+import time
+import shutil
+import random
+import sqlite3
+import argparse
+import tempfile
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import helpers
+import universe
+import fake_netfonds
+
+
+def serial_scrape(markets, market_url):
+    # the old get_tickers_nf, one market after another
+    tickers = []
+    for market in markets:
+        page_source = requests.get(market_url + market)
+        tickers += universe.parse_market(page_source.text)
+    return sorted(tickers)
+
+
+def keywords(db_file):
+    with sqlite3.connect(db_file) as conn:
+        return set([i[0] for i in conn.execute('SELECT keyword FROM keywords')])
+
+
+def timed(func, *args, **kwargs):
+    start = time.time()
+    result = func(*args, **kwargs)
+    return time.time() - start, result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Ticker universe loader benchmark.')
+    parser.add_argument('--markets', type=int, default=10)
+    parser.add_argument('--tickers', type=int, default=3000, help='Tickers per market.')
+    parser.add_argument('--latency', type=float, default=0.3, help='Seconds per page.')
+    args = parser.parse_args()
+
+    rnd = random.Random(0)
+    markets = ['M{:02d}'.format(i) for i in range(args.markets)]
+    listings = {m: ['T{}{:05d}.{}'.format(m, i, m) for i in range(args.tickers)] for m in markets}
+    fake = fake_netfonds.FakeNetfonds(latency=args.latency)
+    for market, tickers in listings.items():
+        fake.set_tickers(market, tickers)
+    server = fake_netfonds.serve(fake)
+
+    tmp = tempfile.mkdtemp(prefix='bench_universe_')
+    try:
+        db_file = os.path.join(tmp, 'search_stats.db')
+        helpers.check_db(db_file)
+        sync = lambda ttl: universe.sync_keywords(db_file, markets, server.market_url, ttl)
+
+        print('{:>28} {:>8} {:>9} {:>8}'.format('load', 'sec', 'requests', 'changes'))
+        for name, func in [
+                ('serial scrape', lambda: serial_scrape(markets, server.market_url) and ([], [])),
+                ('concurrent, cold', lambda: sync(universe.TTL_SEC)),
+                ('refresh, 304 not modified', lambda: sync(0)),
+                ('refresh within ttl', lambda: sync(universe.TTL_SEC))]:
+            requests_before = fake.requests
+            sec, (added, removed) = timed(func)
+            print('{:>28} {:8.2f} {:9d} {:8d}'.format(name, sec, fake.requests - requests_before,
+                                                       len(added) + len(removed)))
+
+        # list and delist some tickers
+        market = markets[0]
+        delisted = set(rnd.sample(listings[market], 10))
+        listed = ['N{:05d}.{}'.format(i, market) for i in range(5)]
+        fake.set_tickers(market, [i for i in listings[market] if i not in delisted] + listed)
+        before = keywords(db_file)
+        sec, (added, removed) = timed(sync, 0)
+        print('{:>28} {:8.2f} {:>9} {:8d}'.format('refresh, one market changed', sec, '',
+                                                   len(added) + len(removed)))
+        assert set(added) == universe.ticker_keywords(listed)
+        assert set(removed) == universe.ticker_keywords(delisted)
+        assert keywords(db_file) == (before | set(added)) - set(removed)
+        print('diff applied: {:d} added, {:d} removed'.format(len(added), len(removed)))
+    finally:
+        server.shutdown()
+        shutil.rmtree(tmp)
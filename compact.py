@@ -0,0 +1,339 @@
+import os
+import json
+import time
+import heapq
+import shutil
+import logging
+import datetime
+import multiprocessing
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import archive
+import reader
+import rollup
+
+
+# files changed this recently might still be written to
+MIN_AGE_SEC = 15*60
+
+
+def loads(line):
+    if archive.orjson is not None:
+        return archive.orjson.loads(line)
+    return json.loads(line)
+
+
+def line_id(line):
+    if isinstance(line, bytes):
+        line = line.decode('utf-8')
+    m = archive.ID_PATTERN.match(line)
+    return int(m.group(1)) if m else loads(line)['id']
+
+
+def read_lines(file_names):
+    '''
+    Yield the tweet lines of files, decompressed as they are read.
+    '''
+    for file_name in file_names:
+        with archive.open_archive(file_name) as f:
+            for line in f:
+                if line.strip():
+                    yield line if line.endswith('\n') else line + '\n'
+
+
+def sorted_runs(lines, run_dir, run_bytes):
+    '''
+    Split lines into files of about run_bytes, each sorted by id.
+    Returns the file names.
+    '''
+    runs = []
+    run, size = [], 0
+
+    def write_run():
+        run.sort()
+        file_name = os.path.join(run_dir, 'run_{:05d}'.format(len(runs)))
+        with open(file_name, 'w', encoding='utf-8') as f:
+            f.writelines([i[1] for i in run])
+        runs.append(file_name)
+
+    for line in lines:
+        run.append((line_id(line), line))
+        size += len(line)
+        if size >= run_bytes:
+            write_run()
+            run, size = [], 0
+    if run:
+        write_run()
+    return runs
+
+
+def merge_runs(runs, dedup):
+    '''
+    Yield the lines of sorted runs in id order,
+    each id once with dedup.
+    '''
+    files = [open(i, encoding='utf-8') for i in runs]
+    try:
+        last_id = None
+        for tweet_id, line in heapq.merge(*[((line_id(l), l) for l in f) for f in files],
+                                          key=lambda i: i[0]):
+            if dedup and tweet_id == last_id:
+                continue
+            last_id = tweet_id
+            yield line
+    finally:
+        for f in files:
+            f.close()
+
+
+def write_blocks(lines, out_name, codec, block_bytes):
+    '''
+    Write lines to out_name in compressed streams of about
+    block_bytes, each with an index entry. Returns the tweets
+    written.
+    '''
+    count = 0
+    with open(out_name, 'wb') as out:
+        block, size, ids, keywords = [], 0, [], set()
+        for line in lines:
+            tweet = loads(line)
+            data = line.encode('utf-8')
+            block.append(data)
+            size += len(data)
+            ids.append(tweet['id'])
+            keywords.update(archive.tweet_keywords(tweet))
+            if size >= block_bytes:
+                count += archive._write_stream(out, out_name, block, ids, keywords, codec,
+                                               {'compacted': 1})
+                block, size, ids, keywords = [], 0, [], set()
+        if block:
+            count += archive._write_stream(out, out_name, block, ids, keywords, codec,
+                                           {'compacted': 1})
+    return count
+
+
+def verify(file_name, expected, check_order):
+    '''
+    Read a written file back, stream by stream: the tweets must
+    be the ones counted in its index and as many as expected,
+    in id order if check_order.
+    '''
+    entries = reader.read_index(file_name) or []
+    if sum([i['count'] for i in entries]) != expected:
+        raise ValueError('{}: index has {:d} tweets, {:d} written'.format(
+                          file_name, sum([i['count'] for i in entries]), expected))
+    count = 0
+    last_id = None
+    with open(file_name, 'rb') as f:
+        for entry in entries:
+            f.seek(entry['offset'])
+            data = reader.decompress(f.read(entry['length']), file_name)
+            lines = [i for i in data.splitlines() if i.strip()]
+            if len(lines) != entry['count']:
+                raise ValueError('{}: stream at {:d} has {:d} tweets, index {:d}'.format(
+                                  file_name, entry['offset'], len(lines), entry['count']))
+            if check_order:
+                for line in lines:
+                    tweet_id = line_id(line)
+                    if last_id is not None and tweet_id < last_id:
+                        raise ValueError('{}: ids out of order at {:d}'.format(file_name, tweet_id))
+                    last_id = tweet_id
+            count += len(lines)
+    if count != expected:
+        raise ValueError('{}: read {:d} tweets, {:d} written'.format(file_name, count, expected))
+
+
+def compact_day(file_names, out_name, codec='bz2', dedup=False, sort=False,
+                block_bytes=32*1024**2, run_bytes=64*1024**2):
+    '''
+    Rewrite the files of a day into out_name, in compressed streams
+    of about block_bytes. With sort the tweets are ordered by id and
+    with dedup each id is kept once, both through sorted runs of
+    run_bytes on disk, so memory stays bounded on any size of day.
+    The file is written under a temporary name, read back and checked
+    against the tweets counted on the way in, then renamed over
+    out_name and the other files are removed, see finish_day.
+    Returns the tweets read and written.
+    '''
+    tmp_name = temp_name(out_name)
+    run_dir = tmp_name + '.runs'
+    for name in [tmp_name, archive.index_name(tmp_name)]:
+        if os.path.exists(name):
+            os.remove(name)
+    shutil.rmtree(run_dir, ignore_errors=True)
+
+    counted = [0]
+
+    def count_lines(lines):
+        for line in lines:
+            counted[0] += 1
+            yield line
+
+    try:
+        lines = count_lines(read_lines(file_names))
+        if sort or dedup:
+            os.makedirs(run_dir)
+            lines = merge_runs(sorted_runs(lines, run_dir, run_bytes), dedup)
+        written = write_blocks(lines, tmp_name, codec, block_bytes)
+        if not dedup and written != counted[0]:
+            raise ValueError('{}: {:d} tweets read, {:d} written'.format(out_name, counted[0], written))
+        verify(tmp_name, written, sort or dedup)
+    except Exception:
+        for name in [tmp_name, archive.index_name(tmp_name)]:
+            if os.path.exists(name):
+                os.remove(name)
+        raise
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+    # the files to remove are journaled before the first
+    # change, a crash from here on is finished by the next run
+    write_journal(out_name, file_names)
+    finish_day(out_name, file_names)
+    return counted[0], written
+
+
+def temp_name(out_name):
+    # hidden from archive_files, with the extension of the codec
+    return os.path.join(os.path.dirname(out_name), '.compact_' + os.path.basename(out_name))
+
+
+def journal_name(out_name):
+    return temp_name(out_name) + '.journal'
+
+
+def write_journal(out_name, file_names):
+    '''
+    Record the compacted file of a day and the files it replaces.
+    '''
+    with open(journal_name(out_name), 'w') as f:
+        json.dump({'out_name': os.path.basename(out_name),
+                   'file_names': [os.path.basename(i) for i in file_names]}, f)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def finish_day(out_name, file_names):
+    '''
+    Rename the checked file of a day over out_name and remove the
+    other files. Steps done before a crash are skipped.
+    '''
+    tmp_name = temp_name(out_name)
+    if os.path.exists(tmp_name):
+        # a file without index is read in full, so the old
+        # index goes first and the new one comes with the file
+        if os.path.exists(archive.index_name(out_name)):
+            os.remove(archive.index_name(out_name))
+        os.replace(tmp_name, out_name)
+    if os.path.exists(archive.index_name(tmp_name)):
+        os.replace(archive.index_name(tmp_name), archive.index_name(out_name))
+    for file_name in file_names:
+        if file_name == out_name:
+            continue
+        for name in [file_name, archive.index_name(file_name)]:
+            if os.path.exists(name):
+                os.remove(name)
+
+
+def finish_journals(output_dir, db_file):
+    '''
+    Finish the compactions a crash stopped after their journal
+    was written, the rollup position included.
+    '''
+    for name in sorted(os.listdir(output_dir)):
+        if not (name.startswith('.compact_') and name.endswith('.journal')):
+            continue
+        try:
+            with open(os.path.join(output_dir, name)) as f:
+                journal = json.load(f)
+        except ValueError:
+            # cut off while written, nothing was replaced yet
+            os.remove(os.path.join(output_dir, name))
+            continue
+        out_name = os.path.join(output_dir, journal['out_name'])
+        file_names = [os.path.join(output_dir, i) for i in journal['file_names']]
+        logging.info('Finishing the compaction of ' + out_name)
+        finish_day(out_name, file_names)
+        rollup.replace_files(db_file, file_names, out_name)
+        os.remove(os.path.join(output_dir, name))
+
+
+def is_compacted(file_names, codec):
+    '''
+    A day already compacted into one file of the codec.
+    '''
+    if len(file_names) != 1 or not file_names[0].endswith('.json' + archive.CODECS[codec]):
+        return False
+    try:
+        entries = reader.read_index(file_names[0])
+    except ValueError:
+        return False
+    return bool(entries) and all([i.get('compacted') for i in entries])
+
+
+def past_days(output_dir, codec, force=False):
+    '''
+    Files of every day before today which is not compacted,
+    day -> file names. Days with a file changed in the last
+    MIN_AGE_SEC are left for later.
+    '''
+    days = defaultdict(list)
+    for file_name in archive.archive_files(output_dir):
+        days[reader.file_day(file_name)].append(file_name)
+    today = datetime.date.today()
+    now = time.time()
+    due = {}
+    for day, file_names in sorted(days.items()):
+        if day >= today:
+            continue
+        if any([now - os.path.getmtime(i) < MIN_AGE_SEC for i in file_names]):
+            logging.info('Files of {} changed recently, skipped.'.format(day))
+            continue
+        if not force and is_compacted(file_names, codec):
+            continue
+        due[day] = file_names
+    return due
+
+
+def compact_command(args):
+    '''
+    The compact subcommand, compacts past days
+    over a pool of --workers processes.
+    '''
+    if args.codec == 'zstd' and archive.zstandard is None:
+        raise ValueError('zstd codec needs the zstandard package')
+    finish_journals(args.output_dir, args.db_file)
+    due = past_days(args.output_dir, args.codec, args.force)
+    if not due:
+        logging.info('Nothing to compact.')
+        return
+    # the compacted files take over the rollup position
+    # of the files of a day, the rest is rolled up first
+    keywords = rollup.load_keywords(args.db_file, args.keywords_file)
+    rollup.rollup_archive(args.db_file, args.output_dir, keywords,
+                          [i for file_names in due.values() for i in file_names])
+
+    ext = '.json' + archive.CODECS[args.codec]
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=context) as pool:
+        futures = {}
+        for day, file_names in due.items():
+            out_name = os.path.join(args.output_dir, 'tweets_' + day.strftime('%Y%m%d') + ext)
+            size = sum([os.path.getsize(i) for i in file_names])
+            future = pool.submit(compact_day, file_names, out_name, args.codec, args.dedup, args.sort,
+                                 int(args.block_mb*1024**2), int(args.run_mb*1024**2))
+            futures[future] = (day, file_names, out_name, size)
+        for future in futures:
+            day, file_names, out_name, size = futures[future]
+            try:
+                read, written = future.result()
+            except Exception as e:
+                logging.warning('Could not compact {}, its files are kept.'.format(day))
+                logging.warning(str(e))
+                continue
+            rollup.replace_files(args.db_file, file_names, out_name)
+            os.remove(journal_name(out_name))
+            logging.info('Compacted {:d} files of {}: {:d} tweets, {:d} duplicates dropped, '
+                         '{:.1f} MB -> {:.1f} MB'.format(len(file_names), day, written, read - written,
+                                                         size / 1024**2, os.path.getsize(out_name) / 1024**2))
@@ -0,0 +1,248 @@
+import os
+import re
+import sys
+import time
+import fcntl
+import signal
+import hashlib
+import logging
+import datetime
+import threading
+import multiprocessing
+
+import archive
+import helpers
+import metrics
+import publish
+import rollup
+import stats_store
+
+
+# seconds between worker heartbeats, a worker silent
+# for DEAD_HEARTBEATS of them is killed and restarted
+HEARTBEAT_SEC = 30
+DEAD_HEARTBEATS = 10
+MAX_RESTART_DELAY = 15*60
+# seconds between rollups of the shard files, the 3 min pause of a cycle
+ROLLUP_SEC = 3*60
+SHARD_FILE = re.compile(r'^tweets_(\d{8})_shard\d+(?:_\d+)?\.json(?:%s)?$' %
+                        '|'.join([re.escape(i) for i in archive.CODECS.values() if i]))
+
+
+def shard_suffix(shard):
+    '''
+    Name suffix of the tweets files of a shard.
+    '''
+    return '_shard{:02d}'.format(shard)
+
+
+def shard_address(address, shard):
+    '''
+    Publish address of a shard: the next ports after
+    the one given, or the path with the shard suffix.
+    '''
+    kind, address = publish.parse_address(address)
+    if kind == 'tcp':
+        return '{}:{:d}'.format(address[0], address[1] + 1 + shard)
+    return address + shard_suffix(shard)
+
+
+def _weight(keyword, shard):
+    return hashlib.md5('{:d}:{}'.format(shard, keyword).encode('utf-8')).digest()
+
+
+def partition(keywords, shards):
+    '''
+    (keyword, shard) of every keyword by rendezvous hashing: a keyword
+    goes to the shard with the highest hash of (shard, keyword), so
+    when a shard dies or comes back only its keywords move.
+    '''
+    if not shards:
+        return []
+    return [(keyword, max(shards, key=lambda shard: _weight(keyword, shard)))
+            for keyword in keywords]
+
+
+def run_worker(shard, keys_file, args, level):
+    '''
+    Search loop of one shard in its own process, with its own key
+    file and tweets files. Stats go to the shared db.
+    '''
+    # the coordinator process does not search
+    import twitter_search
+    logging.basicConfig(level=level, datefmt='%Y-%m-%d %I:%M:%S',
+                        format='%(asctime)s %(levelname)10s shard{:02d} %(message)s'.format(shard))
+    twitter_search.api_url = args.api_url
+    twitter_search.twitter_keys = [helpers.load_keys(keys_file)]
+    metrics.json_log = args.json_log
+    if args.metrics_port is not None:
+        metrics.serve(args.metrics_port + 1 + shard, args.metrics_host)
+    if args.publish:
+        publish.start(shard_address(args.publish, shard), int(args.publish_buffer_mb*1024**2),
+                      args.publish_policy)
+
+    store = stats_store.StatsStore(args.db_file, shard=shard)
+    store.register_shard(shard, os.getpid(), keys_file, 'running')
+
+    def beat():
+        while True:
+            store.heartbeat()
+            time.sleep(args.heartbeat)
+    threading.Thread(target=beat, daemon=True).start()
+
+    # close the writer when the coordinator stops
+    def terminate(signum, frame):
+        sys.exit()
+    signal.signal(signal.SIGTERM, terminate)
+
+    writer = twitter_search.open_writer(args, suffix=shard_suffix(shard))
+    twitter_search.search_loop(twitter_search.search_mode(args), store, writer, None)
+
+
+def coordinate(args, store):
+    '''
+    The coordinate subcommand. Runs one worker process per key file
+    and keeps the keywords partitioned over the live workers in the
+    shard_keywords table. A dead worker's keywords go to the others
+    from their next cycle, the worker is restarted after
+    --restart_delay, doubled on every restart.
+    '''
+    # one coordinator per db file
+    lock = open(args.db_file + '.lock', 'w')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        logging.critical('Another coordinator is running on ' + args.db_file)
+        return
+
+    level = logging.getLogger().level
+    context = multiprocessing.get_context('spawn')
+    workers = {shard: {'keys': keys_file, 'process': None, 'started': 0, 'start_at': 0, 'restarts': 0}
+               for shard, keys_file in enumerate(args.keys)}
+    keywords = []
+    assignment = None
+    last_rollup = 0
+
+    def terminate(signum, frame):
+        sys.exit()
+    signal.signal(signal.SIGTERM, terminate)
+
+    try:
+        while True:
+            now = time.time()
+            heartbeats = store.shard_heartbeats()
+            for shard, worker in workers.items():
+                process = worker['process']
+                if process is None:
+                    continue
+                if process.is_alive() and \
+                        now - (heartbeats.get(shard) or now) > DEAD_HEARTBEATS*args.heartbeat:
+                    logging.warning('Shard {:d} stopped sending heartbeats.'.format(shard))
+                    process.kill()
+                    process.join()
+                if not process.is_alive():
+                    if now - worker['started'] > MAX_RESTART_DELAY:
+                        worker['restarts'] = 0
+                    delay = min(args.restart_delay * 2**worker['restarts'], MAX_RESTART_DELAY)
+                    logging.warning('Shard {:d} exited with code {}, restarting in {:.0f} sec.'.format(
+                                    shard, process.exitcode, delay))
+                    store.register_shard(shard, None, worker['keys'], 'dead')
+                    worker['process'] = None
+                    worker['start_at'] = now + delay
+                    worker['restarts'] += 1
+
+            start = [shard for shard, worker in workers.items()
+                     if worker['process'] is None and now >= worker['start_at']]
+            live = sorted([shard for shard, worker in workers.items()
+                           if worker['process'] is not None] + start)
+
+            # keywords are read every round, changes are picked up
+            try:
+                if args.keywords_file:
+                    keywords = helpers.get_keywords_file(args.keywords_file)
+                else:
+                    keywords = helpers.get_keywords_sql(args.db_file)
+            except Exception as e:
+                logging.warning('Could not read the keywords.')
+                logging.warning(str(e))
+            new_assignment = partition(keywords, live)
+            if new_assignment != assignment:
+                # workers pick up their keywords at the start of a cycle
+                moved = len(set(new_assignment) - set(assignment or []))
+                store.assign_shards(new_assignment)
+                logging.info('{:d} keywords over {:d} shards, {:d} assigned anew.'.format(
+                             len(keywords), len(live), moved))
+                assignment = new_assignment
+
+            for shard in start:
+                worker = workers[shard]
+                # the heartbeat starts fresh
+                store.register_shard(shard, None, worker['keys'], 'starting')
+                worker['process'] = context.Process(target=run_worker, name='shard{:02d}'.format(shard),
+                                                    args=(shard, worker['keys'], args, level))
+                worker['process'].start()
+                worker['started'] = now
+                logging.info('Started shard {:d} with {}, pid {:d}'.format(
+                             shard, worker['keys'], worker['process'].pid))
+
+            if now - last_rollup >= ROLLUP_SEC:
+                rollup.rollup_cycle(args.db_file, args.output_dir, args.keywords_file)
+                last_rollup = now
+
+            time.sleep(args.heartbeat)
+    finally:
+        logging.info('Stopping the workers...')
+        for worker in workers.values():
+            if worker['process'] is not None:
+                worker['process'].terminate()
+        for shard, worker in workers.items():
+            if worker['process'] is not None:
+                worker['process'].join(60)
+                if worker['process'].is_alive():
+                    worker['process'].kill()
+            store.register_shard(shard, None, worker['keys'], 'stopped')
+        lock.close()
+
+
+def merged_name(output_dir, day, codec):
+    '''
+    First free name of the merged file of a day.
+    '''
+    ext = '.json' + archive.CODECS[codec]
+    part = 0
+    while True:
+        suffix = '_{:02d}'.format(part) if part else ''
+        file_name = os.path.join(output_dir, 'tweets_' + day + '_merged' + suffix + ext)
+        if not os.path.exists(file_name):
+            return file_name
+        part += 1
+
+
+def merge_command(args):
+    '''
+    The merge subcommand. The shard files of every day before
+    yesterday, when the workers might still flush, are merged
+    into one file per day with each tweet once.
+    '''
+    last_day = (datetime.date.today() - datetime.timedelta(days=1)).strftime('%Y%m%d')
+    days = {}
+    for file_name in sorted(os.listdir(args.output_dir)):
+        m = SHARD_FILE.match(file_name)
+        if m and m.group(1) < last_day:
+            days.setdefault(m.group(1), []).append(os.path.join(args.output_dir, file_name))
+
+    if days:
+        # the merged files take over the rollup position of the
+        # shard files, what is left of them is rolled up first
+        keywords = rollup.load_keywords(args.db_file, args.keywords_file)
+    for day, file_names in sorted(days.items()):
+        out_name = merged_name(args.output_dir, day, args.codec)
+        rollup.rollup_archive(args.db_file, args.output_dir, keywords, file_names)
+        count = archive.merge_files(file_names, out_name, args.codec)
+        rollup.replace_files(args.db_file, file_names, out_name)
+        for file_name in file_names:
+            os.remove(file_name)
+            if os.path.exists(archive.index_name(file_name)):
+                os.remove(archive.index_name(file_name))
+        logging.info('Merged {:d} shard files of {} into {}: {:d} tweets'.format(
+                     len(file_names), day, os.path.basename(out_name), count))
@@ -0,0 +1,190 @@
+import os
+import logging
+import datetime
+from collections import defaultdict
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+import archive
+import reader
+
+
+TWITTER_DATE = '%a %b %d %H:%M:%S %z %Y'
+
+
+def tweet_row(tweet):
+    '''
+    Flat row of the columns kept in the export.
+    '''
+    user = tweet.get('user') or {}
+    entities = tweet.get('entities') or {}
+    retweeted = tweet.get('retweeted_status')
+    return {
+        'id': tweet['id'],
+        'created_at': datetime.datetime.strptime(tweet['created_at'], TWITTER_DATE),
+        'user_id': user.get('id'),
+        'user_screen_name': user.get('screen_name'),
+        'text': tweet.get('full_text', tweet.get('text')),
+        'lang': tweet.get('lang'),
+        'symbols': [i['text'] for i in entities.get('symbols', [])],
+        'hashtags': [i['text'] for i in entities.get('hashtags', [])],
+        'is_retweet': retweeted is not None,
+        'is_quote': bool(tweet.get('is_quote_status')),
+        'retweeted_id': retweeted['id'] if retweeted else None,
+        'quoted_id': tweet.get('quoted_status_id'),
+        'retweet_count': tweet.get('retweet_count'),
+        'favorite_count': tweet.get('favorite_count'),
+        }
+
+
+def schema():
+    return pa.schema([
+        ('id', pa.int64()),
+        ('created_at', pa.timestamp('s', tz='UTC')),
+        ('user_id', pa.int64()),
+        ('user_screen_name', pa.string()),
+        ('text', pa.string()),
+        ('lang', pa.string()),
+        ('symbols', pa.list_(pa.string())),
+        ('hashtags', pa.list_(pa.string())),
+        ('is_retweet', pa.bool_()),
+        ('is_quote', pa.bool_()),
+        ('retweeted_id', pa.int64()),
+        ('quoted_id', pa.int64()),
+        ('retweet_count', pa.int64()),
+        ('favorite_count', pa.int64()),
+        ])
+
+
+def partition_file(export_dir, day):
+    return os.path.join(export_dir, 'date=' + day.isoformat(), 'tweets.parquet')
+
+
+def day_ids(day):
+    '''
+    First and last tweet id which can be created on a UTC day.
+    '''
+    start = reader._unix_time(day)
+    return archive.time_to_id(start), archive.time_to_id(start + 86400) - 1
+
+
+def lag_files(file_names, day):
+    '''
+    Files which can hold tweets created on a UTC day by their names:
+    files are named by the local day they were written, at most
+    FETCH_LAG_DAYS after the tweets.
+    '''
+    first = day - datetime.timedelta(days=1)
+    last = day + datetime.timedelta(days=reader.FETCH_LAG_DAYS)
+    return [i for i in file_names if first <= reader.file_day(i) <= last]
+
+
+def source_files(file_names, day):
+    '''
+    The files an index covering the whole file does
+    not rule out for tweets created on a UTC day.
+    '''
+    min_id, max_id = day_ids(day)
+    files = []
+    for file_name in file_names:
+        entries = reader.read_index(file_name)
+        if entries and sum([i['length'] for i in entries]) == os.path.getsize(file_name) and \
+                not any([i['min_id'] <= max_id and i['max_id'] >= min_id for i in entries]):
+            continue
+        files.append(file_name)
+    return files
+
+
+def exported(out_file, file_names):
+    '''
+    True if out_file was written after the last change of file_names.
+    '''
+    return os.path.exists(out_file) and \
+        os.path.getmtime(out_file) >= max([os.path.getmtime(i) for i in file_names])
+
+
+def export_day(file_names, out_file, day, row_group_size=50000):
+    '''
+    Write the tweets created on a UTC day found in file_names into
+    one parquet file, each id once, a row group at a time so only
+    row_group_size rows are in memory. Written to a temporary file
+    and renamed when complete, not written without tweets.
+    Returns the number of tweets written.
+    '''
+    os.makedirs(os.path.dirname(out_file), exist_ok=True)
+    tmp_file = out_file + '.tmp'
+    table_schema = schema()
+    min_id, max_id = day_ids(day)
+    # the same tweet can be in the live, _backfill,
+    # _shardNN and rotated files of a day
+    seen = set()
+    count = 0
+    columns = defaultdict(list)
+
+    def write_group(writer):
+        table = pa.Table.from_pydict(dict(columns), schema=table_schema)
+        writer.write_table(table)
+        columns.clear()
+
+    with pq.ParquetWriter(tmp_file, table_schema) as writer:
+        for file_name in file_names:
+            for tweet in reader.read_file(file_name, min_id=min_id, max_id=max_id):
+                if not min_id <= tweet['id'] <= max_id or tweet['id'] in seen:
+                    continue
+                seen.add(tweet['id'])
+                for key, value in tweet_row(tweet).items():
+                    columns[key].append(value)
+                count += 1
+                if count % row_group_size == 0:
+                    write_group(writer)
+        if columns:
+            write_group(writer)
+    if count == 0:
+        # no partition for a day without tweets
+        os.remove(tmp_file)
+        if not os.listdir(os.path.dirname(out_file)):
+            os.rmdir(os.path.dirname(out_file))
+        return count
+    os.replace(tmp_file, out_file)
+    return count
+
+
+def export_archive(output_dir, export_dir, row_group_size=50000):
+    '''
+    Export the tweets of every past UTC day by their created_at:
+        export_dir/date=2017-11-01/tweets.parquet
+    Today's files are still being written and left out. A day is
+    exported again when a file which can hold its tweets changed
+    after its export, ex. a backfill or a gap search days later.
+    '''
+    if pa is None:
+        raise ValueError('export needs the pyarrow package')
+
+    today = datetime.date.today()
+    files = [i for i in archive.archive_files(output_dir) if reader.file_day(i) < today]
+    if not files:
+        return
+    day = min([reader.file_day(i) for i in files]) - datetime.timedelta(days=reader.FETCH_LAG_DAYS)
+    last = min(max([reader.file_day(i) for i in files]) + datetime.timedelta(days=1),
+               datetime.datetime.utcnow().date() - datetime.timedelta(days=1))
+    while day <= last:
+        out_file = partition_file(export_dir, day)
+        file_names = lag_files(files, day)
+        if file_names and not exported(out_file, file_names):
+            file_names = source_files(file_names, day)
+        if file_names and not exported(out_file, file_names):
+            count = export_day(file_names, out_file, day, row_group_size)
+            if count:
+                logging.info('Exported {:d} tweets created on {}'.format(count, day))
+        day += datetime.timedelta(days=1)
+
+
+def export_command(args):
+    '''
+    The export subcommand.
+    '''
+    export_archive(args.output_dir, args.export_dir, args.row_group_size)
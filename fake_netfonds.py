@@ -0,0 +1,109 @@
+'''
+Local stand-in for the netfonds market pages of the ticker loader.
+
+Serves a page per market, generated from a ticker list or saved from
+the site, with an ETag, answering 304 to a matching If-None-Match.
+
+    fake = fake_netfonds.FakeNetfonds(latency=0.2)
+    fake.set_tickers('O', ['AAPL.O', 'MSFT.O'])
+    fake.load('N', 'saved/kurs_N.html')
+    server = fake_netfonds.serve(fake)
+    universe.sync_keywords(db_file, ['O', 'N'], server.market_url)
+'''
+import time
+import hashlib
+import logging
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def market_page(tickers):
+    '''
+    Market page with the ticker table in the netfonds layout.
+    '''
+    rows = ''.join(['<tr><td><a href="ppaper.php?paper={0}">{1}</a></td><td>0.00</td></tr>'.format(
+                    ticker, ticker.split('.')[0]) for ticker in tickers])
+    return ('<html><body><div class="hcontent"><table>'
+            '<tr><th>Ticker</th><th>Last</th></tr>' + rows + '</table></div></body></html>')
+
+
+class FakeNetfonds(object):
+    '''
+    Market pages by market code, and the requests served.
+    '''
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.pages = {}
+        self.requests = 0
+        self.not_modified = 0
+
+    def set_page(self, market, text):
+        with self.lock:
+            self.pages[market] = (text, '"%s"' % hashlib.md5(text.encode('utf-8')).hexdigest())
+
+    def set_tickers(self, market, tickers):
+        self.set_page(market, market_page(tickers))
+
+    def load(self, market, file_name):
+        '''
+        Serve a page saved from the site.
+        '''
+        with open(file_name, encoding='utf-8', errors='replace') as f:
+            self.set_page(market, f.read())
+
+    def page(self, market):
+        with self.lock:
+            self.requests += 1
+            return self.pages.get(market)
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        fake = self.server.fake
+        url = urlparse(self.path)
+        market = parse_qs(url.query).get('exchange', [''])[0]
+        if fake.latency:
+            time.sleep(fake.latency)
+
+        page = fake.page(market)
+        if page is None:
+            return self.reply(404, b'')
+        text, etag = page
+        if self.headers.get('If-None-Match') == etag:
+            with fake.lock:
+                fake.not_modified += 1
+            return self.reply(304, b'', {'ETag': etag})
+        self.reply(200, text.encode('utf-8'), {'ETag': etag})
+
+    def reply(self, status, body, headers={}):
+        self.send_response(status)
+        if status != 304:
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(fake, host='127.0.0.1', port=0):
+    '''
+    Serve the fake market pages from a thread.
+    Returns the server, the loader url is server.market_url.
+    '''
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.fake = fake
+    server.market_url = 'http://%s:%d/quotes/kurs.php?exchange=' % server.server_address[:2]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.debug('Fake netfonds at ' + server.market_url)
+    return server
@@ -0,0 +1,224 @@
+import json
+import time
+import random
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, urlencode
+
+import archive
+
+
+TWITTER_DATE = '%a %b %d %H:%M:%S +0000 %Y'
+
+
+def synthetic_tweet(tweet_id, symbols):
+    '''
+    Tweet with the fields and about the size of a real one.
+    '''
+    created = time.strftime(TWITTER_DATE, time.gmtime(archive.tweet_time(tweet_id)))
+    user_id = tweet_id % 100000
+    text = ' '.join(symbols) + ' synthetic tweet text to fill the status up to a usual length'
+    return {
+        'created_at': created,
+        'id': tweet_id,
+        'id_str': str(tweet_id),
+        'text': text,
+        'truncated': False,
+        'entities': {
+            'hashtags': [{'text': s[1:], 'indices': [0, 0]} for s in symbols if s[0] == '#'],
+            'symbols': [{'text': s[1:], 'indices': [0, 0]} for s in symbols if s[0] == '$'],
+            'user_mentions': [],
+            'urls': [],
+            },
+        'metadata': {'iso_language_code': 'en', 'result_type': 'recent'},
+        'source': '<a href="http://twitter.com" rel="nofollow">Twitter Web Client</a>',
+        'in_reply_to_status_id': None,
+        'user': {
+            'id': user_id,
+            'id_str': str(user_id),
+            'name': 'user %d' % user_id,
+            'screen_name': 'user%d' % user_id,
+            'location': '',
+            'description': 'synthetic user of the fake search backend',
+            'followers_count': user_id % 5000,
+            'friends_count': user_id % 300,
+            'statuses_count': user_id % 20000,
+            'created_at': 'Mon Jan 01 00:00:00 +0000 2012',
+            'lang': 'en',
+            'profile_image_url_https': 'https://pbs.twimg.com/profile_images/%d/normal.jpg' % user_id,
+            },
+        'is_quote_status': False,
+        'retweet_count': 0,
+        'favorite_count': 0,
+        'lang': 'en',
+        }
+
+
+class FakeTwitter(object):
+    '''
+    In memory corpus of tweets and rate limit windows
+    answering like the search endpoint.
+
+    Tweets are kept as (id, keywords) and rendered on request.
+    The rate limit allows window_requests per window_sec.
+    '''
+
+    def __init__(self, window_requests=180, window_sec=15*60, latency=0.0):
+        self.window_requests = window_requests
+        self.window_sec = window_sec
+        self.latency = latency
+        self.lock = threading.Lock()
+        # keyword (lowercase) -> sorted list of tweet ids
+        self.ids = {}
+        self.tweets = {}
+        self.recorded = {}
+        self.window_start = time.time()
+        self.window_used = 0
+        self.requests = 0
+
+    def add_tweet(self, tweet_id, keywords, tweet=None):
+        with self.lock:
+            self.tweets[tweet_id] = keywords
+            if tweet is not None:
+                self.recorded[tweet_id] = tweet
+            for keyword in keywords:
+                bisect.insort(self.ids.setdefault(keyword.lower(), []), tweet_id)
+
+    def generate(self, keywords, n_tweets, seconds=3600, seed=0):
+        '''
+        Add n_tweets over the last seconds, after the newest tweet
+        already there. Keyword popularity follows a power law
+        like cashtags do.
+        '''
+        rnd = random.Random(seed)
+        weights = [1.0 / (i + 1) for i in range(len(keywords))]
+        now = time.time()
+        # new tweets come after the ones already there
+        start_id = max(archive.time_to_id(now - seconds), max(self.tweets, default=0) + 1024)
+        step = max((archive.time_to_id(now) - start_id) // max(n_tweets, 1), 1)
+        for i in range(n_tweets):
+            tags = set(rnd.choices(keywords, weights, k=rnd.randint(1, 3)))
+            self.add_tweet(start_id + i*step + rnd.randint(0, 1023), tuple(tags))
+
+    def load(self, file_name):
+        '''
+        Replay tweets recorded in a tweets file.
+        '''
+        with archive.open_archive(file_name) as f:
+            for line in f:
+                if line.strip():
+                    tweet = json.loads(line)
+                    self.add_tweet(tweet['id'], tuple(archive.tweet_keywords(tweet)), tweet)
+
+    def rate_limit(self):
+        '''
+        Take a request from the window, returns
+        (allowed, remaining, reset).
+        '''
+        with self.lock:
+            now = time.time()
+            if now - self.window_start >= self.window_sec:
+                self.window_start = now
+                self.window_used = 0
+            reset = int(self.window_start + self.window_sec) + 1
+            if self.window_used >= self.window_requests:
+                return False, 0, reset
+            self.window_used += 1
+            self.requests += 1
+            return True, self.window_requests - self.window_used, reset
+
+    def rate_limit_status(self):
+        with self.lock:
+            remaining = max(self.window_requests - self.window_used, 0)
+            if time.time() - self.window_start >= self.window_sec:
+                remaining = self.window_requests
+            return {'resources': {'search': {'/search/tweets': {
+                'limit': self.window_requests,
+                'remaining': remaining,
+                'reset': int(self.window_start + self.window_sec) + 1,
+                }}}}
+
+    def search(self, params):
+        '''
+        Response of the search endpoint for the query parameters.
+        '''
+        query = params.get('q', '')
+        terms = [i.strip('"').lower() for i in query.split(' ') if i and i != 'OR']
+        count = int(params.get('count', 15))
+        since_id = int(params.get('since_id', 0))
+        max_id = int(params.get('max_id', 2**63 - 1))
+
+        with self.lock:
+            found = set()
+            for term in terms:
+                ids = self.ids.get(term, [])
+                lo = bisect.bisect_right(ids, since_id)
+                hi = bisect.bisect_right(ids, max_id)
+                # newest first, only count of them are needed per term
+                found.update(ids[max(lo, hi - count):hi])
+            page = sorted(found, reverse=True)[:count]
+            statuses = [self.recorded.get(i) or synthetic_tweet(i, self.tweets[i]) for i in page]
+
+        metadata = {'count': count, 'query': query, 'since_id': since_id}
+        if len(page) == count:
+            next_params = dict(params, max_id=str(page[-1] - 1))
+            metadata['next_results'] = '?' + urlencode(next_params)
+        return {'statuses': statuses, 'search_metadata': metadata}
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        fake = self.server.fake
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if fake.latency:
+            time.sleep(fake.latency)
+
+        if url.path.endswith('/account/verify_credentials.json'):
+            return self.reply(200, {'id': 1})
+        if url.path.endswith('/application/rate_limit_status.json'):
+            return self.reply(200, fake.rate_limit_status())
+        if not url.path.endswith('/search/tweets.json'):
+            return self.reply(404, {'errors': [{'message': 'Not found'}]})
+
+        allowed, remaining, reset = fake.rate_limit()
+        headers = {
+            'x-rate-limit-limit': str(fake.window_requests),
+            'x-rate-limit-remaining': str(remaining),
+            'x-rate-limit-reset': str(reset),
+            }
+        if not allowed:
+            return self.reply(429, {'errors': [{'message': 'Rate limit exceeded'}]}, headers)
+        self.reply(200, fake.search(params), headers)
+
+    def reply(self, status, content, headers={}):
+        body = json.dumps(content).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(fake, host='127.0.0.1', port=0):
+    '''
+    Serve the fake backend from a thread.
+    Returns the server, its API url is server.api_url.
+    '''
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.fake = fake
+    server.api_url = 'http://%s:%d/1.1/' % server.server_address[:2]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.debug('Fake twitter at ' + server.api_url)
+    return server
@@ -0,0 +1,140 @@
+import time
+import logging
+import sqlite3
+import TwitterSearch
+
+import archive
+import helpers
+import metrics
+import publish
+import backfill
+import stats_store
+
+
+def horizon_id(now=None):
+    '''
+    Oldest tweet id the search API still returns.
+    '''
+    return archive.time_to_id((now or time.time()) - backfill.HORIZON_DAYS*24*3600)
+
+
+def plan_gaps(store, keywords=None, now=None):
+    '''
+    Gaps to search per keyword, keyword -> [row], oldest first.
+    A row is searched from its cursor (max_id) down to its since_id,
+    gaps older than the search horizon are cut there, the rest of
+    them can not be searched any more.
+    '''
+    horizon = horizon_id(now)
+    all_gaps = store.load_gaps()
+    metrics.COVERAGE_GAPS.set(sum([len(i) for i in all_gaps.values()]))
+    keywords = set(keywords) if keywords is not None else set(all_gaps)
+    plan = {}
+    for keyword, gaps in all_gaps.items():
+        if keyword not in keywords:
+            continue
+        rows = [{'keyword': keyword, 'since_id': max(since_id, horizon), 'max_id': max_id,
+                 'cursor': max_id, 'count': 0} for since_id, max_id in gaps if max_id > horizon]
+        if rows:
+            plan[keyword] = rows
+    if plan:
+        logging.info('{:d} gaps to search for {:d} keywords'.format(
+                     sum([len(i) for i in plan.values()]), len(plan)))
+    return plan
+
+
+def gap_tso(row):
+    tso = TwitterSearch.TwitterSearchOrder()
+    tso.set_include_entities(True)
+    tso.set_result_type('recent')
+    tso.set_keywords([row['keyword']])
+    tso.set_since_id(row['since_id'])
+    return tso
+
+
+def gap_page(tweets, writer, store, row):
+    '''
+    Write a page of a gap, the ids above its oldest tweet are covered.
+    '''
+    with metrics.timer('write_tweets'):
+        writer.write(tweets)
+    publish.publish([row['keyword']], tweets)
+    if len(tweets) != 0:
+        cursor = min([t['id'] for t in tweets]) - 1
+        store.add_coverage(row['keyword'], cursor, row['cursor'])
+        row['count'] += len(tweets)
+        row['cursor'] = cursor
+
+
+def gap_done(store, row, cursor):
+    '''
+    A gap searched to its since_id is closed, else
+    the part below cursor is left for the next visit.
+    '''
+    if cursor is None:
+        store.add_coverage(row['keyword'], row['since_id'], row['cursor'])
+    logging.debug('Gap of {} searched: {:d} tweets{}'.format(
+                  row['keyword'], row['count'], ', more left' if cursor is not None else ''))
+
+
+def fill_gaps(ts, rows, pages, writer, store, max_pages=None, keys=None, base_url=None, pbar=None):
+    '''
+    Search the gaps of a keyword, oldest first, in at most max_pages
+    pages. Pages are written and covered by the pages pipeline.
+    Returns the number of windows slept.
+    '''
+    window_count = 0
+    for row in rows:
+        if max_pages is not None and max_pages <= 0:
+            break
+        windows, n_pages, cursor = helpers.follow_pages(
+            ts, gap_tso(row), lambda tweets, row=row: pages.submit(gap_page, tweets, writer, store, row),
+            pages, cursor=row['cursor'], max_pages=max_pages, keys=keys, base_url=base_url, pbar=pbar)
+        pages.submit(gap_done, store, row, cursor)
+        window_count += windows
+        if max_pages is not None:
+            max_pages -= n_pages
+    return window_count
+
+
+def gaps_report(db_file, now=None):
+    '''
+    Gaps left per keyword, [(keyword, gaps, hours, oldest, expired)]
+    most hours first: the hours of tweets not searched, the creation
+    time of the oldest id not searched and the gaps past the horizon.
+    '''
+    horizon = horizon_id(now)
+    with sqlite3.connect(db_file) as conn:
+        c = conn.execute('SELECT keyword, since_id, max_id FROM coverage ORDER BY keyword, since_id')
+        rows = c.fetchall()
+    ranges = {}
+    for keyword, since_id, max_id in rows:
+        ranges.setdefault(keyword, []).append((since_id, max_id))
+    report = []
+    for keyword, r in ranges.items():
+        gaps = stats_store.range_gaps(r)
+        if not gaps:
+            continue
+        hours = sum([archive.tweet_time(m) - archive.tweet_time(s) for s, m in gaps]) / 3600
+        expired = len([1 for s, m in gaps if m <= horizon])
+        report.append((keyword, len(gaps), hours, archive.tweet_time(gaps[0][0]), expired))
+    report.sort(key=lambda i: i[2], reverse=True)
+    return report
+
+
+def gaps_command(args):
+    '''
+    The gaps subcommand, prints the gaps left per keyword.
+    '''
+    report = gaps_report(args.db_file)
+    if not report:
+        print('No gaps, every search reached the one before.')
+        return
+    print('{:20} {:>5} {:>8} {:>20} {:>8}'.format('keyword', 'gaps', 'hours', 'oldest', 'expired'))
+    for keyword, n_gaps, hours, oldest, expired in report[:args.limit]:
+        print('{:20} {:5d} {:8.2f} {:>20} {:8d}'.format(keyword, n_gaps, hours,
+                                                        helpers.format_date(oldest), expired))
+    print('{:d} gaps in {:d} keywords, {:.1f} hours of tweets not searched, {:d} past the '
+          '{:d} day horizon.'.format(sum([i[1] for i in report]), len(report),
+                                     sum([i[2] for i in report]), sum([i[4] for i in report]),
+                                     backfill.HORIZON_DAYS))
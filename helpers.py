@@ -4,19 +4,232 @@ import logging
 import requests
 import os
 import time
-import bz2
-import json
+import calendar
 import pause
-import pandas as pd
+import importlib.util
 import TwitterSearch 
-from urllib.parse import parse_qs, quote_plus, unquote 
-from collections import defaultdict
-from lxml import html
+import oauth
+import metrics
+import matcher
+import publish
+import universe
+from urllib.parse import parse_qs, quote_plus
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
 
 
 
 
+TWITTER_DATE = '%a %b %d %H:%M:%S %z %Y'
+MONTHS = {m: i+1 for i, m in enumerate(['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+                                        'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'])}
+
+# time zone of the sleep messages
+try:
+    LOG_TZ = ZoneInfo('Europe/London')
+except ZoneInfoNotFoundError:
+    LOG_TZ = timezone.utc
+
+
+def parse_date(created_at):
+    '''
+    Unix time of a created_at string, ex.: Wed Aug 27 13:08:45 +0000 2008.
+    Twitter always sends it in this fixed width form, anything
+    else goes through strptime.
+    '''
+    try:
+        if len(created_at) != 30:
+            raise ValueError
+        unix_time = calendar.timegm((int(created_at[26:30]), MONTHS[created_at[4:7]],
+                                     int(created_at[8:10]), int(created_at[11:13]),
+                                     int(created_at[14:16]), int(created_at[17:19])))
+        if created_at[20:25] != '+0000':
+            offset = int(created_at[21:23])*3600 + int(created_at[23:25])*60
+            unix_time -= offset if created_at[20] == '+' else -offset
+        return unix_time
+    except (ValueError, KeyError):
+        return int(datetime.strptime(created_at, TWITTER_DATE).timestamp())
+
+
+def parse_dates(tweets):
+    '''
+    created_at of all tweets, as unix time.
+    '''
+    return [parse_date(t['created_at']) for t in tweets]
+
+
+def format_date(unix_time):
+    return datetime.utcfromtimestamp(unix_time).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class KeywordStats(object):
+    '''
+    Running count, min/max date and max id of a keyword
+    over all pages of a search.
+    '''
+
+    def __init__(self):
+        self.start = time.time()
+        self.count = 0
+        self.pages = 0
+        self.min_date = None
+        self.max_date = None
+        self.max_id = None
+
+    def update(self, count, min_date, max_date, max_id):
+        self.count += count
+        if min_date is not None and (self.min_date is None or min_date < self.min_date):
+            self.min_date = min_date
+        if max_date is not None and (self.max_date is None or max_date > self.max_date):
+            self.max_date = max_date
+        if max_id is not None and (self.max_id is None or max_id > self.max_id):
+            self.max_id = max_id
+
+    def update_page(self, tweets):
+        '''
+        Add all tweets of a page.
+        '''
+        self.pages += 1
+        if len(tweets) == 0:
+            return
+        dates = parse_dates(tweets)
+        self.update(len(tweets), min(dates), max(dates), max([t['id'] for t in tweets]))
+
+    def row(self, keyword, since_id):
+        '''
+        Row for the latest_search table, max_id stays at
+        since_id if nothing was found.
+        '''
+        return {
+            'keyword': keyword,
+            'count': self.count,
+            'min_date': format_date(self.min_date) if self.min_date is not None else None,
+            'max_date': format_date(self.max_date) if self.max_date is not None else None,
+            'max_id': self.max_id if self.max_id is not None else since_id,
+            'search_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            }
+
+
+def keyword_stats(tweets, keyword_matcher, matches=None):
+    '''
+    Count, min/max date and max id of every keyword of a
+    matcher.KeywordMatcher in a page, in a single pass over the tweets.
+    The keywords of every tweet are added to the matches list if given.
+    Returns dict keyword -> [count, min_date, max_date, max_id]
+    '''
+    stats = {}
+    for tweet, date in zip(tweets, parse_dates(tweets)):
+        keywords = keyword_matcher.match(tweet)
+        if matches is not None:
+            matches.append(keywords)
+        for keyword in keywords:
+            s = stats.get(keyword)
+            if s is None:
+                stats[keyword] = [1, date, date, tweet['id']]
+                continue
+            s[0] += 1
+            if date < s[1]: s[1] = date
+            if date > s[2]: s[2] = date
+            if tweet['id'] > s[3]: s[3] = tweet['id']
+    return stats
+
+
+# extra sec to be on the safe side when waiting for the limit reset
+RESET_MARGIN = 10
+# TwitterSearchException code when there is no next page
+NO_MORE_RESULTS = 1011
+TOO_MANY_REQUESTS = 429
+
+
+def get_ts(keys, base_url):
+    '''
+    TwitterSearch client for a module holding app keys.
+    '''
+    ts = TwitterSearch.TwitterSearch(
+            consumer_key = keys.consumer_key,
+            consumer_secret = keys.consumer_secret,
+            access_token = keys.access_token,
+            access_token_secret = keys.access_token_secret,
+            verify = False
+        )
+    ts._base_url = base_url
+    ts.authenticate(True)
+    return ts
+
+
+def start_search(ts, tso, cursor=None):
+    '''
+    First request of a tso, at the max_id cursor
+    of a resumed pagination if given.
+    '''
+    if not cursor:
+        ts.search_tweets(tso)
+        return
+    tso.set_max_id(cursor)
+    ts.search_tweets(tso)
+    # TwitterSearch adds the max_id of the next pages
+    # to the url of the first one
+    del tso.arguments['max_id']
+    ts._start_url = tso.create_search_url()
+
+
+def rate_limit_status(keys, base_url):
+    '''
+    Remaining requests and reset time (unix) of the search endpoint
+    from application/rate_limit_status, which has its own rate limit.
+    '''
+    url = base_url + 'application/rate_limit_status.json'
+    params = {'resources': 'search'}
+    headers = {'Authorization': oauth.oauth_header('GET', url, params, keys)}
+    response = requests.get(url, params=params, headers=headers, timeout=30)
+    response.raise_for_status()
+    limit = response.json()['resources']['search']['/search/tweets']
+    return int(limit['remaining']), int(limit['reset'])
+
+
+def wait_for_reset(meta, pbar=None, keys=None, base_url=None):
+    '''
+    Sleep until the search rate limit window resets.
+    With keys the remaining budget is checked with rate_limit_status
+    first, else the reset time comes from the response headers.
+    Returns True if it slept.
+    '''
+    limit_reset = None
+    if keys is not None:
+        try:
+            remaining, limit_reset = rate_limit_status(keys, base_url)
+            if remaining > 0:
+                logging.debug('{:d} requests left, not sleeping'.format(remaining))
+                return False
+        except Exception as e:
+            logging.warn('rate_limit_status ERROR')
+            logging.warn(str(e))
+    if limit_reset is None and 'x-rate-limit-reset' in meta:
+        limit_reset = int(meta['x-rate-limit-reset'])
+
+    if limit_reset is None:
+        logging.warn('Rate limit reset unknown, sleep for 15min...')
+        # wait the maximum time until next window...
+        if pbar is not None:
+            pbar.set_description("Sleeping for 15 min.")
+            pbar.refresh()
+        with metrics.timer('sleep'):
+            pause.minutes(15)
+        return True
+
+    limit_reset += RESET_MARGIN
+    # convert to correct datetime
+    limit_reset_dt = datetime.fromtimestamp(limit_reset, LOG_TZ)
+    logging.debug('Sleeping until {:%H:%M:%S}'.format(limit_reset_dt))
+    if pbar is not None:
+        pbar.set_description('Sleeping until {:%H:%M:%S}'.format(limit_reset_dt))
+        pbar.refresh()
+    with metrics.timer('sleep'):
+        pause.until(limit_reset)
+    return True
+
+
 def check_db(db_file):
     conn = sqlite3.connect(db_file)
     c = conn.cursor()
@@ -92,6 +305,71 @@ def check_db(db_file):
             END;
         ''',
         '''
+        CREATE TABLE IF NOT EXISTS checkpoint
+             (keyword text PRIMARY KEY,
+              since_id int,
+              cursor int,
+              count int,
+              min_date int,
+              max_date int,
+              max_id int,
+              done int
+              )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS backfill
+             (keyword text,
+              day text,
+              since_id int,
+              max_id int,
+              cursor int,
+              count int,
+              done int,
+              PRIMARY KEY (keyword, day)
+              )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS shard_keywords
+             (keyword text PRIMARY KEY,
+              shard int,
+              position int
+              )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS markets
+             (market text PRIMARY KEY,
+              etag text,
+              last_modified text,
+              fetched real,
+              tickers text
+              )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS shards
+             (shard int PRIMARY KEY,
+              pid int,
+              keys text,
+              state text,
+              heartbeat real
+              )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS coverage
+             (keyword text,
+              since_id int,
+              max_id int,
+              PRIMARY KEY (keyword, since_id)
+              )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS rollup_files
+             (file_name text PRIMARY KEY,
+              offset int,
+              tweets int,
+              updated real
+              )
+        ''',
+        '''
         CREATE TABLE IF NOT EXISTS exp_averages(
             keyword text UNIQUE,
             count real,
@@ -113,9 +391,38 @@ def check_db(db_file):
         ''',
     ]
 
+    # tweets per keyword and minute, hour and day, see rollup.py
+    for table in ['rollup_minute', 'rollup_hour', 'rollup_day']:
+        sql_commands += [
+            '''
+            CREATE TABLE IF NOT EXISTS %s
+                 (keyword text,
+                  bucket int,
+                  count int,
+                  PRIMARY KEY (keyword, bucket)
+                  ) WITHOUT ROWID
+            ''' % table,
+            'CREATE INDEX IF NOT EXISTS {0}_bucket ON {0} (bucket)'.format(table),
+        ]
+
+    # columns added to existing tables after their creation
+    # (table, column, type)
+    new_columns = [
+        ('iterations', 'mode', 'text'),
+        ('iterations', 'queries_saved', 'int'),
+        ('iterations', 'dedup_hits', 'int'),
+        ('iterations', 'dedup_misses', 'int'),
+        ('iterations', 'shard', 'int'),
+        ('keywords', 'source', 'text'),
+    ]
+
     try:
         for command in sql_commands:
             c.execute(command)
+        for table, column, col_type in new_columns:
+            c.execute('PRAGMA table_info(%s)' % table)
+            if column not in [i[1] for i in c.fetchall()]:
+                c.execute('ALTER TABLE %s ADD COLUMN %s %s' % (table, column, col_type))
         conn.commit()
     except Exception as e:
         logging.critical('Stat db error')
@@ -156,66 +463,50 @@ def dict_to_sqlite(input_dict, table, db_file):
     conn.close()
 
 
-def get_tickers_nf(markets=['O', 'N', 'A']):
+def get_keywords_sql(db_file, table='keywords'):
     '''
-    Scrape tickers from selected markets, from netfonds.
-    Expected input: market tickers ex.: ST, OSE ...
-    Expected output: list of all tickers in specified markets
+    Keywords from the db. When the table is empty or holds tickers
+    of the market lists, listings and delistings are applied first,
+    see universe.sync_keywords.
     '''
-    markets = [markets, ] if type(markets) is not list else markets
-    logging.debug('Getting tickers for %s markets.', len(markets))
-    market_url = 'http://www.netfonds.no/quotes/kurs.php?exchange='
-    tickers_xpath = "//div[@class='hcontent']//tr/td[1]/a/@href"
-    tickers = []
-    for market in markets:
-        page_source = requests.get(market_url+market)
-        tree = html.fromstring(page_source.text)
-        tickers_current = tree.xpath(tickers_xpath)
-        tickers += [i.split('=')[1] for i in tickers_current]
-    tickers = sorted(tickers)
-    logging.debug('Tickers got: %s', len(tickers))
-    return tickers
+    with sqlite3.connect(db_file) as conn:
+        c = conn.cursor()
+        c.execute('SELECT count(*), count(source) FROM %s' % table)
+        total, from_markets = c.fetchone()
+        c.close()
 
+    # first time case
+    # if keywords are empty use netfonds to get tickers
+    if total == 0 or from_markets:
+        if total == 0:
+            logging.info('No keywords in DB, fetching Tickers from netfonds...')
+        universe.sync_keywords(db_file)
 
-def get_keywords_sql(db_file, table='keywords'):
     with sqlite3.connect(db_file) as conn:
         c = conn.cursor()
-        c.execute('SELECT * FROM %s' % table)
+        c.execute('SELECT keyword FROM %s' % table)
         fetched = c.fetchall()
-
-        
-        # first time case
-        # if keywords are empty use netfonds to get tickers
-        if len(fetched) == 0:
-            logging.info('No keywords in DB, fetching Tickers from netfonds...')
-            # blacklisted tickers conflict with twitter keywords
-            black_listed = ['OR'] 
-            fetched = get_tickers_nf()
-            fetched = [i.split('.')[0] for i in fetched]
-            fetched = ['$'+i for i in fetched if i not in black_listed]
-            # insert in to keywords for next use
-            fetched = [(i,) for i in fetched]
-            try:
-                c.executemany('INSERT INTO '+table+' VALUES (?)', fetched)
-            except:
-                conn.rollback()
-            conn.commit()
         c.close()
     return [i[0] for i in fetched]
     
 
-def write_tweets(tweets, output_dir='tweets'):
+def load_keys(keys_file):
     '''
-    Writes all tweets to a file of current date.
+    Import twitter keys as variables from a .py file.
+    Each file is loaded as its own module, so several
+    files with the same name can be used.
     '''
-    if not os.path.exists(output_dir):
-        os.mkdir(output_dir)
-    file_name = 'tweets_'+time.strftime('%Y%m%d')+'.json.bz2'
-    full_name = os.path.join(output_dir,file_name)
-    with bz2.open(full_name, 'at') as f:
-        for tweet in tweets:
-            json.dump(tweet, f)
-            f.write('\n')
+    module_name = os.path.splitext(os.path.basename(keys_file))[0]
+    if not keys_file.endswith('.py'):
+        keys_file += '.py'
+    spec = importlib.util.spec_from_file_location(module_name, keys_file)
+    keys = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(keys)
+    keys.consumer_key
+    keys.consumer_secret
+    keys.access_token
+    keys.access_token_secret
+    return keys
 
 
 def get_keywords_file(keyword_file):
@@ -226,7 +517,88 @@ def get_keywords_file(keyword_file):
     return lines
 
 
-def generate_tso(keywords, db_file):
+# a query url (the query string) has to be shorter than this
+MAX_QUERY_URL = 450
+# tweets per result page
+PAGE_TWEETS = 100
+# longest since_id, for the length of the query url
+MAX_TWEET_ID = 2**63 - 1
+
+
+def encoded_length(keyword):
+    '''
+    Length of a keyword in the query url, as TwitterSearch quotes it.
+    '''
+    return len(quote_plus(keyword if ' ' not in keyword else '"%s"' % keyword))
+
+
+def query_tso(rows):
+    '''
+    OR-query of a group of (keyword, count, max_id) rows.
+    '''
+    # use the smallest of the max_id because in the time 
+    # from min(max_id) to max(max_id) there might have been
+    # tweets for keywords other then the one of max(max_id)
+    max_ids = [r[2] for r in rows if r[2] is not None]
+    tso = TwitterSearch.TwitterSearchOrder()
+    tso.set_include_entities(True)
+    tso.set_result_type('recent')
+    tso.set_keywords([r[0] for r in rows], or_operator=True)
+    if max_ids:
+        tso.set_since_id(int(min(max_ids)))
+    return tso
+
+
+def pack_keywords(rows, max_url=MAX_QUERY_URL, max_tweets=PAGE_TWEETS):
+    '''
+    Pack (keyword, count, max_id) rows into OR-queries.
+
+    Every query is a bin with two limits: the url length and the
+    expected tweets per cycle (the exp_averages count), one page by
+    default so that a query costs one request. Keywords are placed
+    first-fit decreasing by expected tweets, on encoded lengths
+    computed once. Keywords without a count yet and keywords over
+    max_tweets get a query of their own.
+    '''
+    # url length without keywords, with the longest since_id
+    base = query_tso([('x', None, MAX_TWEET_ID)]).create_search_url()
+    room = max_url - len(base) + len('x') - 1
+    sep = len('+OR+')
+
+    alone = []
+    items = []
+    for row in rows:
+        if row[1] is None or row[1] > max_tweets:
+            alone.append([row])
+        else:
+            items.append((row[1], encoded_length(row[0]), row))
+    if not items:
+        return alone
+    items.sort(key=lambda i: (i[0], i[1]), reverse=True)
+    min_length = min([i[1] for i in items])
+
+    # [rows, url length left, tweets left], full bins are dropped
+    # from the open ones so that first-fit stays short
+    bins = []
+    open_bins = []
+    for count, length, row in items:
+        for i, b in enumerate(open_bins):
+            if length + sep <= b[1] and count <= b[2]:
+                b[0].append(row)
+                b[1] -= length + sep
+                b[2] -= count
+                if b[1] < min_length + sep:
+                    del open_bins[i]
+                break
+        else:
+            b = [[row], room - length, max_tweets - count]
+            bins.append(b)
+            if b[1] >= min_length + sep:
+                open_bins.append(b)
+    return [b[0] for b in bins] + alone
+
+
+def generate_tso(keywords, db_file, max_url=MAX_QUERY_URL, max_tweets=PAGE_TWEETS):
     '''
     Generate tsos combining least frequet keywords.
     '''
@@ -240,65 +612,18 @@ def generate_tso(keywords, db_file):
         c.close()
 
     # mere keywords data with sql data
-    latest_df = pd.DataFrame(latest, columns=['keyword', 'count', 'max_id'])
-    df = pd.DataFrame(keywords, columns=['keyword'])
-    df = df[df['keyword'] != '$OR'] # twitter keywords... not allowed
-    df = df[df['keyword'] != 'OR']  # same
-    df = pd.merge(df, latest_df, how='left', on='keyword')
-
-    thresholds = [
-        {'count':    3,      'combine': 50},
-        {'count':   10,      'combine': 10},
-        {'count':   20,      'combine':  4},
-        {'count':   40,      'combine':  2},
-        {'count': None,      'combine':  1},
-        ]
-
-    for threshold in thresholds:
-        # Select a section from the df
-        # truncating the df as it goes through the thresholds
-        # new tweets will have None as count and thus will not
-        # meet any thresholds and will be processed one at time.
-        if threshold['count']:
-            section = df[df['count'] < threshold['count']]
-        else:
-            section = df[:]
-
-        df.drop(section.index, inplace=True)
-
-        # Generate tsos
-        while len(section) > 0:
-            # determine the right number of keywords to combine
-            try_n = threshold['combine']
-            too_long = True
-            while too_long:
-                subsection = section[:try_n]
-                combine = list(subsection.keyword)
-                
-                # use the smallest of the max_id because in the time 
-                # from min(max_id) to max(max_id) there might have been
-                # tweets for keywords other then the one of max(max_id)
-                max_id = subsection['max_id'].min()
-                tso = TwitterSearch.TwitterSearchOrder()
-                tso.set_include_entities(True)
-                tso.set_result_type('recent')
-                tso.set_keywords(combine, or_operator=True)
-                if not pd.isnull(max_id):
-                    tso.set_since_id(int(max_id))
-
-                url = tso.create_search_url()
-                
-                if (len(url) < 450) | (try_n == 1):
-                    # exit clause
-                    too_long = False
-                    logging.debug('Number of tickers combnied {}'.format(len(combine)))
-                    logging.debug(combine)
-                    logging.debug(tso.create_search_url())
-                else:
-                    try_n -= 1
-                
-            yield tso
-            section = section.iloc[try_n:]
+    # (keyword, count, max_id), None for new keywords
+    latest = {keyword: (count, max_id) for keyword, count, max_id in latest}
+    rows = [(kw,) + latest.get(kw, (None, None)) for kw in keywords
+            if kw not in ('$OR', 'OR')] # twitter keywords... not allowed
+
+    groups = pack_keywords(rows, max_url, max_tweets)
+    logging.info('{:d} keywords packed into {:d} queries'.format(len(rows), len(groups)))
+    for group in groups:
+        tso = query_tso(group)
+        logging.debug('Number of tickers combnied {}'.format(len(group)))
+        logging.debug(tso.create_search_url())
+        yield tso
 
 #debuging
 # Setting the logging params for ipython 
@@ -321,87 +646,112 @@ def generate_tso(keywords, db_file):
 #    pass
 
 
-def submit_tso(tso, ts, output_dir):
-    # get params from tso object
-    url = tso.create_search_url()
-    tso_params = parse_qs(url)
-    since_id = tso_params.get('since_id', None)
-    since_id = since_id if since_id is None else since_id[0] 
-    keywords = tso_params.get('?q', None)
-    if keywords:
-        keywords = set(keywords[0].split(' '))
-        keywords = [kw.strip('"') for kw in keywords if kw != 'OR']
-        keywords = set(keywords) #just in case stripinus '"' atsirado duplikatu
-
-    # use defaultdict(list) as each tso might have many pages
-    # append all pages to a list and aggregate after
-    max_id   = defaultdict(list)
-    max_date = defaultdict(list)
-    min_date = defaultdict(list) 
-    count    = defaultdict(list)
+def follow_pages(ts, tso, on_page, pipeline, cursor=None, max_pages=None,
+                 keys=None, base_url=None, pbar=None):
+    '''
+    Search a tso from the max_id cursor if given and follow its pages,
+    at most max_pages of them. on_page(tweets) is called for every
+    page, the pipeline is told when the fetcher sleeps for the rate
+    limit. Returns the number of windows slept, of pages and the max_id
+    of the next page if the pagination stopped at max_pages, else None.
+    '''
     window_count = 0
+    pages = 0
 
-    ts.search_tweets(tso)
-    try_next = True
-    while try_next:     
+    with metrics.timer('request'):
+        start_search(ts, tso, cursor)
+    while True:
         # parse response
         meta = ts.get_metadata()
-        remaining_limit = int(meta.get('x-rate-limit-remaining',0))            
-        num_tweets = ts.get_amount_of_tweets()
-    
-        # process tweets if there are any
-        if num_tweets != 0:
-            tweets = ts.get_tweets().get('statuses', [])
-            write_tweets(tweets, output_dir)
-            # for now only with cashtags
-            # todo: hashtags and simple keywords..
-            current_max_id = max([t['id'] for t in tweets]) # max id off all
-            for kw in keywords:
-                kw_tweets = [t for t in tweets if kw in ['$'+i['text'] for i in t['entities']['symbols']]]
-                max_id[kw].append(current_max_id) # max id off all tso
-                if len(kw_tweets) != 0:
-                    max_date[kw].append(max([pd.to_datetime(tweet['created_at'], utc=True) for tweet in kw_tweets]))
-                    min_date[kw].append(min([pd.to_datetime(tweet['created_at'], utc=True) for tweet in kw_tweets]))
-                    count[kw].append(len(kw_tweets))
-        
+        remaining_limit = int(meta.get('x-rate-limit-remaining',0))
+        tweets = ts.get_tweets().get('statuses', [])
+        on_page(tweets)
+        pages += 1
+
         if remaining_limit == 0:
-            try:
-                limit_reset = int(meta.get('x-rate-limit-reset', time.time()+15*60)) + 10 # extra sec to be on the safe side
-                # convert to correct datetime
-                limit_reset_dt = pd.to_datetime(limit_reset, unit='s', utc=True)
-                limit_reset_dt = limit_reset_dt.tz_convert('Europe/London')
-                logging.debug('Sleeping until {:%H:%M:%S}'.format(limit_reset_dt))
-                pause.until(limit_reset)
-            except Exception as e:
-                logging.warn('limit_reset ERROR')
-                logging.warn(str(e))
-                logging.warn('Sleep for 15min...')
-                # wait the maximum time until next window...
-                pause.minutes(15)
-            window_count += 1
-        # check if there is a next page for the tso
+            # pages keep being processed while the fetcher sleeps
+            pipeline.waiting()
+            description = pbar.desc if pbar is not None else None
+            if wait_for_reset(meta, pbar, keys=keys, base_url=base_url):
+                window_count += 1
+            if pbar is not None:
+                pbar.set_description_str(description)
+                pbar.refresh()
+
+        # a full page has more after it, as for TwitterSearch
+        if max_pages and pages >= max_pages and len(tweets) >= int(tso.arguments['count']):
+            return window_count, pages, min([t['id'] for t in tweets]) - 1
+
+        # check if there is a next page
         try:
-            try_next = ts.search_next_results()
-        except:
-            try_next = False
-
-    # aggregate stats for current tso
-    tso_stats = []
-    for kw in keywords:
-        max_id[kw] = max(max_id[kw]) if len(max_id[kw]) !=0 else since_id#??
-        max_date[kw] = max(max_date[kw]) if len(max_date[kw]) !=0 else None
-        min_date[kw] = min(min_date[kw]) if len(min_date[kw]) !=0 else None
-        count[kw] = sum(count[kw])
-
-        
-        tso_stats.append({
-            'keyword':kw,
-            'count':count[kw],
-            'min_date': min_date[kw].strftime('%Y-%m-%d %H:%M:%S') if not min_date[kw] is None else None,
-            'max_date': max_date[kw].strftime('%Y-%m-%d %H:%M:%S') if not max_date[kw] is None else None,
-            'max_id': max_id[kw],
-            'search_date': pd.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            })
-            
-    return tso_stats, window_count
+            with metrics.timer('request'):
+                ts.search_next_results()
+        except TwitterSearch.TwitterSearchException as e:
+            # 1011 is no more results, other errors stop the pagination
+            # and it resumes from the checkpoint
+            if e.code != NO_MORE_RESULTS:
+                raise
+            return window_count, pages, None
+
+
+def submit_tso(tso, ts, pipeline, writer, store, keys=None, base_url=None,
+               keyword_matcher=None, max_pages=None):
+    '''
+    Search a tso, following all pages or max_pages of them. Pages
+    are written and split back per keyword by the pipeline with
+    keyword_matcher, built from the keywords of the tso if not given,
+    which adds the keyword stats to the store at the end. Returns the
+    number of keywords and of windows slept.
+    '''
+    # get params from tso object
+    url = tso.create_search_url()
+    tso_params = parse_qs(url)
+    since_id = tso_params.get('since_id', None)
+    since_id = since_id if since_id is None else int(since_id[0])
+    # keywords of the OR-query, phrases are quoted
+    keywords = set([kw.strip('"') for kw in ' OR '.join(tso.searchterms).split(' OR ')])
+    if keyword_matcher is None:
+        keyword_matcher = matcher.KeywordMatcher(keywords)
+
+    # running stats per keyword over all pages of the tso
+    stats = {kw: KeywordStats() for kw in keywords}
 
+    def on_page(tweets):
+        # process tweets if there are any
+        if len(tweets) != 0:
+            pipeline.submit(tso_page, tweets, writer, stats, keyword_matcher)
+
+    window_count, _, cursor = follow_pages(ts, tso, on_page, pipeline, max_pages=max_pages,
+                                        keys=keys, base_url=base_url)
+
+    # aggregate stats for current tso once all pages are processed
+    pipeline.submit(tso_done, stats, since_id, store, cursor)
+    return len(keywords), window_count
+
+
+def tso_page(tweets, writer, stats, keyword_matcher):
+    '''
+    Write a page of a tso and add it to the stats of its keywords.
+    '''
+    with metrics.timer('write_tweets'):
+        writer.write(tweets)
+    # keywords per tweet for the subscribers
+    matches = [] if publish.publisher is not None else None
+    with metrics.timer('parse'):
+        current_max_id = max([t['id'] for t in tweets]) # max id off all
+        page_stats = keyword_stats(tweets, keyword_matcher, matches)
+    if matches is not None:
+        publish.publish_matched(tweets, matches)
+    for kw in stats:
+        # max id off all tso
+        stats[kw].pages += 1
+        stats[kw].update(0, None, None, current_max_id)
+        if kw in page_stats:
+            stats[kw].update(*page_stats[kw])
+
+
+def tso_done(stats, since_id, store, cursor=None):
+    store.add_searches([stats[kw].row(kw, since_id) for kw in stats])
+    for kw in stats:
+        store.add_visit(kw, since_id, stats[kw].max_id, cursor)
+        metrics.keyword_searched(kw, stats[kw], since_id)
@@ -0,0 +1,106 @@
+import re
+
+
+# words, cashtags and hashtags of a text, lowercase
+TOKEN = re.compile(r'[#$]?\w+')
+
+
+def tokenize(text):
+    return TOKEN.findall(text.lower())
+
+
+def tweet_tokens(tweet):
+    '''
+    Tokens a search matches a tweet on: the text, cashtags,
+    hashtags and expanded urls of the tweet and of the tweet
+    it retweets or quotes. None separates the parts, so that
+    phrases do not match across them.
+    '''
+    tokens = []
+    for status in (tweet, tweet.get('retweeted_status'), tweet.get('quoted_status')):
+        if not status:
+            continue
+        tokens.extend(tokenize(status.get('full_text') or status.get('text') or ''))
+        entities = status.get('entities') or {}
+        tokens.append(None)
+        tokens.extend(['$' + i['text'].lower() for i in entities.get('symbols', [])])
+        tokens.extend(['#' + i['text'].lower() for i in entities.get('hashtags', [])])
+        for url in entities.get('urls', []):
+            tokens.append(None)
+            tokens.extend(tokenize(url.get('expanded_url') or url.get('url') or ''))
+        tokens.append(None)
+    return tokens
+
+
+class KeywordMatcher(object):
+    '''
+    Keywords of an OR-query found in its tweets.
+
+    Built once per cycle from the keyword set: cashtags, hashtags,
+    words and phrases are split into tokens and put into one
+    Aho-Corasick automaton over tokens. A tweet is matched in one
+    pass over its tokens, whatever the number of keywords. Words
+    and phrases also match the hashtags and cashtags of their
+    words, as on Twitter: bitcoin matches #bitcoin.
+    '''
+
+    def __init__(self, keywords):
+        # state -> {token: state}, failure state and keywords found
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [()]
+        # words and phrases match the tokens without # and $ too
+        self.plain = False
+        for keyword in set(keywords):
+            tokens = tokenize(keyword)
+            if not tokens:
+                continue
+            if not tokens[0].startswith(('#', '$')):
+                self.plain = True
+            self._add(tokens, keyword)
+        self._build()
+
+    def _add(self, tokens, keyword):
+        state = 0
+        for token in tokens:
+            if token not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append(())
+                self.goto[state][token] = len(self.goto) - 1
+            state = self.goto[state][token]
+        self.out[state] = self.out[state] + (keyword,)
+
+    def _build(self):
+        # failure links breadth first, outputs of the
+        # failure state are added to every state
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for token, child in self.goto[state].items():
+                fail = self.fail[state]
+                while fail and token not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[child] = self.goto[fail].get(token, 0)
+                self.out[child] = self.out[child] + self.out[self.fail[child]]
+                queue.append(child)
+
+    def _scan(self, tokens, found):
+        goto, fail, out = self.goto, self.fail, self.out
+        state = 0
+        for token in tokens:
+            while state and token not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(token, 0)
+            if out[state]:
+                found.update(out[state])
+
+    def match(self, tweet):
+        '''
+        Set of keywords found in a tweet.
+        '''
+        found = set()
+        tokens = tweet_tokens(tweet)
+        self._scan(tokens, found)
+        if self.plain:
+            self._scan([i.lstrip('#$') if i else i for i in tokens], found)
+        return found
@@ -0,0 +1,194 @@
+import json
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# seconds, the last ones are for rate limit sleeps
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 60, 300, 900)
+
+# log a json line per keyword search
+json_log = False
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(['%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                           for name, value in zip(names, values)]) + '}'
+
+
+class Counter(object):
+    '''
+    Prometheus counter with labels.
+    '''
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, *labels, value=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + value
+
+    def render(self):
+        with self.lock:
+            return ['%s%s %s' % (self.name, _labels(self.labels, k), v)
+                    for k, v in sorted(self.values.items())]
+
+
+class Gauge(object):
+    '''
+    Prometheus gauge without labels.
+    '''
+    kind = 'gauge'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def render(self):
+        return ['%s %s' % (self.name, self.value)]
+
+
+class Histogram(object):
+    '''
+    Prometheus histogram with labels.
+    '''
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        # labels -> [bucket counts, sum, count]
+        self.values = {}
+
+    def observe(self, value, *labels):
+        with self.lock:
+            entry = self.values.setdefault(labels, [[0]*len(self.buckets), 0.0, 0])
+            i = bisect.bisect_left(self.buckets, value)
+            if i < len(self.buckets):
+                entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for k, (counts, total, count) in sorted(self.values.items()):
+                cumulative = 0
+                for bucket, n in zip(self.buckets, counts):
+                    cumulative += n
+                    lines.append('%s_bucket%s %d' % (self.name, _labels(
+                        self.labels + ('le',), k + (repr(float(bucket)),)), cumulative))
+                lines.append('%s_bucket%s %d' % (self.name, _labels(
+                    self.labels + ('le',), k + ('+Inf',)), count))
+                lines.append('%s_sum%s %r' % (self.name, _labels(self.labels, k), total))
+                lines.append('%s_count%s %d' % (self.name, _labels(self.labels, k), count))
+        return lines
+
+
+STAGE_SECONDS = Histogram('twitter_search_stage_seconds',
+                          'Time spent per stage of the search loop.', ('stage',))
+KEYWORD_TWEETS = Counter('twitter_search_keyword_tweets_total',
+                         'Tweets found per keyword.', ('keyword',))
+KEYWORD_PAGES = Counter('twitter_search_keyword_pages_total',
+                        'Result pages per keyword.', ('keyword',))
+KEYWORD_EMPTY = Counter('twitter_search_keyword_empty_total',
+                        'Keyword searches that found no new tweets.', ('keyword',))
+PUBLISH_PAGES = Counter('twitter_search_published_pages_total',
+                        'Pages published to subscribers.')
+PUBLISH_DROPPED = Counter('twitter_search_publish_dropped_total',
+                          'Pages dropped for slow subscribers.')
+PUBLISH_SUBSCRIBERS = Gauge('twitter_search_publish_subscribers',
+                            'Connected subscribers.')
+COVERAGE_GAPS = Gauge('twitter_search_coverage_gaps',
+                      'Gaps left between the searches of the keywords.')
+METRICS = [STAGE_SECONDS, KEYWORD_TWEETS, KEYWORD_PAGES, KEYWORD_EMPTY,
+           PUBLISH_PAGES, PUBLISH_DROPPED, PUBLISH_SUBSCRIBERS, COVERAGE_GAPS]
+
+
+@contextmanager
+def timer(stage):
+    '''
+    Time a stage of the loop: request, parse, write_tweets, stats or sleep.
+    '''
+    start = time.time()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.time() - start, stage)
+
+
+def keyword_searched(keyword, stats, since_id=None):
+    '''
+    Count a finished keyword search from its KeywordStats.
+    '''
+    KEYWORD_TWEETS.inc(keyword, value=stats.count)
+    KEYWORD_PAGES.inc(keyword, value=stats.pages)
+    if stats.count == 0:
+        KEYWORD_EMPTY.inc(keyword)
+    if json_log:
+        logging.info(json.dumps({
+            'keyword': keyword,
+            'tweets': stats.count,
+            'pages': stats.pages,
+            'since_id': since_id,
+            'max_id': stats.max_id,
+            'duration_sec': round(time.time() - stats.start, 3),
+            }))
+
+
+def render():
+    '''
+    All metrics in the Prometheus text format.
+    '''
+    lines = []
+    for metric in METRICS:
+        lines.append('# HELP %s %s' % (metric.name, metric.help))
+        lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(port, host='127.0.0.1'):
+    '''
+    Serve /metrics from a thread, on the loopback
+    interface unless another host is given.
+    '''
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info('Metrics on {}:{:d}'.format(*server.server_address[:2]))
+    return server
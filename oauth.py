@@ -0,0 +1,37 @@
+import hmac
+import time
+import base64
+import hashlib
+import binascii
+import os
+from urllib.parse import quote
+
+
+def _quote(value):
+    return quote(str(value), safe='~')
+
+
+def oauth_header(method, url, params, keys, nonce=None, timestamp=None):
+    '''
+    OAuth 1.0a HMAC-SHA1 Authorization header for a request.
+    url is without the query string, params are the query parameters.
+    keys is a module or object with the four twitter app keys.
+    '''
+    oauth = {
+        'oauth_consumer_key': keys.consumer_key,
+        'oauth_nonce': nonce or binascii.hexlify(os.urandom(16)).decode(),
+        'oauth_signature_method': 'HMAC-SHA1',
+        'oauth_timestamp': str(int(timestamp or time.time())),
+        'oauth_token': keys.access_token,
+        'oauth_version': '1.0',
+        }
+
+    pairs = [(_quote(k), _quote(v)) for k, v in list(params.items()) + list(oauth.items())]
+    param_string = '&'.join(['%s=%s' % (k, v) for k, v in sorted(pairs)])
+    base_string = '&'.join([method.upper(), _quote(url), _quote(param_string)])
+    signing_key = '&'.join([_quote(keys.consumer_secret), _quote(keys.access_token_secret)])
+    digest = hmac.new(signing_key.encode(), base_string.encode(), hashlib.sha1).digest()
+    oauth['oauth_signature'] = base64.b64encode(digest).decode()
+
+    return 'OAuth ' + ', '.join(['%s="%s"' % (_quote(k), _quote(v))
+                                 for k, v in sorted(oauth.items())])
@@ -0,0 +1,80 @@
+import time
+import queue
+import logging
+import threading
+
+
+class Pipeline(object):
+    '''
+    Processing stage between the search fetchers and the disk.
+
+    Fetchers submit work for every page (archive writes, keyword
+    stats) to a bounded queue and go on with the next request,
+    one thread runs it in order. When the queue is full submit()
+    blocks, so a slow disk slows the fetchers instead of piling
+    up pages in memory.
+
+    While a fetcher sleeps for the rate limit reset it calls
+    waiting(), which queues the idle work (ex. writer.flush and
+    store.commit) so compression and stats writes are done in
+    the window instead of after it.
+
+    The first error of the processing stage is raised to the
+    fetchers by the next submit() and by close().
+    '''
+
+    def __init__(self, maxsize=64, idle=()):
+        self.tasks = queue.Queue(maxsize=maxsize)
+        self.idle = idle
+        self.error = None
+        # seconds fetchers were blocked on a full queue
+        self.blocked_time = 0.0
+        self.busy_time = 0.0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                return
+            if self.error is not None:
+                # keep draining so that fetchers never block
+                continue
+            func, args = task
+            start = time.time()
+            try:
+                func(*args)
+            except Exception as e:
+                logging.warning('Processing failed.')
+                logging.warning(str(e))
+                self.error = e
+            self.busy_time += time.time() - start
+
+    def submit(self, func, *args):
+        '''
+        Queue func(*args) for the processing thread.
+        '''
+        if self.error is not None:
+            raise self.error
+        start = time.time()
+        self.tasks.put((func, args))
+        self.blocked_time += time.time() - start
+
+    def waiting(self):
+        '''
+        A fetcher is about to sleep, queue the idle work.
+        '''
+        for func in self.idle:
+            self.submit(func)
+
+    def close(self):
+        '''
+        Finish the queued work and stop the processing thread.
+        '''
+        self.tasks.put(None)
+        self.thread.join()
+        logging.debug('Processing {:.1f} sec, fetchers blocked {:.1f} sec'.format(
+                      self.busy_time, self.blocked_time))
+        if self.error is not None:
+            raise self.error
@@ -0,0 +1,279 @@
+import os
+import json
+import stat
+import socket
+import logging
+import threading
+from collections import deque
+
+import archive
+import metrics
+
+
+# what a subscriber's full buffer does with a new page
+POLICIES = ['drop_oldest', 'drop_newest', 'disconnect']
+
+# the publisher of the run, None when --publish is not given
+publisher = None
+
+
+def is_socket(path):
+    return stat.S_ISSOCK(os.stat(path).st_mode)
+
+
+def encode(keywords, tweets):
+    '''
+    A page as one json line: {"keywords": [...], "tweets": [...]}
+    '''
+    message = {'keywords': sorted(keywords), 'tweets': tweets}
+    if archive.orjson is not None:
+        return archive.orjson.dumps(message, option=archive.orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(message) + '\n').encode('utf-8')
+
+
+def publish(keywords, tweets):
+    '''
+    Publish a page of tweets found for keywords, a keyword or the
+    keywords of an OR-query. Does nothing without a publisher.
+    '''
+    if publisher is None or not tweets:
+        return
+    publisher.publish(keywords, tweets)
+
+
+def publish_matched(tweets, matches):
+    '''
+    Publish the page of an OR-query with the keywords each tweet
+    matched, matches in the order of the tweets: a message per set
+    of keywords.
+    '''
+    if publisher is None or not tweets:
+        return
+    groups = {}
+    for tweet, keywords in zip(tweets, matches):
+        groups.setdefault(tuple(sorted(keywords)), []).append(tweet)
+    for keywords, group in groups.items():
+        publisher.publish(keywords, group)
+
+
+def parse_address(address):
+    '''
+    ('tcp', (host, port)) of host:port, else ('unix', path).
+    '''
+    host, _, port = address.rpartition(':')
+    if port.isdigit():
+        return 'tcp', (host or '127.0.0.1', int(port))
+    return 'unix', address
+
+
+class Subscriber(object):
+    '''
+    One connected reader with its bounded buffer of pages
+    and the thread sending them.
+    '''
+
+    def __init__(self, conn, name, max_bytes, policy, on_close):
+        self.conn = conn
+        self.name = name
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.on_close = on_close
+        self.cond = threading.Condition()
+        self.buffer = deque()
+        self.size = 0
+        # pages dropped since the last one sent, and in total
+        self.dropped = 0
+        self.dropped_total = 0
+        self.sent = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def put(self, data):
+        '''
+        Queue a page without blocking, the policy decides
+        what happens when the buffer is full.
+        '''
+        with self.cond:
+            if self.closed:
+                return
+            if self.size + len(data) > self.max_bytes and self.buffer:
+                if self.policy == 'disconnect':
+                    logging.warning('Subscriber {} too slow, disconnected.'.format(self.name))
+                    self._close()
+                    return
+                if self.policy == 'drop_newest':
+                    self._drop(1)
+                    return
+                while self.buffer and self.size + len(data) > self.max_bytes:
+                    self.size -= len(self.buffer.popleft())
+                    self._drop(1)
+            self.buffer.append(data)
+            self.size += len(data)
+            self.cond.notify()
+
+    def _drop(self, n):
+        self.dropped += n
+        self.dropped_total += n
+        metrics.PUBLISH_DROPPED.inc(value=n)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.buffer and not self.closed:
+                    self.cond.wait()
+                if self.closed:
+                    return
+                data = self.buffer.popleft()
+                self.size -= len(data)
+                dropped, self.dropped = self.dropped, 0
+            try:
+                if dropped:
+                    # the reader learns about the gap before the next page
+                    self.conn.sendall(('{"dropped": %d}\n' % dropped).encode('utf-8'))
+                self.conn.sendall(data)
+                self.sent += 1
+            except OSError:
+                with self.cond:
+                    self._close()
+                return
+
+    def _close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.buffer.clear()
+        self.size = 0
+        self.cond.notify()
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.conn.close()
+        self.on_close(self)
+
+    def close(self):
+        with self.cond:
+            self._close()
+
+
+class Publisher(object):
+    '''
+    Fan-out of the fetched pages to local subscribers.
+
+    Listens on a unix socket or a tcp port; every connection gets
+    every page published from then on, as json lines (see encode).
+    A page is encoded once and queued to the buffer of every
+    subscriber, of at most max_bytes, which its own thread sends.
+    publish() never blocks: when a subscriber's buffer is full its
+    oldest pages are dropped (drop_oldest), the new page is dropped
+    (drop_newest) or the subscriber is disconnected (disconnect).
+    Dropped pages are announced to the subscriber with a
+    {"dropped": n} line before the next page it gets.
+    '''
+
+    def __init__(self, address, max_bytes=16*1024**2, policy='drop_oldest'):
+        if policy not in POLICIES:
+            raise ValueError('Unknown publish policy: ' + policy)
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.lock = threading.Lock()
+        self.subscribers = []
+        self.published = 0
+        self.connections = 0
+        kind, self.address = parse_address(address)
+        if kind == 'unix':
+            if os.path.exists(self.address):
+                # a socket left by a run which did not close it
+                if not is_socket(self.address):
+                    raise ValueError('Publish address is not a socket: ' + self.address)
+                os.remove(self.address)
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(self.address)
+        if kind == 'tcp':
+            self.address = self.sock.getsockname()
+        self.sock.listen(16)
+        self.thread = threading.Thread(target=self._accept, daemon=True)
+        self.thread.start()
+        logging.info('Publishing tweets on {}'.format(self.address))
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            with self.lock:
+                self.connections += 1
+                name = '{}#{:d}'.format(self.address, self.connections)
+                self.subscribers.append(Subscriber(conn, name, self.max_bytes, self.policy,
+                                                   self._remove))
+                metrics.PUBLISH_SUBSCRIBERS.set(len(self.subscribers))
+            logging.debug('Subscriber connected, {:d} in all'.format(len(self.subscribers)))
+
+    def _remove(self, subscriber):
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+            metrics.PUBLISH_SUBSCRIBERS.set(len(self.subscribers))
+
+    def publish(self, keywords, tweets):
+        '''
+        Queue a page to every subscriber.
+        '''
+        with self.lock:
+            subscribers = list(self.subscribers)
+            self.published += 1
+        metrics.PUBLISH_PAGES.inc()
+        if not subscribers:
+            return
+        data = encode(keywords, tweets)
+        for subscriber in subscribers:
+            subscriber.put(data)
+
+    def close(self):
+        # shutdown wakes the accept thread, close alone does not
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.close()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            if is_socket(self.address):
+                os.remove(self.address)
+            else:
+                logging.warning('Not removing {}, it is not a socket any more'.format(self.address))
+
+
+def start(address, max_bytes=16*1024**2, policy='drop_oldest'):
+    '''
+    Start the publisher of the run.
+    '''
+    global publisher
+    publisher = Publisher(address, max_bytes, policy)
+    return publisher
+
+
+def subscribe(address):
+    '''
+    Yield the pages of a publisher as dicts, for local readers:
+        for page in publish.subscribe('/data/tweets.sock'):
+            if 'dropped' in page: ...
+            for tweet in page['tweets']: ...
+    '''
+    kind, address = parse_address(address)
+    sock = socket.socket(socket.AF_UNIX if kind == 'unix' else socket.AF_INET, socket.SOCK_STREAM)
+    sock.connect(address)
+    with sock, sock.makefile('rb') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                # disconnected in the middle of a page
+                return
+            yield json.loads(line)
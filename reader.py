@@ -0,0 +1,281 @@
+import os
+import io
+import re
+import bz2
+import gzip
+import json
+import zlib
+import logging
+import datetime
+
+import archive
+
+
+# tweets are archived on the day they were fetched,
+# the search API goes back 7 days
+FETCH_LAG_DAYS = 8
+# streams of old files are grouped into blocks of about this size
+INDEX_BLOCK_BYTES = 1024**2
+FILE_DAY = re.compile(r'^tweets_(\d{8})')
+
+
+def decompress(data, file_name):
+    '''
+    Decompress one or more complete streams of a tweets file.
+    '''
+    if file_name.endswith('.bz2'):
+        return bz2.decompress(data)
+    if file_name.endswith('.gz'):
+        return gzip.decompress(data)
+    if file_name.endswith('.zst'):
+        if archive.zstandard is None:
+            raise ValueError('zstd codec needs the zstandard package')
+        reader = archive.zstandard.ZstdDecompressor().stream_reader(
+            io.BytesIO(data), read_across_frames=True)
+        return reader.read()
+    return data
+
+
+def read_index(file_name):
+    '''
+    Entries of the sidecar index of a tweets file,
+    None if the file has no index. A last line the writer
+    is still appending is left out.
+    '''
+    if not os.path.exists(archive.index_name(file_name)):
+        return None
+    entries = []
+    with open(archive.index_name(file_name)) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # only the last line can be written in part
+                if line.endswith('\n'):
+                    raise
+    return entries
+
+
+def iter_streams(file_name, offset=0):
+    '''
+    Yield (offset, length) of every compressed stream of a file,
+    from offset on, which has to be the start of a stream.
+    '''
+    if file_name.endswith('.bz2'):
+        new_decompressor = bz2.BZ2Decompressor
+    elif file_name.endswith('.gz'):
+        new_decompressor = lambda: zlib.decompressobj(31)
+    elif file_name.endswith('.zst'):
+        new_decompressor = archive.zstandard.ZstdDecompressor().decompressobj
+    else:
+        if os.path.getsize(file_name) > offset:
+            yield offset, os.path.getsize(file_name) - offset
+        return
+
+    with open(file_name, 'rb') as f:
+        f.seek(offset)
+        decompressor = new_decompressor()
+        start = offset
+        while True:
+            chunk = f.read(64*1024)
+            if not chunk:
+                break
+            while chunk:
+                decompressor.decompress(chunk)
+                if not decompressor.eof:
+                    offset += len(chunk)
+                    break
+                # stream ended within the chunk
+                used = len(chunk) - len(decompressor.unused_data)
+                offset += used
+                yield start, offset - start
+                start = offset
+                chunk = decompressor.unused_data
+                decompressor = new_decompressor()
+
+
+def build_index(file_name):
+    '''
+    Write the sidecar index of a file written without one.
+    Small streams are grouped into blocks of INDEX_BLOCK_BYTES,
+    a block of concatenated streams decompresses as one.
+    '''
+    entries = []
+    entry = None
+    with open(file_name, 'rb') as f:
+        for offset, length in iter_streams(file_name):
+            f.seek(offset)
+            data = decompress(f.read(length), file_name)
+            if entry is None:
+                entry = {'offset': offset, 'length': 0, 'count': 0, 'size': 0,
+                         'min_id': None, 'max_id': None, 'keywords': set()}
+            for line in data.splitlines():
+                if not line.strip():
+                    continue
+                tweet = json.loads(line)
+                entry['count'] += 1
+                entry['min_id'] = min(tweet['id'], entry['min_id'] or tweet['id'])
+                entry['max_id'] = max(tweet['id'], entry['max_id'] or tweet['id'])
+                entry['keywords'].update(archive.tweet_keywords(tweet))
+            entry['length'] = offset + length - entry['offset']
+            entry['size'] += len(data)
+            if entry['size'] >= INDEX_BLOCK_BYTES:
+                entries.append(entry)
+                entry = None
+    if entry is not None:
+        entries.append(entry)
+
+    if os.path.exists(archive.index_name(file_name)):
+        os.remove(archive.index_name(file_name))
+    for entry in entries:
+        if entry['count'] == 0:
+            continue
+        del entry['size']
+        entry['keywords'] = sorted(entry['keywords'])
+        archive.write_index_entry(file_name, entry)
+    logging.info('Indexed {} in {:d} blocks'.format(file_name, len(entries)))
+    return entries
+
+
+def parse_lines(data):
+    for line in data.splitlines():
+        if line.strip():
+            yield json.loads(line)
+
+
+def read_file(file_name, keyword=None, min_id=None, max_id=None):
+    '''
+    Yield tweets of one file, only the streams which can hold
+    tweets of the keyword and the id range are decompressed.
+    '''
+    entries = read_index(file_name)
+    if entries is None:
+        with archive.open_archive(file_name) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        return
+
+    end = 0
+    with open(file_name, 'rb') as f:
+        # streams written before the file got an index
+        first = min([i['offset'] for i in entries]) if entries else None
+        if first:
+            for tweet in read_unindexed(f, 0, first, file_name):
+                yield tweet
+
+        for entry in entries:
+            end = max(end, entry['offset'] + entry['length'])
+            if keyword and keyword not in entry['keywords']:
+                continue
+            if min_id and entry['max_id'] < min_id:
+                continue
+            if max_id and entry['min_id'] > max_id:
+                continue
+            f.seek(entry['offset'])
+            for tweet in parse_lines(decompress(f.read(entry['length']), file_name)):
+                yield tweet
+
+        # streams written after the last index entry
+        for tweet in read_unindexed(f, end, None, file_name):
+            yield tweet
+
+
+def read_unindexed(f, offset, length, file_name):
+    '''
+    Yield tweets of a part of a file not covered by its index.
+    '''
+    f.seek(offset)
+    data = f.read(length) if length else f.read()
+    if not data:
+        return
+    logging.debug('Reading unindexed part of ' + file_name)
+    try:
+        data = decompress(data, file_name)
+    except (EOFError, OSError, ValueError) as e:
+        # stream still being written or cut off
+        logging.warning('Could not read a part of ' + file_name)
+        logging.warning(str(e))
+        return
+    for tweet in parse_lines(data):
+        yield tweet
+
+
+def read_tweets(output_dir='tweets', start=None, end=None, keyword=None):
+    '''
+    Lazily yield archived tweets created from start to end date
+    (datetime.date, inclusive) which have the cashtag or hashtag
+    keyword, ex.: '$AAPL', '#bitcoin'.
+    '''
+    keyword = keyword.lower() if keyword else None
+    min_id = max_id = None
+    if start:
+        min_id = archive.time_to_id(_unix_time(start))
+    if end:
+        max_id = archive.time_to_id(_unix_time(end + datetime.timedelta(days=1))) - 1
+
+    for file_name in archive.archive_files(output_dir):
+        day = file_day(file_name)
+        # files are named by local date, tweet dates are utc
+        if start and day < start - datetime.timedelta(days=1):
+            continue
+        if end and day > end + datetime.timedelta(days=FETCH_LAG_DAYS):
+            continue
+        for tweet in read_file(file_name, keyword, min_id, max_id):
+            if min_id and tweet['id'] < min_id:
+                continue
+            if max_id and tweet['id'] > max_id:
+                continue
+            if keyword and keyword not in archive.tweet_keywords(tweet):
+                continue
+            yield tweet
+
+
+def get_tweet(output_dir, tweet_id):
+    '''
+    Find an archived tweet by its id, None if it is not archived.
+    '''
+    day = datetime.datetime.utcfromtimestamp(archive.tweet_time(tweet_id)).date()
+    for file_name in archive.archive_files(output_dir):
+        if not day - datetime.timedelta(days=1) <= file_day(file_name) \
+                <= day + datetime.timedelta(days=FETCH_LAG_DAYS):
+            continue
+        for tweet in read_file(file_name, min_id=tweet_id, max_id=tweet_id):
+            if tweet['id'] == tweet_id:
+                return tweet
+    return None
+
+
+def file_day(file_name):
+    '''
+    Date a tweets file was written.
+    '''
+    day = FILE_DAY.match(os.path.basename(file_name)).group(1)
+    return datetime.datetime.strptime(day, '%Y%m%d').date()
+
+
+def _unix_time(date):
+    return (datetime.datetime(date.year, date.month, date.day) -
+            datetime.datetime(1970, 1, 1)).total_seconds()
+
+
+def parse_date(text):
+    return datetime.datetime.strptime(text, '%Y-%m-%d').date()
+
+
+def read_command(args):
+    '''
+    The read subcommand, prints tweets as json lines.
+    '''
+    if args.build_index:
+        for file_name in archive.archive_files(args.output_dir):
+            if read_index(file_name) is None:
+                build_index(file_name)
+    count = 0
+    for tweet in read_tweets(args.output_dir, args.start, args.end, args.keyword):
+        print(json.dumps(tweet))
+        count += 1
+        if args.limit and count >= args.limit:
+            break
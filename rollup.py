@@ -0,0 +1,237 @@
+import os
+import time
+import sqlite3
+import logging
+from collections import Counter
+
+import archive
+import helpers
+import matcher
+import reader
+import scheduler
+
+
+# seconds per bucket of each rollup table
+RESOLUTIONS = {
+    'minute': 60,
+    'hour': 3600,
+    'day': 86400,
+    }
+# days the buckets of a resolution are kept, None for ever
+RETENTION_DAYS = {
+    'minute': 7,
+    'hour': 180,
+    'day': None,
+    }
+UPSERT = ('INSERT INTO rollup_%s (keyword, bucket, count) VALUES (?, ?, ?) '
+          'ON CONFLICT (keyword, bucket) DO UPDATE SET count=count+excluded.count')
+
+
+def load_keywords(db_file, keywords_file=None):
+    '''
+    Keywords counted: the keywords file, else the keywords table
+    as it is, the market lists are not asked.
+    '''
+    if keywords_file and os.path.exists(keywords_file):
+        return helpers.get_keywords_file(keywords_file)
+    with sqlite3.connect(db_file) as conn:
+        return [i[0] for i in conn.execute('SELECT keyword FROM keywords').fetchall()]
+
+
+def file_streams(file_name, offset):
+    '''
+    (offset, length) of the complete streams of a file
+    from offset on, from its index or read from the file.
+    '''
+    if offset >= os.path.getsize(file_name):
+        return []
+    entries = reader.read_index(file_name)
+    if entries is None:
+        return list(reader.iter_streams(file_name, offset))
+    return sorted([(i['offset'], i['length']) for i in entries if i['offset'] >= offset])
+
+
+def count_streams(file_name, streams, keyword_matcher):
+    '''
+    Tweets per (keyword, minute) of the streams of a file.
+    '''
+    counts = Counter()
+    tweets = 0
+    with open(file_name, 'rb') as f:
+        for offset, length in streams:
+            f.seek(offset)
+            for tweet in reader.parse_lines(reader.decompress(f.read(length), file_name)):
+                minute = helpers.parse_date(tweet['created_at']) // 60 * 60
+                for keyword in keyword_matcher.match(tweet):
+                    counts[(keyword, minute)] += 1
+                tweets += 1
+    return counts, tweets
+
+
+def add_counts(conn, counts, retention=RETENTION_DAYS, now=None):
+    '''
+    Add minute counts to the rollup tables of every resolution.
+    Buckets past the retention of a table are not added to it.
+    '''
+    now = now or time.time()
+    for resolution, seconds in RESOLUTIONS.items():
+        rows = Counter()
+        for (keyword, minute), count in counts.items():
+            rows[(keyword, minute // seconds * seconds)] += count
+        days = retention.get(resolution)
+        first = now - days*86400 if days else 0
+        conn.executemany(UPSERT % resolution,
+                         [(k, b, c) for (k, b), c in rows.items() if b >= first])
+
+
+def rollup_archive(db_file, output_dir, keywords, file_names=None, retention=RETENTION_DAYS):
+    '''
+    Count the tweets archived since the last rollup into the per
+    keyword minute, hour and day tables. Every file is read from
+    the end of the last stream rolled up, kept in rollup_files.
+    The counts and the new position of a file are written in one
+    transaction, only if the position did not move meanwhile, so
+    a stream is never counted twice.
+    Returns the number of tweets counted.
+    '''
+    keyword_matcher = matcher.KeywordMatcher(keywords)
+    if file_names is None:
+        file_names = archive.archive_files(output_dir)
+    conn = sqlite3.connect(db_file, timeout=60)
+    total = 0
+    try:
+        offsets = dict(conn.execute('SELECT file_name, offset FROM rollup_files').fetchall())
+        for file_name in file_names:
+            name = os.path.basename(file_name)
+            offset = offsets.get(name, 0)
+            streams = file_streams(file_name, offset)
+            if not streams:
+                continue
+            counts, tweets = count_streams(file_name, streams, keyword_matcher)
+            end = streams[-1][0] + streams[-1][1]
+            with conn:
+                conn.execute('INSERT OR IGNORE INTO rollup_files (file_name, offset, tweets) '
+                             'VALUES (?, 0, 0)', (name,))
+                c = conn.execute('UPDATE rollup_files SET offset=?, tweets=tweets+?, updated=? '
+                                 'WHERE file_name=? AND offset=?',
+                                 (end, tweets, time.time(), name, offset))
+                if c.rowcount == 0:
+                    logging.warning('Rollup of {} moved meanwhile, skipped.'.format(name))
+                    continue
+                add_counts(conn, counts, retention)
+            total += tweets
+    finally:
+        conn.close()
+    if total:
+        logging.info('Rolled up {:d} tweets'.format(total))
+    return total
+
+
+def replace_files(db_file, old_files, new_file):
+    '''
+    new_file holds the tweets of old_files, ex. merged shard files,
+    which were rolled up before: it is marked as rolled up to its
+    end and the old files are forgotten.
+    '''
+    names = [os.path.basename(i) for i in old_files]
+    with sqlite3.connect(db_file, timeout=60) as conn:
+        conn.execute('INSERT OR REPLACE INTO rollup_files (file_name, offset, tweets, updated) '
+                     'VALUES (?, ?, (SELECT IFNULL(SUM(tweets), 0) FROM rollup_files WHERE '
+                     'file_name IN (%s)), ?)' % ','.join('?'*len(names)),
+                     [os.path.basename(new_file), os.path.getsize(new_file)] + names + [time.time()])
+        conn.executemany('DELETE FROM rollup_files WHERE file_name=?',
+                         [(i,) for i in names if i != os.path.basename(new_file)])
+
+
+def prune(db_file, output_dir, retention=RETENTION_DAYS, now=None):
+    '''
+    Drop the buckets past the retention of their table and the
+    positions of files no longer in output_dir.
+    '''
+    now = now or time.time()
+    with sqlite3.connect(db_file, timeout=60) as conn:
+        for resolution, days in retention.items():
+            if days:
+                conn.execute('DELETE FROM rollup_%s WHERE bucket < ?' % resolution,
+                             (now - days*86400,))
+        files = set([os.path.basename(i) for i in archive.archive_files(output_dir)])
+        gone = [i[0] for i in conn.execute('SELECT file_name FROM rollup_files').fetchall()
+                if i[0] not in files]
+        conn.executemany('DELETE FROM rollup_files WHERE file_name=?', [(i,) for i in gone])
+
+
+def prune_searches(db_file, days, now=None):
+    '''
+    Delete the searches rows older than days, only asked for by
+    the rollup subcommand. The adaptive mode reads the last 7.
+    '''
+    now = now or time.time()
+    since = time.strftime(scheduler.DATE_FORMAT, time.localtime(now - days*86400))
+    with sqlite3.connect(db_file, timeout=60) as conn:
+        n = conn.execute('DELETE FROM searches WHERE search_date < ?', (since,)).rowcount
+    logging.info('Deleted {:d} searches rows older than {}'.format(n, since))
+
+
+def rollup_cycle(db_file, output_dir, keywords_file=None):
+    '''
+    Roll up new tweets and apply the retention of the rollup
+    tables, run after every search cycle. The searches rows are
+    kept. Errors are logged, not raised.
+    '''
+    try:
+        rollup_archive(db_file, output_dir, load_keywords(db_file, keywords_file))
+        prune(db_file, output_dir)
+    except Exception as e:
+        logging.warning('Rollup failed')
+        logging.warning(str(e))
+
+
+def pick_resolution(start, now=None):
+    '''
+    Finest resolution whose retention covers start.
+    '''
+    now = now or time.time()
+    for resolution in sorted(RESOLUTIONS, key=RESOLUTIONS.get):
+        days = RETENTION_DAYS[resolution]
+        if days is None or start >= now - days*86400:
+            return resolution
+
+
+def series(db_file, keyword, start, end, resolution=None):
+    '''
+    Tweets of a keyword per bucket from start to end (unix times,
+    end excluded), buckets without tweets included:
+    a list of (bucket unix time, count). The resolution is the
+    finest one kept back to start if not given.
+    '''
+    resolution = resolution or pick_resolution(start)
+    seconds = RESOLUTIONS[resolution]
+    first = int(start) // seconds * seconds
+    with sqlite3.connect(db_file) as conn:
+        counts = dict(conn.execute('SELECT bucket, count FROM rollup_%s WHERE keyword=? AND '
+                                   'bucket >= ? AND bucket < ?' % resolution,
+                                   (keyword, first, end)).fetchall())
+    return [(bucket, counts.get(bucket, 0)) for bucket in range(first, int(end), seconds)]
+
+
+def rollup_command(args):
+    '''
+    The rollup subcommand, rolls up with the given retention.
+    '''
+    retention = {'minute': args.minute_days, 'hour': args.hour_days, 'day': None}
+    rollup_archive(args.db_file, args.output_dir, load_keywords(args.db_file, args.keywords_file),
+                   retention=retention)
+    prune(args.db_file, args.output_dir, retention)
+    if args.searches_days:
+        prune_searches(args.db_file, args.searches_days)
+
+
+def series_command(args):
+    '''
+    The series subcommand, prints a csv line per bucket.
+    '''
+    start = reader._unix_time(args.start)
+    end = reader._unix_time(args.end) + 86400
+    print('time,' + args.keyword)
+    for bucket, count in series(args.db_file, args.keyword, start, end, args.resolution):
+        print('{},{:d}'.format(helpers.format_date(bucket), count))
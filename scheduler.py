@@ -0,0 +1,87 @@
+import sqlite3
+import heapq
+import logging
+from datetime import datetime, timedelta
+
+
+# Twitter search API allows 180 requests per 15 min window per user
+WINDOW_REQUESTS = 180
+# a single query returns at most 100 tweets
+TWEETS_PER_QUERY = 100
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def keyword_rates(db_file, history_days=7):
+    '''
+    Smoothed count, mean time between searches and last search date
+    for every keyword with search history.
+    Returns dict keyword -> (count, interval_sec, last_search)
+    '''
+    since = (datetime.now() - timedelta(days=history_days)).strftime(DATE_FORMAT)
+    with sqlite3.connect(db_file) as conn:
+        c = conn.cursor()
+        c.execute('SELECT keyword, count, search_date FROM exp_averages')
+        averages = c.fetchall()
+        c.execute('''SELECT keyword, COUNT(*), MIN(search_date), MAX(search_date)
+                     FROM searches WHERE search_date > ?
+                     GROUP BY keyword''', [since])
+        history = {i[0]: i[1:] for i in c.fetchall()}
+        c.close()
+
+    rates = {}
+    for keyword, count, search_date in averages:
+        if search_date is None:
+            continue
+        last_search = datetime.strptime(search_date, DATE_FORMAT)
+        n, first, last = history.get(keyword, (0, None, None))
+        if n > 1:
+            span = datetime.strptime(last, DATE_FORMAT) - datetime.strptime(first, DATE_FORMAT)
+            interval = span.total_seconds() / (n - 1)
+        else:
+            interval = None
+        rates[keyword] = (count or 0, interval, last_search)
+    return rates
+
+
+def keyword_priority(count, interval, last_search, now, max_age):
+    '''
+    Expected new tweets for one query of a keyword.
+    Keywords not searched for longer than max_age come first,
+    oldest first, so cold keywords are not starved.
+    '''
+    age = (now - last_search).total_seconds()
+    if age >= max_age.total_seconds():
+        return float('inf'), age
+    # tweets per second since the last search, the smoothed
+    # count is per search so scale it by the search interval
+    if interval:
+        expected = count * age / interval
+    else:
+        expected = count
+    return min(expected, TWEETS_PER_QUERY), age
+
+
+def schedule(keywords, db_file, max_age=timedelta(hours=6)):
+    '''
+    Yield keywords in order of expected new tweets per query.
+    New keywords without history are yielded first, then
+    keywords older than max_age, then the rest by priority.
+    The caller stops consuming when the request budget is spent.
+    '''
+    now = datetime.now()
+    rates = keyword_rates(db_file)
+
+    heap = []
+    for keyword in keywords:
+        if keyword not in rates:
+            # never searched, nothing to predict from
+            priority, age = float('inf'), float('inf')
+        else:
+            priority, age = keyword_priority(*rates[keyword], now=now, max_age=max_age)
+        # heapq is a min heap, negate to pop the highest first
+        heapq.heappush(heap, (-priority, -age, keyword))
+
+    logging.debug('Scheduled {:d} keywords'.format(len(heap)))
+    while heap:
+        priority, age, keyword = heapq.heappop(heap)
+        yield keyword
@@ -0,0 +1,412 @@
+import sqlite3
+import logging
+import threading
+import time
+from collections import defaultdict
+
+
+SEARCH_COLUMNS = ['keyword', 'count', 'min_date', 'max_date', 'max_id', 'search_date']
+INSERT_SEARCH = 'INSERT OR REPLACE INTO latest_search (%s) VALUES (%s)' % (
+    ','.join(SEARCH_COLUMNS), ','.join([':'+i for i in SEARCH_COLUMNS]))
+CHECKPOINT_COLUMNS = ['keyword', 'since_id', 'cursor', 'count', 'min_date', 'max_date', 'max_id', 'done']
+INSERT_CHECKPOINT = 'INSERT OR REPLACE INTO checkpoint (%s) VALUES (%s)' % (
+    ','.join(CHECKPOINT_COLUMNS), ','.join([':'+i for i in CHECKPOINT_COLUMNS]))
+SLICE_COLUMNS = ['keyword', 'day', 'since_id', 'max_id', 'cursor', 'count', 'done']
+INSERT_SLICE = 'INSERT OR %%s INTO backfill (%s) VALUES (%s)' % (
+    ','.join(SLICE_COLUMNS), ','.join([':'+i for i in SLICE_COLUMNS]))
+
+
+def merge_ranges(ranges):
+    '''
+    Merge (since_id, max_id) ranges of ids, since_id < id <= max_id,
+    which overlap or touch. Returns them sorted.
+    '''
+    merged = []
+    for since_id, max_id in sorted(ranges):
+        if merged and since_id <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], max_id))
+        else:
+            merged.append((since_id, max_id))
+    return merged
+
+
+def range_gaps(ranges):
+    '''
+    Ids between merged ranges, as (since_id, max_id) ranges, oldest first.
+    '''
+    return [(ranges[i][1], ranges[i+1][0]) for i in range(len(ranges) - 1)]
+
+
+class StatsStore(object):
+    '''
+    One connection to the stats db for the whole run.
+
+    Keyword stats of a cycle are kept in memory and written to
+    latest_search in a single transaction by commit(). max_id of all
+    keywords is loaded in one query by load_max_ids() and kept up to
+    date as stats are added, max_id only moves forward.
+    Safe to use from several search workers.
+
+    The progress of the current cycle is kept in the checkpoint
+    table, written by the same commits: keywords done and the
+    pagination cursor (max_id of the next page) with the running
+    stats of keywords in flight. A cycle interrupted by a crash
+    resumes from it, end_cycle() clears the keywords done.
+
+    With a shard, the store belongs to a worker process of the
+    coordinator: the keywords of a cycle are the ones assigned to
+    the shard, end_cycle() only clears them and iterations rows are
+    tagged with the shard. Several processes share the db file.
+
+    The coverage table keeps the ranges of tweet ids searched per
+    keyword, merged as they are written. A search cut short at a page
+    limit leaves a gap between its oldest page and the last search,
+    the gaps are what is left between the ranges of a keyword.
+    '''
+
+    def __init__(self, db_file, shard=None):
+        self.db_file = db_file
+        self.shard = shard
+        self.lock = threading.RLock()
+        # other processes can hold the write lock for a commit
+        self.conn = sqlite3.connect(db_file, timeout=60, check_same_thread=False)
+        # readers (scheduler, generate_tso) do not block the writes
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.max_ids = {}
+        self.pending = []
+        # keyword -> checkpoint row
+        self.checkpoint = {}
+        self.pending_checkpoint = {}
+        # (keyword, day) -> backfill slice row
+        self.pending_slices = {}
+        # (keyword, since_id, max_id) ranges searched
+        self.pending_coverage = []
+        # seconds spent writing and reading stats
+        self.sql_time = 0.0
+
+    def load_max_ids(self):
+        '''
+        max_id of every keyword searched before, keyword -> max_id.
+        '''
+        with self.lock:
+            start = time.time()
+            c = self.conn.execute('SELECT keyword, max_id FROM latest_search')
+            self.max_ids = {keyword: max_id for keyword, max_id in c.fetchall()}
+            c.close()
+            self.sql_time += time.time() - start
+        return self.max_ids
+
+    def load_checkpoint(self):
+        '''
+        Checkpoint of an unfinished cycle, keyword -> row.
+        '''
+        with self.lock:
+            start = time.time()
+            c = self.conn.execute('SELECT %s FROM checkpoint' % ','.join(CHECKPOINT_COLUMNS))
+            self.checkpoint = {row[0]: dict(zip(CHECKPOINT_COLUMNS, row)) for row in c.fetchall()}
+            c.close()
+            self.sql_time += time.time() - start
+        return self.checkpoint
+
+    def resume(self, keyword):
+        '''
+        Checkpoint row of a keyword with its pagination in flight, or None.
+        '''
+        with self.lock:
+            row = self.checkpoint.get(keyword)
+            if row is None or row['done'] or row['cursor'] is None:
+                return None
+            return row
+
+    def checkpoint_page(self, keyword, since_id, cursor, count, min_date, max_date, max_id):
+        '''
+        Queue the position of a pagination for the next commit,
+        cursor is the max_id of the next page.
+        '''
+        with self.lock:
+            row = {'keyword': keyword, 'since_id': since_id, 'cursor': cursor, 'count': count,
+                   'min_date': min_date, 'max_date': max_date, 'max_id': max_id, 'done': 0}
+            self.checkpoint[keyword] = row
+            self.pending_checkpoint[keyword] = row
+
+    def end_cycle(self):
+        '''
+        Write the stats of a finished cycle and clear its checkpoint.
+        Paginations that failed stay, the next cycle resumes them.
+        '''
+        with self.lock:
+            self.commit()
+            try:
+                with self.conn:
+                    if self.shard is None:
+                        self.conn.execute('DELETE FROM checkpoint WHERE done=1')
+                    else:
+                        self.conn.execute('DELETE FROM checkpoint WHERE done=1 AND keyword IN '
+                                          '(SELECT keyword FROM shard_keywords WHERE shard=?)',
+                                          (self.shard,))
+            except sqlite3.Error as e:
+                logging.warning('db error')
+                logging.warning(str(e))
+            self.checkpoint = {k: v for k, v in self.checkpoint.items() if not v['done']}
+
+    def first_dates(self):
+        '''
+        Date of the oldest tweet found per keyword, keyword -> min_date.
+        '''
+        with self.lock:
+            c = self.conn.execute('SELECT keyword, min_date FROM totals WHERE min_date IS NOT NULL')
+            first = dict(c.fetchall())
+            c.close()
+        return first
+
+    def add_slices(self, rows):
+        '''
+        Add backfill slices, slices already there are kept as they are.
+        '''
+        with self.lock:
+            try:
+                with self.conn:
+                    self.conn.executemany(INSERT_SLICE % 'IGNORE', rows)
+            except sqlite3.Error as e:
+                logging.warning('db error')
+                logging.warning(str(e))
+
+    def backfill_keywords(self):
+        '''
+        Keywords with backfill slices planned.
+        '''
+        with self.lock:
+            c = self.conn.execute('SELECT DISTINCT keyword FROM backfill')
+            keywords = set([i[0] for i in c.fetchall()])
+            c.close()
+        return keywords
+
+    def load_slices(self):
+        '''
+        Backfill slices not done yet, newest first.
+        '''
+        with self.lock:
+            c = self.conn.execute('SELECT %s FROM backfill WHERE done=0 ORDER BY day DESC, keyword'
+                                  % ','.join(SLICE_COLUMNS))
+            rows = [dict(zip(SLICE_COLUMNS, row)) for row in c.fetchall()]
+            c.close()
+        return rows
+
+    def slice_progress(self, row):
+        '''
+        Queue the cursor, count and state of a backfill slice for the next commit.
+        '''
+        with self.lock:
+            self.pending_slices[(row['keyword'], row['day'])] = dict(row)
+
+    def add_coverage(self, keyword, since_id, max_id):
+        '''
+        Queue a range of ids searched for a keyword for the next commit,
+        tweets with since_id < id <= max_id.
+        '''
+        if since_id is None or max_id is None or max_id < since_id:
+            return
+        with self.lock:
+            self.pending_coverage.append((keyword, int(since_id), int(max_id)))
+
+    def add_visit(self, keyword, since_id, max_id, cursor=None):
+        '''
+        Queue the ids covered by a search of a keyword since since_id,
+        max_id the newest tweet found. A search cut short, cursor the
+        max_id of its next page, covers the ids above the cursor only.
+        The first search of a keyword starts at the search horizon,
+        what a cut leaves below it is a gap too.
+        '''
+        if since_id is None:
+            # gaps imports the store
+            import gaps
+            since_id = gaps.horizon_id()
+        if cursor is None:
+            self.add_coverage(keyword, since_id, max_id)
+            return
+        self.add_coverage(keyword, cursor, max_id)
+        # since_id ends the range of the last search, the gap
+        # below the cursor is left even if that range is not there
+        self.add_coverage(keyword, since_id, since_id)
+
+    def load_gaps(self):
+        '''
+        Ids not searched between the ranges of every keyword,
+        keyword -> [(since_id, max_id)], oldest first.
+        '''
+        with self.lock:
+            start = time.time()
+            c = self.conn.execute('SELECT keyword, since_id, max_id FROM coverage '
+                                  'ORDER BY keyword, since_id')
+            ranges = defaultdict(list)
+            for keyword, since_id, max_id in c.fetchall():
+                ranges[keyword].append((since_id, max_id))
+            c.close()
+            self.sql_time += time.time() - start
+        gaps = {keyword: range_gaps(r) for keyword, r in ranges.items()}
+        return {keyword: g for keyword, g in gaps.items() if g}
+
+    def _write_coverage(self):
+        # merged with the ranges of the keyword already there,
+        # a keyword keeps one row more than its gaps
+        ranges = defaultdict(list)
+        for keyword, since_id, max_id in self.pending_coverage:
+            ranges[keyword].append((since_id, max_id))
+        for keyword, new in ranges.items():
+            c = self.conn.execute('SELECT since_id, max_id FROM coverage WHERE keyword=?', (keyword,))
+            merged = merge_ranges(c.fetchall() + new)
+            c.close()
+            self.conn.execute('DELETE FROM coverage WHERE keyword=?', (keyword,))
+            self.conn.executemany('INSERT INTO coverage (keyword, since_id, max_id) VALUES (?, ?, ?)',
+                                  [(keyword, since_id, max_id) for since_id, max_id in merged])
+
+    def since_id(self, keyword):
+        with self.lock:
+            return self.max_ids.get(keyword)
+
+    def _queue_search(self, search_stats):
+        keyword = search_stats['keyword']
+        current = self.max_ids.get(keyword)
+        max_id = int(search_stats['max_id']) if search_stats['max_id'] else None
+        # another worker could have searched
+        # the same keyword in the meantime
+        if current and (max_id is None or current > max_id):
+            max_id = current
+        if max_id:
+            self.max_ids[keyword] = max_id
+        self.pending.append(dict(search_stats, max_id=max_id))
+
+    def add_search(self, search_stats):
+        '''
+        Queue a latest_search row for the next commit,
+        the keyword is done in the checkpoint of the cycle.
+        '''
+        with self.lock:
+            self._queue_search(search_stats)
+            row = dict.fromkeys(CHECKPOINT_COLUMNS, None)
+            row.update({'keyword': search_stats['keyword'], 'done': 1})
+            self.checkpoint[search_stats['keyword']] = row
+            self.pending_checkpoint[search_stats['keyword']] = row
+
+    def add_searches(self, rows):
+        for row in rows:
+            self.add_search(row)
+
+    def add_boundaries(self, rows):
+        '''
+        Queue latest_search rows written outside of a search
+        cycle, the checkpoint is left as it is.
+        '''
+        with self.lock:
+            for row in rows:
+                self._queue_search(row)
+
+    def commit(self):
+        '''
+        Write all queued keyword stats and the checkpoint
+        in one transaction.
+        '''
+        with self.lock:
+            if len(self.pending) == 0 and len(self.pending_checkpoint) == 0 and \
+                    len(self.pending_slices) == 0 and len(self.pending_coverage) == 0:
+                return
+            start = time.time()
+            try:
+                with self.conn:
+                    self.conn.executemany(INSERT_SEARCH, self.pending)
+                    self.conn.executemany(INSERT_CHECKPOINT, list(self.pending_checkpoint.values()))
+                    self.conn.executemany(INSERT_SLICE % 'REPLACE', list(self.pending_slices.values()))
+                    self._write_coverage()
+                logging.debug('Stats written for {:d} keywords'.format(len(self.pending)))
+                self.pending = []
+                self.pending_checkpoint = {}
+                self.pending_slices = {}
+                self.pending_coverage = []
+            except sqlite3.Error as e:
+                logging.warning('db error')
+                logging.warning(str(e))
+            self.sql_time += time.time() - start
+
+    def assign_shards(self, assignment):
+        '''
+        Replace the keyword assignment, a list of (keyword, shard)
+        in the order of the keywords.
+        '''
+        with self.lock:
+            try:
+                with self.conn:
+                    self.conn.execute('DELETE FROM shard_keywords')
+                    self.conn.executemany('INSERT INTO shard_keywords (keyword, shard, position) '
+                                          'VALUES (?, ?, ?)',
+                                          [(k, s, i) for i, (k, s) in enumerate(assignment)])
+            except sqlite3.Error as e:
+                logging.warning('db error')
+                logging.warning(str(e))
+
+    def shard_keywords(self, shard=None):
+        '''
+        Keywords assigned to a shard, this store's shard by default.
+        '''
+        shard = self.shard if shard is None else shard
+        with self.lock:
+            c = self.conn.execute('SELECT keyword FROM shard_keywords WHERE shard=? '
+                                  'ORDER BY position', (shard,))
+            keywords = [i[0] for i in c.fetchall()]
+            c.close()
+        return keywords
+
+    def register_shard(self, shard, pid, keys, state):
+        '''
+        Add or update a worker process in the shards table.
+        '''
+        with self.lock:
+            try:
+                with self.conn:
+                    self.conn.execute('INSERT OR REPLACE INTO shards (shard, pid, keys, state, heartbeat) '
+                                      'VALUES (?, ?, ?, ?, ?)', (shard, pid, keys, state, time.time()))
+            except sqlite3.Error as e:
+                logging.warning('db error')
+                logging.warning(str(e))
+
+    def heartbeat(self):
+        '''
+        Tell the coordinator this shard's worker is alive.
+        '''
+        with self.lock:
+            try:
+                with self.conn:
+                    self.conn.execute('UPDATE shards SET heartbeat=? WHERE shard=?',
+                                      (time.time(), self.shard))
+            except sqlite3.Error as e:
+                logging.warning('db error')
+                logging.warning(str(e))
+
+    def shard_heartbeats(self):
+        '''
+        Last heartbeat of every shard, shard -> unix time.
+        '''
+        with self.lock:
+            c = self.conn.execute('SELECT shard, heartbeat FROM shards')
+            heartbeats = dict(c.fetchall())
+            c.close()
+        return heartbeats
+
+    def write_iteration(self, iteration_stats):
+        with self.lock:
+            if self.shard is not None:
+                iteration_stats = dict(iteration_stats, shard=self.shard)
+            keys = ','.join(iteration_stats.keys())
+            question_marks = ','.join(list('?'*len(iteration_stats)))
+            try:
+                with self.conn:
+                    self.conn.execute('INSERT INTO iterations ('+keys+') VALUES ('+question_marks+')',
+                                      list(iteration_stats.values()))
+            except sqlite3.Error as e:
+                logging.warning('db error')
+                logging.warning(str(e))
+
+    def close(self):
+        with self.lock:
+            self.commit()
+            self.conn.close()
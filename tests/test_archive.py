@@ -0,0 +1,92 @@
+import time
+
+import pytest
+
+import archive
+import reader
+
+
+def tweets(ids):
+    return [{'created_at': 'Mon Nov 06 14:00:00 +0000 2017', 'id': i,
+             'entities': {'symbols': [{'text': 'AAPL'}], 'hashtags': []}} for i in ids]
+
+
+FIRST_ID = archive.time_to_id(time.time() - 3600)
+
+
+def recent_ids(n, start=0):
+    return [FIRST_ID + (start + i)*4096 for i in range(n)]
+
+
+def test_seen_dedup():
+    seen = archive.SeenIndex(merge_size=10)
+    ids = recent_ids(50)
+    assert all([seen.add(i) for i in ids])
+    assert not any([seen.add(i) for i in ids])
+    assert len(seen) == 50
+    assert seen.pop_stats() == (50, 50)
+
+
+def test_seen_evicts():
+    seen = archive.SeenIndex(horizon_days=1, max_ids=20)
+    old = archive.time_to_id(time.time() - 2*86400)
+    seen.add(old)
+    for i in recent_ids(30):
+        seen.add(i)
+    seen.merge()
+    assert old not in seen
+    assert len(seen) == 20
+    assert recent_ids(30)[-1] in seen
+
+
+def test_writer_skips_seen(tmp_path):
+    seen = archive.SeenIndex()
+    with archive.ArchiveWriter(str(tmp_path), codec='gzip', seen=seen) as writer:
+        writer.write(tweets(recent_ids(10)))
+        writer.write(tweets(recent_ids(10, start=5)))
+    assert sorted(archive.read_ids(writer.file_name)) == recent_ids(15)
+
+
+@pytest.mark.parametrize('codec', ['bz2', 'gzip', 'none'])
+def test_seen_rebuild(tmp_path, codec):
+    with archive.ArchiveWriter(str(tmp_path), codec=codec) as writer:
+        writer.write(tweets(recent_ids(100)))
+    seen = archive.SeenIndex()
+    seen.rebuild(str(tmp_path))
+    assert len(seen) == 100
+    assert not seen.add(recent_ids(100)[42])
+    assert seen.add(recent_ids(1, start=100)[0])
+
+
+def test_read_index_partial_line(tmp_path):
+    with archive.ArchiveWriter(str(tmp_path), codec='gzip', flush_bytes=0) as writer:
+        writer.write(tweets(recent_ids(3)))
+        writer.write(tweets(recent_ids(2, start=3)))
+    with open(archive.index_name(writer.file_name), 'a') as f:
+        f.write('{"offset": 12')
+    entries = reader.read_index(writer.file_name)
+    assert [i['count'] for i in entries] == [3, 2]
+
+
+def test_read_index_broken_line(tmp_path):
+    with archive.ArchiveWriter(str(tmp_path), codec='gzip') as writer:
+        writer.write(tweets(recent_ids(3)))
+    with open(archive.index_name(writer.file_name), 'a') as f:
+        f.write('{"offset": 12\n')
+    with pytest.raises(ValueError):
+        reader.read_index(writer.file_name)
+
+
+@pytest.mark.parametrize('cut', [20, 58])
+def test_seen_rebuild_partial_line(tmp_path, cut):
+    with archive.ArchiveWriter(str(tmp_path), codec='none') as writer:
+        writer.write(tweets(recent_ids(10)))
+    last = recent_ids(1, start=10)[0]
+    # cut off before the id or within its digits
+    with open(writer.file_name, 'a') as f:
+        f.write(archive.dumps_lines(tweets([last])).decode('utf-8')[:cut])
+    seen = archive.SeenIndex()
+    seen.rebuild(str(tmp_path))
+    assert len(seen) == 10
+    assert last not in seen
+    assert sorted(archive.read_ids(writer.file_name)) == recent_ids(10)
@@ -0,0 +1,35 @@
+import calendar
+import datetime
+
+import archive
+import backfill
+
+
+# 2017-11-06 01:30 UTC, a day earlier in time zones west of UTC
+NOW = calendar.timegm((2017, 11, 6, 1, 30, 0))
+
+
+def test_slices_utc_days():
+    boundary = archive.time_to_id(NOW)
+    rows = backfill.plan_slices(['$A'], {'$A': boundary}, days=7, now=NOW)
+    assert [r['day'] for r in rows] == ['2017-10-30', '2017-10-31', '2017-11-01', '2017-11-02',
+                                        '2017-11-03', '2017-11-04', '2017-11-05', '2017-11-06']
+    for row in rows:
+        day = datetime.datetime.strptime(row['day'], '%Y-%m-%d').date()
+        start = calendar.timegm(day.timetuple())
+        assert archive.tweet_time(row['since_id'] + 1) >= start
+        assert archive.tweet_time(row['max_id']) < start + 86400
+        assert row['cursor'] == row['max_id'] and row['done'] == 0
+    # the slices follow each other from the horizon to the boundary
+    assert rows[0]['since_id'] == archive.time_to_id(NOW - 7*86400) - 1
+    assert all([a['max_id'] == b['since_id'] for a, b in zip(rows, rows[1:])])
+    assert rows[-1]['max_id'] == boundary - 1
+
+
+def test_slices_below_boundary():
+    boundaries = {'$A': archive.time_to_id(NOW - 3*86400), '$B': archive.time_to_id(NOW - 10*86400)}
+    rows = backfill.plan_slices(['$A', '$B'], boundaries, days=7, now=NOW)
+    assert [r['day'] for r in rows] == ['2017-10-30', '2017-10-31', '2017-11-01', '2017-11-02',
+                                        '2017-11-03']
+    assert set([r['keyword'] for r in rows]) == {'$A'}
+    assert rows[-1]['max_id'] == boundaries['$A'] - 1
@@ -0,0 +1,49 @@
+import os
+
+import pytest
+
+import archive
+import compact
+import helpers
+import fake_twitter
+
+
+def write_file(file_name, ids):
+    tweets = [fake_twitter.synthetic_tweet(i, ('$a',)) for i in ids]
+    with open(file_name, 'ab') as f:
+        archive._write_stream(f, file_name, [archive.dumps_lines(tweets)], ids, set(['$a']), 'gzip')
+
+
+@pytest.mark.parametrize('crash', ['replace', 'remove'])
+def test_finish_after_crash(tmp_path, monkeypatch, crash):
+    output_dir = str(tmp_path)
+    db_file = str(tmp_path / 'search_stats.db')
+    helpers.check_db(db_file)
+    ids = [archive.time_to_id(1509926400) + i*4096 for i in range(30)]
+    file_names = [os.path.join(output_dir, 'tweets_20171106.json.gz'),
+                  os.path.join(output_dir, 'tweets_20171106_backfill.json.gz'),
+                  os.path.join(output_dir, 'tweets_20171106_01.json.gz')]
+    for i, file_name in enumerate(file_names):
+        write_file(file_name, ids[i*10:(i+1)*10])
+    out_name = file_names[0]
+
+    # the process dies at the rename of the new file or at the
+    # removal of the files it replaces
+    failing = getattr(os, crash)
+
+    def crashing(*args):
+        if crash == 'replace' or args[0] == file_names[2]:
+            raise KeyboardInterrupt
+        return failing(*args)
+    monkeypatch.setattr(os, crash, crashing)
+    with pytest.raises(KeyboardInterrupt):
+        compact.compact_day(file_names, out_name, 'gzip')
+    monkeypatch.setattr(os, crash, failing)
+    assert os.path.exists(compact.journal_name(out_name))
+
+    compact.finish_journals(output_dir, db_file)
+    assert archive.archive_files(output_dir) == [out_name]
+    assert sorted(archive.read_ids(out_name)) == ids
+    assert compact.is_compacted([out_name], 'gzip')
+    assert not os.path.exists(compact.journal_name(out_name))
+    assert not os.path.exists(compact.temp_name(out_name))
@@ -0,0 +1,61 @@
+import os
+import time
+import calendar
+import datetime
+
+import pytest
+
+import archive
+import fake_twitter
+
+pq = pytest.importorskip('pyarrow.parquet')
+import export
+
+
+def write_file(output_dir, name, ids, indexed=True):
+    file_name = os.path.join(output_dir, name)
+    tweets = [fake_twitter.synthetic_tweet(i, ('$a',)) for i in ids]
+    with open(file_name, 'ab') as f:
+        if indexed:
+            archive._write_stream(f, file_name, [archive.dumps_lines(tweets)],
+                                  ids, set(['$a']), 'gzip')
+        else:
+            f.write(archive.compress(archive.dumps_lines(tweets), 'gzip'))
+    return file_name
+
+
+def day_id(day, hour):
+    return archive.time_to_id(calendar.timegm(day.timetuple()) + hour*3600)
+
+
+def exported_ids(export_dir, day):
+    table = pq.read_table(export.partition_file(export_dir, day))
+    return sorted(table.column('id').to_pylist())
+
+
+def test_export_created_days(tmp_path):
+    output_dir, export_dir = str(tmp_path / 'tweets'), str(tmp_path / 'parquet')
+    os.makedirs(output_dir)
+    today = datetime.datetime.utcnow().date()
+    day1, day2, day3 = [today - datetime.timedelta(days=i) for i in (5, 4, 3)]
+    ids1 = [day_id(day1, 23) + i*4096 for i in range(10)]
+    ids2 = [day_id(day2, 1) + i*4096 for i in range(10)]
+    # fetched the next day, a shard and the backfill got some twice
+    write_file(output_dir, 'tweets_%s.json.gz' % day2.strftime('%Y%m%d'), ids1 + ids2[:5])
+    write_file(output_dir, 'tweets_%s_shard01.json.gz' % day2.strftime('%Y%m%d'), ids2[3:])
+    write_file(output_dir, 'tweets_%s_backfill.json.gz' % day3.strftime('%Y%m%d'), ids1[:4],
+               indexed=False)
+
+    export.export_archive(output_dir, export_dir)
+    assert exported_ids(export_dir, day1) == ids1
+    assert exported_ids(export_dir, day2) == ids2
+    assert sorted(os.listdir(export_dir)) == ['date=' + day1.isoformat(), 'date=' + day2.isoformat()]
+
+    # a day is exported again when a file with its tweets changed
+    time.sleep(0.01)
+    more = [day_id(day1, 0) + i*4096 for i in range(3)]
+    write_file(output_dir, 'tweets_%s_backfill_01.json.gz' % day3.strftime('%Y%m%d'), more)
+    mtime = os.path.getmtime(export.partition_file(export_dir, day2))
+    export.export_archive(output_dir, export_dir)
+    assert exported_ids(export_dir, day1) == sorted(ids1 + more)
+    assert os.path.getmtime(export.partition_file(export_dir, day2)) == mtime
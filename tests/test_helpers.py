@@ -0,0 +1,44 @@
+import helpers
+
+
+def packed(rows, **kwargs):
+    groups = helpers.pack_keywords(rows, **kwargs)
+    assert sorted([r for g in groups for r in g]) == sorted(rows)
+    return groups
+
+
+def test_pack_url_limit():
+    rows = [('$K{:04d}'.format(i), 0, 10**18 + i) for i in range(500)]
+    groups = packed(rows)
+    assert len(groups) < len(rows) / 10
+    for group in groups:
+        assert len(helpers.query_tso(group).create_search_url()) <= helpers.MAX_QUERY_URL
+
+
+def test_pack_url_limit_phrases():
+    # phrases are quoted, spaces and quotes are longer in the url
+    rows = [('some long phrase {:d}'.format(i), 1, None) for i in range(50)]
+    for group in packed(rows, max_tweets=10**6):
+        assert len(helpers.query_tso(group).create_search_url()) <= helpers.MAX_QUERY_URL
+
+
+def test_pack_tweet_limit():
+    rows = [('$K{:d}'.format(i), 30, 10**18) for i in range(20)]
+    groups = packed(rows)
+    for group in groups:
+        assert sum([r[1] for r in group]) <= helpers.PAGE_TWEETS
+    # three keywords of 30 tweets fit a page of 100
+    assert len(groups) == 7
+
+
+def test_pack_alone():
+    rows = [('$NEW', None, None), ('$HOT', 500, 10**18), ('$A', 1, 10**18), ('$B', 1, 10**18)]
+    groups = packed(rows)
+    assert [('$NEW', None, None)] in groups
+    assert [('$HOT', 500, 10**18)] in groups
+    assert sorted(map(sorted, groups))[0] == [('$A', 1, 10**18), ('$B', 1, 10**18)]
+
+
+def test_query_since_id():
+    tso = helpers.query_tso([('$A', 1, 300), ('$B', 1, 200), ('$C', None, None)])
+    assert tso.arguments['since_id'] == '200'
@@ -0,0 +1,39 @@
+import matcher
+
+
+def tweet(text, symbols=(), hashtags=()):
+    return {'text': text, 'entities': {'symbols': [{'text': i} for i in symbols],
+                                       'hashtags': [{'text': i} for i in hashtags]}}
+
+
+def test_cashtag_with_dot():
+    m = matcher.KeywordMatcher(['$BRK.B', '$BRK.A', '$AAPL'])
+    assert m.match(tweet('buying $BRK.B today', symbols=['BRK.B'])) == {'$BRK.B'}
+    assert m.match(tweet('$brk.a and $AAPL')) == {'$BRK.A', '$AAPL'}
+    assert m.match(tweet('$BRK is up')) == set()
+
+
+def test_ampersand():
+    m = matcher.KeywordMatcher(['S&P', 'AT&T'])
+    assert m.match(tweet('The S&P 500 fell')) == {'S&P'}
+    assert m.match(tweet('#AT&T outage')) == {'AT&T'}
+    assert m.match(tweet('SP500 and ATT')) == set()
+
+
+def test_hashtag_and_word():
+    m = matcher.KeywordMatcher(['bitcoin', '#eth', 'bear market'])
+    assert m.match(tweet('#Bitcoin rally', hashtags=['Bitcoin'])) == {'bitcoin'}
+    assert m.match(tweet('bitcoin rally')) == {'bitcoin'}
+    assert m.match(tweet('$BITCOIN')) == {'bitcoin'}
+    # a hashtag keyword does not match the plain word
+    assert m.match(tweet('eth is up')) == set()
+    assert m.match(tweet('#ETH is up', hashtags=['ETH'])) == {'#eth'}
+    assert m.match(tweet('a #bear #market')) == {'bear market'}
+
+
+def test_phrase_parts():
+    m = matcher.KeywordMatcher(['bear market'])
+    t = tweet('no bear', hashtags=['market'])
+    assert m.match(t) == set()
+    t['quoted_status'] = tweet('bear market ahead')
+    assert m.match(t) == {'bear market'}
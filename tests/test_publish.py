@@ -0,0 +1,24 @@
+import socket
+
+import pytest
+
+import publish
+
+
+def test_unix_address_not_a_socket(tmp_path):
+    path = tmp_path / 'tweets.db'
+    path.write_text('data')
+    with pytest.raises(ValueError):
+        publish.Publisher(str(path))
+    assert path.read_text() == 'data'
+
+
+def test_unix_address_stale_socket(tmp_path):
+    path = str(tmp_path / 'tweets.sock')
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()
+    publisher = publish.Publisher(path)
+    assert publish.is_socket(path)
+    publisher.close()
+    assert not (tmp_path / 'tweets.sock').exists()
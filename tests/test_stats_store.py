@@ -0,0 +1,85 @@
+import time
+
+import pytest
+
+import archive
+import helpers
+import stats_store
+import gaps
+
+
+@pytest.fixture
+def store(tmp_path):
+    db_file = str(tmp_path / 'search_stats.db')
+    helpers.check_db(db_file)
+    store = stats_store.StatsStore(db_file)
+    yield store
+    store.close()
+
+
+def test_merge_ranges():
+    assert stats_store.merge_ranges([(10, 20), (0, 5), (20, 30), (15, 18), (40, 50)]) == \
+        [(0, 5), (10, 30), (40, 50)]
+    # since_id < id <= max_id, (5, 10] and (0, 5] touch
+    assert stats_store.merge_ranges([(5, 10), (0, 5)]) == [(0, 10)]
+    assert stats_store.merge_ranges([]) == []
+
+
+def test_range_gaps():
+    assert stats_store.range_gaps([(0, 5), (10, 30), (40, 50)]) == [(5, 10), (30, 40)]
+    assert stats_store.range_gaps([(0, 5)]) == []
+
+
+def test_coverage_merged(store):
+    store.add_coverage('$A', 100, 200)
+    store.add_coverage('$A', 300, 400)
+    store.commit()
+    assert store.load_gaps() == {'$A': [(200, 300)]}
+    store.add_coverage('$A', 250, 300)
+    store.add_coverage('$B', 0, 10)
+    store.commit()
+    assert store.load_gaps() == {'$A': [(200, 250)]}
+    store.add_coverage('$A', 150, 260)
+    store.commit()
+    assert store.load_gaps() == {}
+    rows = store.conn.execute('SELECT since_id, max_id FROM coverage WHERE keyword=?', ('$A',))
+    assert rows.fetchall() == [(100, 400)]
+
+
+def test_visit_cut_short(store):
+    # a search since 100 which found 1000 and stopped at the cursor 600
+    store.add_visit('$A', 100, 1000, cursor=600)
+    store.commit()
+    assert store.load_gaps() == {'$A': [(100, 600)]}
+
+
+def test_gaps_expire(store):
+    now = time.time()
+    horizon = gaps.horizon_id(now)
+    day = archive.time_to_id(now - 86400) - archive.time_to_id(now - 2*86400)
+    # one gap past the horizon, one across it, one within
+    for since_id, max_id in [(horizon - 5*day, horizon - 4*day), (horizon - 3*day, horizon - 2*day),
+                             (horizon + day, horizon + 2*day), (horizon + 3*day, horizon + 4*day)]:
+        store.add_coverage('$A', since_id, max_id)
+    store.commit()
+    assert len(store.load_gaps()['$A']) == 3
+    plan = gaps.plan_gaps(store, now=now)
+    assert [(r['since_id'], r['max_id']) for r in plan['$A']] == \
+        [(horizon, horizon + day), (horizon + 2*day, horizon + 3*day)]
+    assert gaps.plan_gaps(store, keywords=['$B'], now=now) == {}
+
+
+def test_checkpoint_resume(store):
+    store.add_search({'keyword': '$A', 'count': 3, 'min_date': None, 'max_date': None,
+                      'max_id': 500, 'search_date': '2017-11-06 10:00:00'})
+    store.checkpoint_page('$B', 100, 700, 50, '2017-11-06 09:00:00', '2017-11-06 10:00:00', 900)
+    store.commit()
+
+    # a new run after a crash in the middle of the pagination of $B
+    resumed = stats_store.StatsStore(store.db_file)
+    checkpoint = resumed.load_checkpoint()
+    assert checkpoint['$A']['done'] == 1
+    assert resumed.resume('$A') is None
+    row = resumed.resume('$B')
+    assert (row['since_id'], row['cursor'], row['count'], row['max_id']) == (100, 700, 50, 900)
+    resumed.close()
@@ -0,0 +1,83 @@
+import time
+
+import pytest
+
+import archive
+import helpers
+import pipeline
+import stats_store
+import fake_twitter
+import twitter_search
+
+
+class Keys(object):
+    consumer_key = consumer_secret = access_token = access_token_secret = 'x'
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    fake = fake_twitter.FakeTwitter(window_requests=10**6, window_sec=900)
+    server = fake_twitter.serve(fake)
+    monkeypatch.setattr(twitter_search, 'api_url', server.api_url)
+    yield fake
+    server.shutdown()
+
+
+def search(store, writer, keyword, fail_after=None, fake=None):
+    '''
+    Search a keyword as a worker of a cycle does, the
+    fake backend fails after fail_after requests.
+    '''
+    if fail_after is not None:
+        requests = fake.requests + fail_after
+        search = fake.search
+
+        def failing(params):
+            if fake.requests > requests:
+                raise IOError('connection lost')
+            return search(params)
+        fake.search = failing
+    ts = twitter_search.get_ts(Keys)
+    pages = pipeline.Pipeline()
+    since_id, cursor, stats = twitter_search.resume_keyword(store, keyword)
+    try:
+        stats, windows, n_pages, cursor = twitter_search.search_keyword(
+            ts, keyword, since_id, pages, writer, store, None, cursor=cursor, stats=stats)
+        pages.submit(twitter_search.keyword_done, keyword, since_id, stats, store, cursor)
+    finally:
+        pages.close()
+        twitter_search.flush(writer, store)
+    return stats
+
+
+def test_resume_pagination(fake, tmp_path):
+    first_id = archive.time_to_id(time.time() - 3600)
+    ids = [first_id + i*4096 for i in range(350)]
+    for i in ids:
+        fake.add_tweet(i, ('$a',))
+    db_file = str(tmp_path / 'search_stats.db')
+    helpers.check_db(db_file)
+    writer = archive.ArchiveWriter(str(tmp_path / 'tweets'), codec='gzip')
+
+    # 100 tweets per page, the 3rd request fails
+    store = stats_store.StatsStore(db_file)
+    with pytest.raises(Exception):
+        search(store, writer, '$A', fail_after=2, fake=fake)
+    store.close()
+
+    # the next run resumes the cycle at the page after the last one written
+    store = stats_store.StatsStore(db_file)
+    assert twitter_search.resume_cycle(['$A', '$B'], store) == ['$A', '$B']
+    row = store.resume('$A')
+    assert (row['cursor'], row['count']) == (ids[-200] - 1, 200)
+    del fake.search
+    stats = search(store, writer, '$A')
+    assert stats.count == 350
+    store.end_cycle()
+    writer.close()
+
+    assert sorted(archive.read_ids(writer.file_name)) == ids
+    assert store.load_checkpoint() == {}
+    assert store.load_max_ids() == {'$A': ids[-1]}
+    assert store.load_gaps() == {}
+    store.close()
@@ -6,152 +6,550 @@ Created on Mon Jun  5 22:31:17 2017
 """
 
 import TwitterSearch 
-import pandas as pd
-import sqlite3
 import pause
 import logging
 import time
 import os
-import json
-import bz2
 import argparse
+import signal
+import functools
+import threading
+import queue
+import asyncio
 import sys
+from datetime import timedelta
 from tqdm import tqdm
 # my helper funcstions
 import helpers
+import scheduler
+import archive
+import reader
+import rollup
+import compact
+import publish
+import async_search
+import stats_store
+import pipeline
+import metrics
+import backfill
+import gaps
+import coordinator
+import matcher
+import universe
 
-def twitter_search(db_file, output_dir, keywords_file):
+# Twitter API, or a local server like fake_twitter
+api_url = async_search.API_URL
 
-    ts = TwitterSearch.TwitterSearch(
-            consumer_key = twitter_keys.consumer_key,
-            consumer_secret = twitter_keys.consumer_secret,
-            access_token = twitter_keys.access_token,
-            access_token_secret = twitter_keys.access_token_secret
-        )
-    
-    start = time.time()
-    window_count = 1
-    conn = sqlite3.connect(db_file)
-    c = conn.cursor()
+
+def get_ts(keys):
+    '''
+    TwitterSearch client for a module holding app keys.
+    '''
+    return helpers.get_ts(keys, api_url)
+
+
+def search_keyword(ts, keyword, since_id, pages, writer, store, pbar, keys=None,
+                   cursor=None, stats=None, max_pages=None):
+    '''
+    Search a single keyword, following all pages since since_id or
+    max_pages of them, from the cursor (max_id) and stats of a resumed
+    pagination. Pages are written, counted and checkpointed by the
+    pages pipeline. Returns the keyword stats, complete once the
+    pipeline processed the pages, the number of windows slept and of
+    pages, and the max_id of the next page if max_pages cut it short.
+    '''
+    tso = TwitterSearch.TwitterSearchOrder()
+    tso.set_include_entities(True)
+    tso.set_result_type('recent')
+    tso.set_keywords([keyword])
+    # only look for tweets since last search..
+    if since_id: tso.set_since_id(since_id)
     
+    if stats is None:
+        stats = helpers.KeywordStats()
+
+    def on_page(tweets):
+        pages.submit(process_page, tweets, writer, stats, store, keyword, since_id)
+
+    window_count, n_pages, cursor = helpers.follow_pages(ts, tso, on_page, pages, cursor=cursor,
+                                                         max_pages=max_pages, keys=keys,
+                                                         base_url=api_url, pbar=pbar)
+    return stats, window_count, n_pages, cursor
+
+
+def process_page(tweets, writer, stats, store, keyword, since_id):
+    '''
+    Write a page of a keyword search, add it to the keyword stats
+    and checkpoint the pagination after it.
+    '''
+    with metrics.timer('write_tweets'):
+        writer.write(tweets)
+    publish.publish([keyword], tweets)
+    with metrics.timer('parse'):
+        stats.update_page(tweets)
+    if len(tweets) != 0:
+        # next page are the tweets older than this one
+        cursor = min([t['id'] for t in tweets]) - 1
+        store.checkpoint_page(keyword, since_id, cursor, stats.count,
+                              stats.min_date, stats.max_date, stats.max_id)
+
+
+def resume_keyword(store, keyword):
+    '''
+    since_id, cursor and stats to search a keyword with,
+    from the checkpoint if its pagination was interrupted.
+    '''
+    stats = helpers.KeywordStats()
+    row = store.resume(keyword)
+    if row is None:
+        # only look for tweets since last search..
+        return store.since_id(keyword), None, stats
+    logging.debug('Resuming {} at max_id {}'.format(keyword, row['cursor']))
+    stats.update(row['count'], row['min_date'], row['max_date'], row['max_id'])
+    return row['since_id'], row['cursor'], stats
+
+
+def resume_cycle(keywords, store):
+    '''
+    Keywords left to search in a cycle interrupted by a crash,
+    in the same order, else all keywords.
+    '''
+    checkpoint = store.load_checkpoint()
+    left = [i for i in keywords if not (i in checkpoint and checkpoint[i]['done'])]
+    if len(left) == 0:
+        # the last cycle was finished, only its checkpoint was left
+        store.end_cycle()
+        return keywords
+    if len(left) < len(keywords):
+        logging.info('Resuming the last cycle, {:d} of {:d} keywords left.'.format(
+                     len(left), len(keywords)))
+    return left
+
+
+def load_keywords(store, keywords_file):
+    '''
+    Keywords of a cycle: the ones assigned to the shard of a
+    coordinator worker, else the keywords file or table.
+    '''
+    if store.shard is not None:
+        return store.shard_keywords()
     if keywords_file:
-        keywords = helpers.get_keywords_file(keywords_file)
-    else:
-        keywords = helpers.get_keywords_sql(db_file)
+        return helpers.get_keywords_file(keywords_file)
+    return helpers.get_keywords_sql(store.db_file)
+
+
+def keyword_done(keyword, since_id, stats, store, cursor=None):
+    store.add_search(stats.row(keyword, since_id))
+    store.add_visit(keyword, since_id, stats.max_id, cursor)
+    metrics.keyword_searched(keyword, stats, since_id)
 
 
-    pbar = tqdm(keywords)
-    for keyword in pbar:
+def flush(writer, store):
+    '''
+    Write buffered tweets and keyword stats, done
+    while the fetchers wait for the rate limit.
+    '''
+    with metrics.timer('write_tweets'):
+        writer.flush()
+    with metrics.timer('stats'):
+        store.commit()
+
+
+def queries_submitted(clients):
+    return sum([i['ts'].get_statistics()[0] for i in clients if i['ts']])
+
+
+def search_worker(keys, tasks, pages, store, writer, pbar, clients, budget=None,
+                  max_pages=None, gap_rows=None):
+    '''
+    Take keywords from the shared tasks queue and search them with
+    own credentials, so each worker sleeps in its own rate-limit window.
+    A keyword gets at most max_pages per visit, its gaps get the pages
+    left after the new tweets.
+    Stops when the queue is empty or all clients used up the budget.
+    '''
+    client = {'ts': None, 'windows_used': 1, 'error': None}
+    clients.append(client)
+    try:
+        ts = get_ts(keys)
+    except Exception as e:
+        logging.warning('Worker could not connect.')
+        logging.warning(str(e))
+        client['error'] = e
+        return
+    client['ts'] = ts
+
+    while True:
+        if budget and queries_submitted(clients) >= budget:
+            break
+        try:
+            keyword = tasks.get_nowait()
+        except queue.Empty:
+            break
         logging.debug('Getting: ' + keyword)
-        # keyword = keyword.replace('/','_')
         pbar.set_description("Processing {:10}".format(keyword))
         pbar.refresh()
-        
-        tso = TwitterSearch.TwitterSearchOrder()
-        tso.set_include_entities(True)
-        tso.set_result_type('recent')
-        tso.set_keywords([keyword])
-        
-        # only look for tweets since last search..
-        c.execute('SELECT max_id FROM latest_search WHERE keyword=?',
-                  [keyword])
-        fetched = c.fetchone()
-        since_id = fetched[0] if not fetched is None else None
-        if since_id: tso.set_since_id(since_id)
-        
-        ts.search_tweets(tso)
-        
-        max_id = []
-        max_date = []
-        min_date = [] 
-        count = []
-        
-        try_next = True
-        while try_next:     
-            # parse response
-            meta = ts.get_metadata()
-            remaining_limit = int(meta.get('x-rate-limit-remaining',0))            
-            num_tweets = ts.get_amount_of_tweets()
-
-            tweets = ts.get_tweets().get('statuses', [])
-            helpers.write_tweets(tweets, output_dir)
-            
-            if num_tweets != 0:
-                max_id.append(max([tweet['id'] for tweet in tweets]))
-                max_date.append(max([pd.to_datetime(tweet['created_at'], utc=True) for tweet in tweets]))
-                min_date.append(min([pd.to_datetime(tweet['created_at'], utc=True) for tweet in tweets]))
-                count.append(num_tweets)
-            
-            if remaining_limit == 0:
-                try:
-                    limit_reset = int(meta.get('x-rate-limit-reset', time.time()+15*60)) + 10 # extra sec to be on the safe side
-                    # convert to correct datetime
-                    limit_reset_dt = pd.to_datetime(limit_reset, unit='s', utc=True)
-                    limit_reset_dt = limit_reset_dt.tz_convert('Europe/London')
-                    pbar.set_description('Sleeping until {:%H:%M:%S}'.format(limit_reset_dt))
-                    pbar.refresh()
-                    pause.until(limit_reset)
-                    pbar.set_description("Processing %s" % keyword)
-                    pbar.refresh()
-                    window_count += 1
-                except Exception as e:
-                    logging.warn('limit_reset ERROR: '+keyword)
-                    logging.warn(str(e))
-                    logging.warn('Sleep for 15min...')
-                     # wait the maximum time until next window...
-                    pbar.set_description("Sleeping for 15 min.")
-                    pbar.refresh()
-
-                    pause.minutes(15)
-
-                    pbar.set_description("Processing {:10}".format(keywords))
-                    pbar.refresh()
-                    window_count += 1
-
-            # check if there is a next page for this search
+
+        since_id, cursor, stats = resume_keyword(store, keyword)
+
+        try:
+            stats, windows, n_pages, cursor = search_keyword(
+                ts, keyword, since_id, pages, writer, store, pbar, keys,
+                cursor=cursor, stats=stats, max_pages=max_pages)
+        except Exception as e:
+            # leave the keyword for the other workers
+            logging.warning('Worker stopped on: ' + keyword)
+            logging.warning(str(e))
+            tasks.put(keyword)
+            client['error'] = e
+            break
+        client['windows_used'] += windows
+
+        pages.submit(keyword_done, keyword, since_id, stats, store, cursor)
+        pbar.update(1)
+
+        rows = (gap_rows or {}).get(keyword)
+        if rows and (not max_pages or n_pages < max_pages):
             try:
-                try_next = ts.search_next_results()
-            except:
-                try_next = False
-    
-        # stats and logging for current keyword
-        max_id = max(max_id) if len(max_id) !=0 else since_id
-        max_date = max(max_date) if len(max_date) !=0 else None
-        min_date = min(min_date) if len(min_date) !=0 else None
-        count = sum(count)
-        
-        search_stats ={
-            'keyword':keyword,
-            'count':count,
-            'min_date': min_date.strftime('%Y-%m-%d %H:%M:%S') if not min_date is None else None,
-            'max_date': max_date.strftime('%Y-%m-%d %H:%M:%S') if not max_date is None else None,
-            'max_id': max_id,
-            'search_date': pd.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            }
-
-        helpers.dict_to_sqlite(search_stats, 'latest_search', db_file)
-
-        
-    # stats and logging for iteration
+                client['windows_used'] += gaps.fill_gaps(
+                    ts, rows, pages, writer, store, max_pages - n_pages if max_pages else None,
+                    keys=keys, base_url=api_url, pbar=pbar)
+            except Exception as e:
+                # the gaps stay for the next visit
+                logging.warning('Worker stopped on the gaps of: ' + keyword)
+                logging.warning(str(e))
+                client['error'] = e
+                break
+
+
+def search_pool(keywords, store, writer, budget=None, max_pages=None):
+    '''
+    Search keywords with one worker thread per credential set
+    and one thread processing the pages they fetch.
+    Keywords are searched in the given order, at most max_pages
+    per keyword, gaps included.
+    Returns a dict per worker with its TwitterSearch client,
+    windows used and the error that stopped it, if any.
+    '''
+    store.load_max_ids()
+    gap_rows = gaps.plan_gaps(store, keywords)
+    tasks = queue.Queue()
+    for keyword in keywords:
+        tasks.put(keyword)
+
+    clients = []
+    pbar = tqdm(total=len(keywords))
+    pages = pipeline.Pipeline(idle=(functools.partial(flush, writer, store),))
+    workers = [threading.Thread(target=search_worker,
+                                args=(keys, tasks, pages, store, writer, pbar, clients, budget,
+                                      max_pages, gap_rows),
+                                daemon=True)
+               for keys in twitter_keys]
+    try:
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    finally:
+        pbar.close()
+        pages.close()
+        # keyword stats of the cycle in one transaction
+        flush(writer, store)
+
+    errors = [i['error'] for i in clients if i['error'] is not None]
+    if len(errors) == len(clients):
+        # nobody could search, let the main loop back off
+        # and resume from the checkpoint
+        raise errors[-1]
+    store.end_cycle()
+    if not tasks.empty() and not budget:
+        logging.warning('{:d} keywords left unsearched.'.format(tasks.qsize()))
+    return clients
+
+
+def write_iteration_stats(iteration_stats, start, store, writer):
+    '''
+    Add timing and de-duplication stats to a row of
+    the iterations table, write and log it.
+    '''
     end = time.time()
     total_time = round((end-start)/60)
+    iteration_stats['start_time'] = helpers.format_date(start)
+    iteration_stats['duration_min'] = total_time
+    if writer.seen is not None:
+        hits, misses = writer.seen.pop_stats()
+        iteration_stats['dedup_hits'] = hits
+        iteration_stats['dedup_misses'] = misses
+        logging.info('Duplicate tweets skipped: {:d} of {:d}'.format(hits, hits+misses))
+    store.write_iteration(iteration_stats)
+
+    logging.info('Total number of windows: ' + str(iteration_stats['windows_used']))
+    logging.info('Total time (min): ' + str(total_time))
+    logging.info('Total tweets got: ' + str(iteration_stats['tweets_got']))
+
+
+def twitter_search(store, writer, keywords_file, max_pages=None):
+
+    start = time.time()
+    
+    keywords = load_keywords(store, keywords_file)
+    keywords = resume_cycle(keywords, store)
+
+    clients = search_pool(keywords, store, writer, max_pages=max_pages)
+
+    # stats and logging for iteration
+    iteration_stats={
+        'keywords': len(keywords),
+        'tweets_got': sum([i['ts'].get_statistics()[1] for i in clients if i['ts']]),
+        'queries_submitted': queries_submitted(clients),
+        'windows_used': sum([i['windows_used'] for i in clients]),
+        'mode': 'keyword',
+        }
+    write_iteration_stats(iteration_stats, start, store, writer)
+
+
+def twitter_search_adaptive(store, writer, keywords_file,
+                            budget=scheduler.WINDOW_REQUESTS, max_age=6, max_pages=None):
+    '''
+    Search keywords in order of expected new tweets per query
+    until the request budget is spent. Keywords not searched for
+    max_age hours are always polled first.
+    The budget is per credential set.
+    '''
+    start = time.time()
+
+    keywords = load_keywords(store, keywords_file)
+    keywords = resume_cycle(keywords, store)
+
+    scheduled = list(scheduler.schedule(keywords, store.db_file, max_age=timedelta(hours=max_age)))
+    clients = search_pool(scheduled, store, writer,
+                          budget=budget*len(twitter_keys), max_pages=max_pages)
+
+    # stats and logging for iteration
+    iteration_stats={
+        'keywords': len(keywords),
+        'tweets_got': sum([i['ts'].get_statistics()[1] for i in clients if i['ts']]),
+        'queries_submitted': queries_submitted(clients),
+        'windows_used': sum([i['windows_used'] for i in clients]),
+        'mode': 'adaptive',
+        }
+    write_iteration_stats(iteration_stats, start, store, writer)
+
+
+def twitter_search_async(store, writer, keywords_file, concurrency=4, max_pages=None):
+    '''
+    Search one query per keyword with the asyncio client, keeping
+    concurrency paginations in flight per credential set, at most
+    max_pages per keyword, gaps included.
+    '''
+    start = time.time()
+
+    keywords = load_keywords(store, keywords_file)
+    keywords = resume_cycle(keywords, store)
+
+    store.load_max_ids()
+    since_ids, cursors, resumed = {}, {}, {}
+    for keyword in keywords:
+        since_ids[keyword], cursors[keyword], keyword_stats = resume_keyword(store, keyword)
+        if cursors[keyword]:
+            resumed[keyword] = keyword_stats
+    gap_rows = gaps.plan_gaps(store, keywords)
+    stats = {}
+    pbar = tqdm(total=len(keywords))
+
+    pages = pipeline.Pipeline(idle=(functools.partial(flush, writer, store),))
+
+    def on_page(keyword, tweets, gap):
+        if gap is not None:
+            pages.submit(gaps.gap_page, tweets, writer, store, gap)
+            return
+        if keyword not in stats:
+            stats[keyword] = resumed.get(keyword) or helpers.KeywordStats()
+        pages.submit(process_page, tweets, writer, stats[keyword], store,
+                     keyword, since_ids[keyword])
+
+    def on_done(keyword, gap, cursor):
+        if gap is not None:
+            pages.submit(gaps.gap_done, store, gap, cursor)
+            return
+        pages.submit(keyword_done, keyword, since_ids.get(keyword), stats[keyword], store, cursor)
+        pbar.set_description("Processing {:10}".format(keyword))
+        pbar.update(1)
+
+    try:
+        clients = asyncio.run(async_search.search_keywords(
+            twitter_keys, keywords, since_ids, on_page, on_done,
+            base_url=api_url, concurrency=concurrency, max_ids=cursors,
+            max_pages=max_pages, gaps=gap_rows))
+    finally:
+        pbar.close()
+        pages.close()
+        flush(writer, store)
+    store.end_cycle()
+
+    # stats and logging for iteration
     iteration_stats={
-        'start_time': pd.to_datetime(start, unit='s').strftime('%Y-%m-%d %H:%M:%S'),
-        'duration_min': total_time,
         'keywords': len(keywords),
+        'tweets_got': sum([i.get_statistics()[1] for i in clients]),
+        'queries_submitted': sum([i.get_statistics()[0] for i in clients]),
+        'windows_used': sum([i.windows for i in clients]),
+        'mode': 'async',
+        }
+    write_iteration_stats(iteration_stats, start, store, writer)
+
+
+def twitter_search_batched(store, writer, keywords_file, max_pages=None):
+    '''
+    Search with least frequent keywords combined into OR-queries.
+    Queries come from helpers.generate_tso, results are split back
+    per keyword by helpers.submit_tso. A query gets at most max_pages,
+    the gaps of its keywords are searched one keyword at a time
+    after the queries, max_pages per keyword.
+    '''
+    ts = get_ts(twitter_keys[0])
+
+    start = time.time()
+    window_count = 1
+
+    keywords = load_keywords(store, keywords_file)
+    # keywords done before a crash are skipped, OR-queries in flight start over
+    keywords = resume_cycle(keywords, store)
+    # tweets are split back per keyword with one automaton for the cycle
+    keyword_matcher = matcher.KeywordMatcher(keywords)
+    gap_rows = gaps.plan_gaps(store, keywords)
+
+    keywords_done = 0
+    pages = pipeline.Pipeline(idle=(functools.partial(flush, writer, store),))
+    pbar = tqdm(helpers.generate_tso(keywords, store.db_file), unit='query')
+    try:
+        for tso in pbar:
+            pbar.set_description("Processing {:5d} keywords".format(keywords_done))
+            pbar.refresh()
+
+            n_keywords, windows = helpers.submit_tso(tso, ts, pages, writer, store,
+                                                     keys=twitter_keys[0], base_url=api_url,
+                                                     keyword_matcher=keyword_matcher,
+                                                     max_pages=max_pages)
+            window_count += windows
+            keywords_done += n_keywords
+        for keyword, rows in gap_rows.items():
+            window_count += gaps.fill_gaps(ts, rows, pages, writer, store, max_pages,
+                                           keys=twitter_keys[0], base_url=api_url)
+    finally:
+        pages.close()
+        # keyword stats of the cycle in one transaction
+        flush(writer, store)
+    store.end_cycle()
+
+    # stats and logging for iteration
+    # baseline is one query per keyword in the keyword mode
+    queries = ts.get_statistics()[0]
+    queries_saved = keywords_done - queries
+    iteration_stats={
+        'keywords': keywords_done,
         'tweets_got': ts.get_statistics()[1],
-        'queries_submitted': ts.get_statistics()[0],
+        'queries_submitted': queries,
         'windows_used': window_count,
+        'mode': 'batched',
+        'queries_saved': queries_saved,
         }
-    helpers.dict_to_sqlite(iteration_stats, 'iterations', db_file)
+    write_iteration_stats(iteration_stats, start, store, writer)
+    logging.info('Queries saved: {:d} ({:d} queries for {:d} keywords)'.format(
+                 queries_saved, queries, keywords_done))
 
-    logging.info('Total number of windows: ' + str(window_count))
-    logging.info('Total time (min): ' + str(total_time))
-    logging.info('Total tweets got: ' + str(ts.get_statistics()[1]))
 
-    # close db file
-    c.close()
-    conn.close()
+def open_writer(args, suffix=''):
+    '''
+    Tweets file writer of the run, skipping tweets archived
+    in the last --dedup_days.
+    '''
+    # ids of archived tweets to skip duplicates
+    seen = None
+    if args.dedup_days:
+        seen = archive.SeenIndex(horizon_days=args.dedup_days)
+        seen.rebuild(args.output_dir)
+    fields = None
+    if args.fields_file:
+        fields = archive.compile_fields(archive.load_fields(args.fields_file))
+    # full copies of sampled tweets, next to the projected ones
+    raw = None
+    if args.raw_sample:
+        raw = archive.ArchiveWriter(os.path.join(args.output_dir, 'raw'),
+                                    codec=args.codec,
+                                    flush_bytes=int(args.flush_mb*1024**2),
+                                    flush_interval=args.flush_interval*60,
+                                    rotate_mb=args.rotate_mb,
+                                    suffix=suffix)
+    return archive.ArchiveWriter(args.output_dir,
+                                 codec=args.codec,
+                                 flush_bytes=int(args.flush_mb*1024**2),
+                                 flush_interval=args.flush_interval*60,
+                                 rotate_mb=args.rotate_mb,
+                                 seen=seen,
+                                 suffix=suffix,
+                                 fields=fields,
+                                 raw=raw,
+                                 raw_sample=args.raw_sample)
+
+
+def search_mode(args):
+    '''
+    Cycle function of --mode.
+    '''
+    if args.mode == 'batched':
+        return functools.partial(twitter_search_batched,
+                                 max_pages=args.max_pages)
+    elif args.mode == 'async':
+        return functools.partial(twitter_search_async,
+                                 concurrency=args.concurrency, max_pages=args.max_pages)
+    elif args.mode == 'adaptive':
+        return functools.partial(twitter_search_adaptive,
+                                 budget=args.budget, max_age=args.max_age,
+                                 max_pages=args.max_pages)
+    return functools.partial(twitter_search,
+                             max_pages=args.max_pages)
+
+
+def search_loop(search, store, writer, keywords_file):
+    '''
+    Run search cycles until terminated, closes the writer and store.
+    '''
+    counter = 1
+    try:
+        while True:
+            logging.info('Started cycle {:d}'.format(counter))
+            try:
+                search(store=store,
+                       writer=writer,
+                       keywords_file=keywords_file)
+                # tweets are on disk at the end of every cycle
+                writer.flush()
+                # the coordinator rolls up the files of its workers
+                if store.shard is None:
+                    rollup.rollup_cycle(store.db_file, writer.output_dir, keywords_file)
+            except TwitterSearch.TwitterSearchException as e:
+                logging.warn('TwitterSearchException')
+                logging.warn(str(e))
+                logging.warn('Waiting for the rate limit reset.')
+                helpers.wait_for_reset({}, keys=twitter_keys[0], base_url=api_url)
+            except Exception as e:
+                logging.warn('Something unexpected happened.')
+                logging.warn(str(e))
+                pause.minutes(5)
+            counter += 1
+            logging.info('Pausing for 3 min, safe to terminate.')
+            logging.info('ctrl+C')
+            try:
+                pause.minutes(3)
+            except:
+                logging.info('Bye bye...')
+                sys.exit()
+            print()
+    finally:
+        writer.close()
+        store.close()
+        if publish.publisher is not None:
+            publish.publisher.close()
 
 
 if __name__ == "__main__":
@@ -160,8 +558,9 @@ if __name__ == "__main__":
     # 
     parser = argparse.ArgumentParser(description='Twitter scraper using Twitter search API.')
 
-    parser.add_argument('--keys', default='/data/twitter_keys',
-                        help = 'Specify the .py file with twitter access keys and tokens.')
+    parser.add_argument('--keys', default=['/data/twitter_keys'], nargs='+',
+                        help = 'Specify the .py file with twitter access keys and tokens. '
+                               'Several files run one search worker per file.')
     parser.add_argument('--loglevel', default='info',
                         choices=['info', 'debug', 'warn'],
                         help='The logging level for module logging.')
@@ -171,24 +570,156 @@ if __name__ == "__main__":
                         help='Folder for storing downloaded tweets.')
     parser.add_argument('--keywords_file', default='/data/keywords.txt',
                         help='Load keywords from a file.')
-    args = parser.parse_args()
+    parser.add_argument('--mode', default='keyword',
+                        choices=['keyword', 'batched', 'adaptive', 'async'],
+                        help='Search one query per keyword or combine '
+                             'least frequent keywords into OR-queries or '
+                             'poll keywords by expected new tweets (adaptive) '
+                             'or one query per keyword with the asyncio client.')
+    parser.add_argument('--budget', default=scheduler.WINDOW_REQUESTS, type=int,
+                        help='Requests per cycle in the adaptive mode.')
+    parser.add_argument('--max_age', default=6, type=float,
+                        help='Hours after which a keyword is always polled '
+                             'in the adaptive mode.')
+    parser.add_argument('--concurrency', default=4, type=int,
+                        help='Paginations in flight per key file in the async mode.')
+    parser.add_argument('--max_pages', default=None, type=int,
+                        help='Pages per keyword (per OR-query in the batched mode) '
+                             'and cycle, the rest is left as a gap searched in later '
+                             'cycles. All pages by default.')
+    parser.add_argument('--api_url', default=async_search.API_URL,
+                        help='Twitter API url, ex. a local fake_twitter server.')
+    parser.add_argument('--codec', default='bz2',
+                        choices=sorted(archive.CODECS),
+                        help='Compression of the tweets files, zstd needs '
+                             'the zstandard package.')
+    parser.add_argument('--flush_mb', default=8, type=float,
+                        help='Write buffered tweets after this many MB.')
+    parser.add_argument('--flush_interval', default=5, type=float,
+                        help='Write buffered tweets at least every this many minutes.')
+    parser.add_argument('--rotate_mb', default=None, type=float,
+                        help='Start a new tweets file after this many MB, '
+                             'files always rotate at midnight.')
+    parser.add_argument('--dedup_days', default=8, type=float,
+                        help='Skip tweets archived in the last days, 0 to '
+                             'archive every copy.')
+    parser.add_argument('--fields_file', default=None,
+                        help='Archive only the fields of the tweets listed in this '
+                             'file, one JSON path per line, ex.: user.screen_name.')
+    parser.add_argument('--raw_sample', default=0.0, type=float,
+                        help='Share of tweets also archived in full to '
+                             '--output_dir/raw, with --fields_file.')
+    parser.add_argument('--metrics_port', default=None, type=int,
+                        help='Serve Prometheus metrics on this port at /metrics.')
+    parser.add_argument('--metrics_host', default='127.0.0.1',
+                        help='Interface the metrics are served on, 0.0.0.0 for all, '
+                             'ex. in a container.')
+    parser.add_argument('--json_log', action='store_true',
+                        help='Log a json line per keyword search.')
+    parser.add_argument('--publish', default=None,
+                        help='Publish every fetched page as a json line to the readers '
+                             'connected to this unix socket path or host:port.')
+    parser.add_argument('--publish_buffer_mb', default=16, type=float,
+                        help='MB of pages buffered per reader.')
+    parser.add_argument('--publish_policy', default='drop_oldest', choices=publish.POLICIES,
+                        help='What a full reader buffer does: drop its oldest pages, '
+                             'drop the new page or disconnect the reader.')
 
-    # Import twitter keys as variables from .py file.
-    # Default twitter_keys.py.
-    try:
-        module_dir, module_file = os.path.split(args.keys)
-        module_name, module_ext = os.path.splitext(module_file)
-        sys.path.append(module_dir)
-        # sys.path.append('/data')
-        twitter_keys = __import__(module_name)
-        twitter_keys.consumer_key
-        twitter_keys.consumer_secret
-        twitter_keys.access_token
-        twitter_keys.access_token_secret
-    except Exception as e:
-        logging.critical('Check twitter key file.')
-        logging.critical(str(e))
-        sys.exit()
+    subparsers = parser.add_subparsers(dest='command',
+                                       help='Run the search loop without a command.')
+    read_parser = subparsers.add_parser('read',
+                                        help='Print archived tweets from --output_dir as json lines.')
+    read_parser.add_argument('--start', type=reader.parse_date,
+                             help='First date of tweets, YYYY-MM-DD.')
+    read_parser.add_argument('--end', type=reader.parse_date,
+                             help='Last date of tweets, YYYY-MM-DD.')
+    read_parser.add_argument('--keyword',
+                             help='Only tweets with this cashtag or hashtag, ex.: $AAPL.')
+    read_parser.add_argument('--limit', type=int,
+                             help='Stop after this many tweets.')
+    read_parser.add_argument('--build_index', action='store_true',
+                             help='Index files written without an index first.')
+    export_parser = subparsers.add_parser('export',
+                                          help='Export past days of --output_dir to parquet, '
+                                               'needs the pyarrow package.')
+    export_parser.add_argument('--export_dir', default='/data/parquet',
+                               help='Folder for the date partitioned parquet files.')
+    export_parser.add_argument('--row_group_size', default=50000, type=int,
+                               help='Tweets per parquet row group.')
+    backfill_parser = subparsers.add_parser('backfill',
+                                            help='Search keywords back to the 7 day horizon of '
+                                                 'the search API in day slices.')
+    backfill_parser.add_argument('--keyword', nargs='+',
+                                 help='Keywords to backfill, else all keywords.')
+    backfill_parser.add_argument('--days', default=backfill.HORIZON_DAYS, type=int,
+                                 help='Days back to search.')
+    backfill_parser.add_argument('--parallel', default=2, type=int,
+                                 help='Slices in flight per key file.')
+    coordinate_parser = subparsers.add_parser('coordinate',
+                                              help='Run one worker process per key file, each '
+                                                   'searching a hash partition of the keywords.')
+    coordinate_parser.add_argument('--heartbeat', default=coordinator.HEARTBEAT_SEC, type=float,
+                                   help='Seconds between worker heartbeats.')
+    coordinate_parser.add_argument('--restart_delay', default=60, type=float,
+                                   help='Seconds before a dead worker is restarted, '
+                                        'doubled on every restart up to 15 min.')
+    universe_parser = subparsers.add_parser('universe',
+                                            help='Apply market listings and delistings to the '
+                                                 'keywords table now.')
+    universe_parser.add_argument('--markets', default=universe.MARKETS, nargs='+',
+                                 help='Netfonds market codes.')
+    universe_parser.add_argument('--ttl', default=0, type=float,
+                                 help='Hours a cached market list is reused, '
+                                      '0 always asks the site.')
+    universe_parser.add_argument('--market_url', default=universe.MARKET_URL,
+                                 help='Market page url without the market code, '
+                                      'ex. a local fake_netfonds server.')
+    merge_parser = subparsers.add_parser('merge',
+                                         help='Merge the shard files of past days in '
+                                              '--output_dir into one file per day.')
+    compact_parser = subparsers.add_parser('compact',
+                                           help='Rewrite the tweets files of every past day in '
+                                                '--output_dir into one file of large streams.')
+    compact_parser.add_argument('--workers', default=os.cpu_count(), type=int,
+                                help='Days compacted at the same time.')
+    compact_parser.add_argument('--block_mb', default=32, type=float,
+                                help='Uncompressed MB per compressed stream.')
+    compact_parser.add_argument('--run_mb', default=64, type=float,
+                                help='MB of tweets sorted in memory at a time, per worker.')
+    compact_parser.add_argument('--sort', action='store_true',
+                                help='Order the tweets of a day by id.')
+    compact_parser.add_argument('--dedup', action='store_true',
+                                help='Keep every tweet id of a day once, sorts too.')
+    compact_parser.add_argument('--force', action='store_true',
+                                help='Compact days which were compacted before again.')
+    rollup_parser = subparsers.add_parser('rollup',
+                                          help='Count the tweets archived in --output_dir per keyword '
+                                               'and minute, hour and day now, the search loop '
+                                               'does it after every cycle.')
+    rollup_parser.add_argument('--minute_days', default=rollup.RETENTION_DAYS['minute'], type=float,
+                               help='Days the minute counts are kept.')
+    rollup_parser.add_argument('--hour_days', default=rollup.RETENTION_DAYS['hour'], type=float,
+                               help='Days the hour counts are kept, day counts are kept for ever.')
+    rollup_parser.add_argument('--searches_days', default=0, type=float,
+                               help='Delete the rows of the searches table older than this many '
+                                    'days, 0 keeps all (default).')
+    series_parser = subparsers.add_parser('series',
+                                          help='Print the tweets of a keyword per minute, hour '
+                                               'or day as csv.')
+    series_parser.add_argument('--keyword', required=True,
+                               help='Keyword as in the keywords, ex.: $AAPL.')
+    series_parser.add_argument('--start', type=reader.parse_date, required=True,
+                               help='First day, YYYY-MM-DD.')
+    series_parser.add_argument('--end', type=reader.parse_date, required=True,
+                               help='Last day, YYYY-MM-DD.')
+    series_parser.add_argument('--resolution', choices=sorted(rollup.RESOLUTIONS),
+                               help='Bucket size, the finest one kept back to --start by default.')
+    gaps_parser = subparsers.add_parser('gaps',
+                                        help='Print the ids left unsearched per keyword by '
+                                             'searches cut short at --max_pages.')
+    gaps_parser.add_argument('--limit', default=50, type=int,
+                             help='Keywords printed, most hours of tweets first.')
+    args = parser.parse_args()
 
     # logging setup
     if args.loglevel == 'info':    loglevel = logging.INFO
@@ -198,36 +729,96 @@ if __name__ == "__main__":
     datefmt = "%Y-%m-%d %I:%M:%S"
     logging.basicConfig(level=loglevel, format=logformat, datefmt=datefmt)
 
+    if args.command == 'read':
+        reader.read_command(args)
+        sys.exit()
+    if args.command == 'merge':
+        helpers.check_db(args.db_file)
+        coordinator.merge_command(args)
+        sys.exit()
+    if args.command == 'compact':
+        helpers.check_db(args.db_file)
+        try:
+            compact.compact_command(args)
+        except ValueError as e:
+            logging.critical(str(e))
+        sys.exit()
+    if args.command in ['rollup', 'series']:
+        helpers.check_db(args.db_file)
+        if args.command == 'rollup':
+            rollup.rollup_command(args)
+        else:
+            rollup.series_command(args)
+        sys.exit()
+    if args.command == 'gaps':
+        helpers.check_db(args.db_file)
+        gaps.gaps_command(args)
+        sys.exit()
+    if args.command == 'universe':
+        helpers.check_db(args.db_file)
+        universe.sync_keywords(args.db_file, args.markets, args.market_url, args.ttl*3600)
+        sys.exit()
+    if args.command == 'export':
+        # pyarrow is only needed here
+        import export
+        try:
+            export.export_command(args)
+        except ValueError as e:
+            logging.critical(str(e))
+        sys.exit()
+
+    api_url = args.api_url
+    metrics.json_log = args.json_log
+    if args.metrics_port is not None:
+        metrics.serve(args.metrics_port, args.metrics_host)
+    if args.publish and args.command != 'coordinate':
+        publish.start(args.publish, int(args.publish_buffer_mb*1024**2), args.publish_policy)
+
+    # Import twitter keys as variables from .py files.
+    # Default twitter_keys.py.
+    try:
+        twitter_keys = [helpers.load_keys(i) for i in args.keys]
+    except Exception as e:
+        logging.critical('Check twitter key file.')
+        logging.critical(str(e))
+        sys.exit()
+
     # check if all tables are created in the db file
     helpers.check_db(args.db_file)
+    store = stats_store.StatsStore(args.db_file)
 
+    if args.mode == 'async' and not async_search.load_aiohttp():
+        logging.critical('async mode needs the aiohttp package')
+        sys.exit()
+
+    if args.command == 'coordinate':
+        coordinator.coordinate(args, store)
+        store.close()
+        sys.exit()
+
+    # tweets file writer kept open for the whole run
+    try:
+        # own files next to the ones of the search loop
+        writer = open_writer(args, suffix='_backfill' if args.command == 'backfill' else '')
+    except ValueError as e:
+        logging.critical(str(e))
+        sys.exit()
+
+    # close the writer on docker stop
+    def terminate(signum, frame):
+        logging.info('SIGTERM, closing...')
+        sys.exit()
+    signal.signal(signal.SIGTERM, terminate)
+
+    if args.command == 'backfill':
+        try:
+            backfill.backfill_command(args, twitter_keys, store, writer)
+        finally:
+            writer.close()
+            store.close()
+        sys.exit()
 
     # 
     # Main loop
     # 
-    counter = 1
-    while True:
-        logging.info('Started cycle {:d}'.format(counter))
-        try:
-            twitter_search(db_file=args.db_file, 
-                           output_dir=args.output_dir,
-                           keywords_file=args.keywords_file)
-        except TwitterSearch.TwitterSearchException as e:
-            logging.warn('TwitterSearchException')
-            logging.warn(str(e))
-            logging.warn('Pausing for 15 min.')
-            pause.minutes(15)
-        except Exception as e:
-            logging.warn('Something unexpected happened.')
-            logging.warn(str(e))
-            pause.minutes(5)
-        counter += 1
-        logging.info('Pausing for 3 min, safe to terminate.')
-        logging.info('ctrl+C')
-        try:
-            pause.minutes(3)
-        except:
-            logging.info('Bye bye...')
-            sys.exit()
-        print()
-
+    search_loop(search_mode(args), store, writer, args.keywords_file)
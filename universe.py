@@ -0,0 +1,155 @@
+import json
+import time
+import sqlite3
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+MARKET_URL = 'http://www.netfonds.no/quotes/kurs.php?exchange='
+MARKETS = ['O', 'N', 'A']
+TICKERS_XPATH = "//div[@class='hcontent']//tr/td[1]/a/@href"
+# parsed market lists are reused for this long
+TTL_SEC = 24*3600
+TIMEOUT_SEC = 30
+# tickers which conflict with twitter keywords
+BLACK_LISTED = ['OR']
+# source of the keywords added by the loader in the keywords table
+SOURCE = 'netfonds'
+
+
+def http_session(pool_size):
+    '''
+    Pooled session, retrying connection errors and 5xx replies.
+    '''
+    retry = Retry(total=3, backoff_factor=1, status_forcelist=[500, 502, 503, 504])
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def parse_market(text):
+    '''
+    Tickers of a market page, ex.: AAPL.O
+    '''
+    # lxml is only needed here
+    from lxml import html
+    tree = html.fromstring(text)
+    return sorted(set([i.split('=')[1] for i in tree.xpath(TICKERS_XPATH)]))
+
+
+def ticker_keywords(tickers):
+    '''
+    Cashtags of tickers, AAPL.O -> $AAPL
+    '''
+    tickers = [i.split('.')[0] for i in tickers]
+    return set(['$' + i for i in tickers if i and i not in BLACK_LISTED])
+
+
+def load_cache(conn):
+    '''
+    Cached market lists, market -> row.
+    '''
+    c = conn.execute('SELECT market, etag, last_modified, fetched, tickers FROM markets')
+    cache = {row[0]: {'etag': row[1], 'last_modified': row[2], 'fetched': row[3],
+                      'tickers': json.loads(row[4])}
+             for row in c.fetchall()}
+    c.close()
+    return cache
+
+
+def fetch_market(session, url, cached):
+    '''
+    Fetch a market page, conditional on the ETag or date of the
+    cached list. Returns the cache row, the cached tickers
+    if the page did not change.
+    '''
+    headers = {}
+    if cached and cached['etag']:
+        headers['If-None-Match'] = cached['etag']
+    if cached and cached['last_modified']:
+        headers['If-Modified-Since'] = cached['last_modified']
+    response = session.get(url, headers=headers, timeout=TIMEOUT_SEC)
+    if response.status_code == 304 and cached:
+        return dict(cached, fetched=time.time())
+    response.raise_for_status()
+    return {'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'fetched': time.time(),
+            'tickers': parse_market(response.text)}
+
+
+def load_markets(db_file, markets=MARKETS, market_url=MARKET_URL, ttl=TTL_SEC):
+    '''
+    Ticker lists of the markets, market -> list, None for a market
+    without a list. Lists fetched within ttl come from the cache in
+    the markets table, the others are fetched concurrently over one
+    pooled session. A market which fails keeps its cached list.
+    '''
+    with sqlite3.connect(db_file) as conn:
+        cache = load_cache(conn)
+    now = time.time()
+    due = [m for m in markets if m not in cache or now - cache[m]['fetched'] >= ttl]
+
+    fetched = {}
+    if due:
+        session = http_session(len(due))
+        with ThreadPoolExecutor(max_workers=len(due)) as pool:
+            futures = {m: pool.submit(fetch_market, session, market_url + m, cache.get(m))
+                       for m in due}
+            for market, future in futures.items():
+                try:
+                    fetched[market] = future.result()
+                except Exception as e:
+                    logging.warning('Could not load market ' + market)
+                    logging.warning(str(e))
+        session.close()
+
+    if fetched:
+        with sqlite3.connect(db_file) as conn:
+            conn.executemany('INSERT OR REPLACE INTO markets (market, etag, last_modified, fetched, tickers) '
+                             'VALUES (?, ?, ?, ?, ?)',
+                             [(m, r['etag'], r['last_modified'], r['fetched'], json.dumps(r['tickers']))
+                              for m, r in fetched.items()])
+        logging.debug('Markets fetched: {}'.format(', '.join(sorted(fetched))))
+    cache.update(fetched)
+    return {m: cache[m]['tickers'] if m in cache else None for m in markets}
+
+
+def sync_keywords(db_file, markets=MARKETS, market_url=MARKET_URL, ttl=TTL_SEC):
+    '''
+    Apply listings and delistings of the markets to the keywords
+    table. Only keywords added by the loader are removed, and only
+    when every market has a list. Listed keywords which were there
+    before are taken over. Returns the keywords added and removed.
+    '''
+    lists = load_markets(db_file, markets, market_url, ttl)
+    listed = set()
+    for tickers in lists.values():
+        listed.update(ticker_keywords(tickers or []))
+    # an empty page is more likely a broken page than a closed market
+    complete = all(lists.values())
+
+    with sqlite3.connect(db_file) as conn:
+        current = dict(conn.execute('SELECT keyword, source FROM keywords').fetchall())
+        added = sorted(listed - set(current))
+        taken = sorted([k for k in listed if k in current and current[k] is None])
+        removed = []
+        if complete:
+            removed = sorted([k for k, s in current.items() if s == SOURCE and k not in listed])
+        conn.executemany('INSERT INTO keywords (keyword, source) VALUES (?, ?)',
+                         [(k, SOURCE) for k in added])
+        conn.executemany('UPDATE keywords SET source=? WHERE keyword=?', [(SOURCE, k) for k in taken])
+        conn.executemany('DELETE FROM keywords WHERE keyword=?', [(k,) for k in removed])
+
+    if not complete:
+        logging.warning('Markets without a list: {}, no keywords removed.'.format(
+                        ', '.join([m for m, t in lists.items() if not t])))
+    if added or removed:
+        logging.info('Keywords from markets: {:d} added, {:d} removed.'.format(len(added), len(removed)))
+    return added, removed